@@ -1,10 +1,26 @@
 from yacv.grammar import *
 from yacv.utils import *
+from yacv.asyncparse import *
+from yacv.tokenids import *
+from yacv.treelayout import *
+from yacv.layoutcache import *
+from yacv.treeexport import *
 
 from yacv.abstractsyntaxtree import *
 from yacv.ll1 import *
 from yacv.lr import *
+from yacv.earley import *
+from yacv.replay import *
+from yacv.keyframes import *
+from yacv.tableexport import *
+from yacv.server import *
+from yacv.bench import *
+from yacv.build import *
 
-from yacv.mobjects import *
-from yacv.vis import *
+try:
+    from yacv.mobjects import *
+    from yacv.vis import *
+except ImportError as e:
+    # manim is not installed, only the parsers and exporters are available
+    pass
 
@@ -21,8 +21,49 @@ class AbstractSyntaxTree(object):
                 self.desc = []
                 self.prod_id = None
 
+    def to_dict(self):
+        # Plain (JSON friendly) nested dicts, built without recursion
+        ret = {'symbol': self.root, 'prod_id': self.prod_id, 'children': []}
+        stack = [(self, ret)]
+        while stack:
+            tree, node = stack.pop(-1)
+            for d in tree.desc:
+                child = {'symbol': d.root, 'prod_id': d.prod_id, 'children': []}
+                node['children'].append(child)
+                stack.append((d, child))
+        return ret
+
     def __str__(self):
         return '{}->{}'.format(self.root, pformat(self.desc))
 
     def __repr__(self):
         return str(self)
+
+def wrap_units(tree, elided, prods):
+    # Puts back the nodes of unit productions skipped by the LR parser
+    # (`LRParser.bypass_units`), `elided` lists them innermost first
+    for prod_id in elided:
+        node = AbstractSyntaxTree(prods[prod_id].lhs)
+        node.prod_id = prod_id
+        node.desc = [tree]
+        tree = node
+    return tree
+
+def restore_units(tree, prods):
+    # Returns the full tree for a tree parsed with `lazy_units`: every node
+    # that recorded skipped unit productions gets them back, without
+    # recursion. Trees without such nodes are returned as they are
+    def expand(node):
+        elided = getattr(node, 'units', None)
+        if not elided:
+            return node
+        node.units = None
+        return wrap_units(node, elided, prods)
+    root = expand(tree)
+    stack = [tree]
+    while stack:
+        node = stack.pop(-1)
+        for i, child in enumerate(node.desc):
+            node.desc[i] = expand(child)
+            stack.append(child)
+    return root
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from yacv.utils import YACVError
+
+# The parsers are written as generators (`parse_steps`) that yield whenever
+# they need the next lookahead and expect the token to be sent back. The same
+# core is driven by a list in `parse()`, and by async token sources here, so
+# a parse suspends while the lexer/socket has nothing to offer and many
+# streams can be parsed concurrently on one event loop. When the source runs
+# out without a trailing '$' one is sent on its behalf
+
+def start_steps(steps):
+    # Runs the generator up to its first request for a token. Returns
+    # (done, tree)
+    try:
+        next(steps)
+    except StopIteration as e:
+        return True, e.value
+    return False, None
+
+def send_token(steps, token):
+    try:
+        steps.send(token)
+    except StopIteration as e:
+        return True, e.value
+    return False, None
+
+def end_of_input(steps, ended):
+    # The source is exhausted, the parser gets '$' once and must finish on it
+    if not ended:
+        done, tree = send_token(steps, '$')
+        if done:
+            return tree
+    raise YACVError('Unexpected end of input')
+
+def feed_tokens(steps, tokens):
+    # Synchronous driver, `tokens` is any iterable of terminals
+    try:
+        done, tree = start_steps(steps)
+        if done:
+            return tree
+        ended = False
+        for token in tokens:
+            done, tree = send_token(steps, token)
+            if done:
+                return tree
+            ended = token == '$'
+            if ended:
+                break
+        return end_of_input(steps, ended)
+    finally:
+        steps.close()
+
+async def afeed_tokens(steps, tokens):
+    # Asynchronous driver, `tokens` is an async iterable (or a plain iterable)
+    # of terminals. Cancelling the awaiting task closes both the parser and
+    # an async generator source
+    try:
+        done, tree = start_steps(steps)
+        if done:
+            return tree
+        ended = False
+        if hasattr(tokens, '__aiter__'):
+            async for token in tokens:
+                done, tree = send_token(steps, token)
+                if done:
+                    return tree
+                ended = token == '$'
+                if ended:
+                    break
+        else:
+            for token in tokens:
+                done, tree = send_token(steps, token)
+                if done:
+                    return tree
+                ended = token == '$'
+                if ended:
+                    break
+                # Let the other streams run between tokens
+                await asyncio.sleep(0)
+        return end_of_input(steps, ended)
+    finally:
+        steps.close()
+        aclose = getattr(tokens, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+
+async def parse_async(parser, tokens, timeout=None, actions=None, \
+        recognize=False):
+    # Parses the tokens produced by `tokens` with any yacv parser. `timeout`
+    # (seconds) bounds the whole stream, asyncio.TimeoutError is raised when
+    # it runs out. `actions` and `recognize` are passed to `parse_steps`
+    coro = afeed_tokens(parser.parse_steps(actions, recognize), tokens)
+    if timeout is None:
+        return await coro
+    return await asyncio.wait_for(coro, timeout)
+
+async def parse_streams(parser, streams, timeout=None, return_exceptions=True):
+    # Parses every stream concurrently, each with its own `timeout`. Results
+    # come back in the order of `streams`, failed parses are returned as the
+    # exception instance unless `return_exceptions` is False
+    log = logging.getLogger('yacv')
+    tasks = [asyncio.ensure_future(parse_async(parser, s, timeout)) \
+            for s in streams]
+    try:
+        results = await asyncio.gather(*tasks, \
+                return_exceptions=return_exceptions)
+    finally:
+        for task in tasks:
+            task.cancel()
+    failed = sum(isinstance(x, BaseException) for x in results)
+    log.debug('Parsed {} streams, {} failed'.format(len(results), failed))
+    return results
@@ -0,0 +1,346 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import defaultdict
+from yacv.utils import YACVError, setup_logger, get_manim_config
+from yacv.constants import YACV_MANIM_RUN_TIME, YACV_MANIM_WAIT_TIME
+
+# `yacv bench` runs the parsing visualizers of one or more configs and
+# reports where the time goes. Time is split (exclusively, nested calls are
+# not counted twice) into components:
+#   parser    : building the parser
+#   trace     : computing the parse trace
+#   graph     : building the Graphviz graph of the current tree
+#   layout    : laying out that graph (dot/tidy, through the layout cache)
+#   tex       : building Tex/Text mobjects (LaTeX compilation, SVG parsing)
+#   mobject   : the rest of GraphvizMobject/StackMobject construction
+#   animation : interpolating the animations (null renderer only)
+#   render    : playing the animations with manim, rasterization included
+#   encode    : writing frames to the movie
+#   other     : everything else in the scene
+# With the null renderer animations are interpolated at the video frame rate
+# but no frame is rasterized or written, which isolates yacv's own costs
+
+YACV_BENCH_COMPONENTS = ['parser', 'trace', 'graph', 'layout', 'tex', \
+        'mobject', 'animation', 'render', 'encode', 'other']
+
+class Profile(object):
+    def __init__(self, fps):
+        self.fps = fps
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.timers = []
+        self.frames = 0
+        self.steps = []
+        self.start_time = time.perf_counter()
+        self.last_time = self.start_time
+        self.last_frames = 0
+        self.last_times = {}
+
+    def start(self, component):
+        self.timers.append([component, time.perf_counter(), 0.0])
+
+    def stop(self):
+        component, start, children = self.timers.pop(-1)
+        elapsed = time.perf_counter() - start
+        self.times[component] += elapsed - children
+        self.calls[component] += 1
+        if self.timers:
+            self.timers[-1][2] += elapsed
+
+    def timed(self, component, fn):
+        profile = self
+        def wrapper(*args, **kwargs):
+            profile.start(component)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.stop()
+        return wrapper
+
+    def timed_class(self, component, cls):
+        # Subclass of a mobject class whose construction is timed. It keeps
+        # the name so that `LabelPool` keys don't change
+        profile = self
+        def __init__(self, *args, **kwargs):
+            profile.start(component)
+            try:
+                cls.__init__(self, *args, **kwargs)
+            finally:
+                profile.stop()
+        return type(cls.__name__, (cls,), {'__init__': __init__})
+
+    def begin_steps(self):
+        # Steps are timed from here, setup time is only in the totals
+        self.last_time = time.perf_counter()
+        self.last_frames = self.frames
+        self.last_times = dict(self.times)
+
+    def add_frames(self, seconds):
+        frames = max(1, int(round(seconds * self.fps)))
+        self.frames += frames
+        return frames
+
+    def step(self, actions):
+        now = time.perf_counter()
+        times = dict(self.times)
+        self.steps.append({
+            'step': len(self.steps),
+            'action': actions[0][0],
+            'size': len(actions),
+            'time': now - self.last_time,
+            'frames': self.frames - self.last_frames,
+            'components': {k: v - self.last_times.get(k, 0) \
+                    for k, v in times.items() if v - self.last_times.get(k, 0)}
+        })
+        self.last_time = now
+        self.last_frames = self.frames
+        self.last_times = times
+
+    def result(self):
+        wall = time.perf_counter() - self.start_time
+        components = {k: self.times.get(k, 0.0) \
+                for k in YACV_BENCH_COMPONENTS if k != 'other'}
+        components['other'] = max(0.0, wall - sum(components.values()))
+        return {
+            'wall': wall,
+            'frames': self.frames,
+            'components': components,
+            'calls': dict(self.calls),
+            'steps': self.steps
+        }
+
+class ProfiledScene(object):
+    # Mixed in front of a visualizer scene. Counts the frames of every play
+    # and wait, and with `null_render` replaces manim's rendering by a plain
+    # interpolation of the animations
+    null_render = False
+
+    def play(self, *animations, **kwargs):
+        run_time = kwargs.get('run_time')
+        if run_time is None:
+            run_time = max([getattr(a, 'run_time', YACV_MANIM_RUN_TIME) \
+                    for a in animations] or [YACV_MANIM_RUN_TIME])
+        frames = self.profile.add_frames(run_time)
+        if not self.null_render:
+            self.profile.start('render')
+            try:
+                return super().play(*animations, **kwargs)
+            finally:
+                self.profile.stop()
+        self.profile.start('animation')
+        try:
+            for a in animations:
+                a.run_time = run_time
+                setup_scene = getattr(a, '_setup_scene', None)
+                if setup_scene is not None:
+                    setup_scene(self)
+                a.begin()
+            for i in range(1, frames + 1):
+                for a in animations:
+                    a.interpolate(i / frames)
+            for a in animations:
+                a.finish()
+                a.clean_up_from_scene(self)
+        finally:
+            self.profile.stop()
+
+    def wait(self, duration=YACV_MANIM_WAIT_TIME, *args, **kwargs):
+        self.profile.add_frames(duration)
+        if self.null_render:
+            return
+        self.profile.start('render')
+        try:
+            return super().wait(duration, *args, **kwargs)
+        finally:
+            self.profile.stop()
+
+class patched(object):
+    # Replaces attributes for the duration of a `with` block
+    def __init__(self, changes):
+        self.changes = changes
+
+    def __enter__(self):
+        self.saved = [(obj, name, getattr(obj, name)) \
+                for obj, name, _ in self.changes]
+        for obj, name, value in self.changes:
+            setattr(obj, name, value)
+        return self
+
+    def __exit__(self, *exc):
+        for obj, name, value in reversed(self.saved):
+            setattr(obj, name, value)
+        return False
+
+def find_configs(paths):
+    ret = []
+    for path in paths:
+        if os.path.isdir(path):
+            for fname in sorted(os.listdir(path)):
+                if fname.endswith('.yml') or fname.endswith('.yaml'):
+                    ret.append(os.path.join(path, fname))
+        else:
+            ret.append(path)
+    return ret
+
+def bench_config(config, null_render=True, quality='480p', save_dir=None):
+    # Runs the parsing visualizer of `config` once and returns the profile
+    try:
+        import yacv.vis as vis
+        import yacv.mobjects as mobjects
+    except ImportError as e:
+        raise YACVError('manim is needed to benchmark visualizations ({})' \
+                .format(e))
+    from yacv.yacv import parser_map, load_config
+    log = logging.getLogger('yacv')
+    args = load_config(config)
+    if args.parsing_algo == 'earley':
+        raise YACVError('Earley parsing has no step by step visualization')
+    colors = args.colors if hasattr(args, 'colors') else None
+    string = [x for x in args.string.split(' ') if x.strip()]
+    if string[-1] != '$':
+        string.append('$')
+    save_dir = save_dir or tempfile.mkdtemp(prefix='yacv-bench-')
+    name = os.path.splitext(os.path.basename(config))[0]
+    manim_config = get_manim_config(save_dir, name, quality)
+    if vis.manimce:
+        from manim import config as manimce_config
+        for k, v in manim_config.items():
+            manimce_config[k] = v
+        fps = manim_config['frame_rate']
+        kwargs = {}
+    else:
+        manim_config['file_writer_config']['open_file_upon_completion'] = False
+        manim_config['file_writer_config']['show_file_location_upon_completion'] = False
+        manim_config['file_writer_config']['write_to_movie'] = not null_render
+        fps = manim_config['camera_config']['frame_rate']
+        kwargs = manim_config
+    profile = Profile(fps)
+    base = vis.LL1ParsingVisualizer if args.parsing_algo == 'll1' else \
+            vis.LRParsingVisualizer
+    scene_cls = type(base.__name__, (ProfiledScene, base), \
+            {'null_render': null_render})
+    stack_cls = mobjects.StackMobject
+    changes = [
+        (vis, 'lr_parse_trace', profile.timed('trace', vis.lr_parse_trace)),
+        (vis, 'll1_parse_trace', profile.timed('trace', vis.ll1_parse_trace)),
+        (vis, 'stack_to_graphviz', profile.timed('graph', \
+                vis.stack_to_graphviz)),
+        (mobjects, 'layout_graph', profile.timed('layout', \
+                mobjects.layout_graph)),
+        (vis, 'GraphvizMobject', profile.timed_class('mobject', \
+                vis.GraphvizMobject)),
+        (vis, 'StackMobject', profile.timed_class('mobject', stack_cls)),
+        (stack_cls, 'set_stack', profile.timed('mobject', \
+                stack_cls.set_stack)),
+    ]
+    for module in [vis, mobjects]:
+        for cls_name in ['Tex', 'Text']:
+            changes.append((module, cls_name, profile.timed_class('tex', \
+                    getattr(module, cls_name))))
+    with patched(changes):
+        profile.start('parser')
+        if args.parsing_algo == 'll1':
+            p = parser_map['ll1'](args.grammar, args.reduce_grammar)
+        else:
+            p = parser_map[args.parsing_algo](args.grammar, \
+                    args.reduce_grammar, args.lr_workers, \
+                    args.lr_bypass_units, args.lr_lazy_units)
+        profile.stop()
+        scene = scene_cls(**kwargs)
+        scene.setup(p, list(string), colors, coalesce=args.manim_coalesce, \
+                time_budget=args.manim_time_budget)
+        scene.profile = profile
+        writer = scene.renderer.file_writer if vis.manimce else \
+                scene.file_writer
+        writer.write_frame = profile.timed('encode', writer.write_frame)
+        profile.begin_steps()
+        if null_render:
+            scene.construct()
+        elif vis.manimce:
+            scene.render()
+        else:
+            scene.run()
+    ret = profile.result()
+    ret.update({'config': config, 'algo': args.parsing_algo, \
+            'tokens': len(string) - 1, 'null_render': null_render, \
+            'quality': quality})
+    log.info('Benchmarked {} in {:.2f}s'.format(config, ret['wall']))
+    return ret
+
+def run_benchmark(configs, null_render=True, quality='480p', repeat=1):
+    # Fastest of `repeat` runs for every config
+    log = logging.getLogger('yacv')
+    results = []
+    for config in find_configs(configs):
+        best = None
+        for _ in range(repeat):
+            try:
+                result = bench_config(config, null_render, quality)
+            except (YACVError, ValueError) as e:
+                log.warning('Skipping {}: {}'.format(config, e))
+                break
+            if best is None or result['wall'] < best['wall']:
+                best = result
+        if best is not None:
+            results.append(best)
+    return results
+
+def format_report(results, steps=False):
+    lines = []
+    for r in results:
+        n = len(r['steps'])
+        lines.append('{} ({}, {} tokens, {} steps, {} frames, {})'.format(
+            r['config'], r['algo'], r['tokens'], n, r['frames'], \
+            'null renderer' if r['null_render'] else r['quality']))
+        lines.append('  {:<10} {:>9.3f}s {:>9.2f}ms/step'.format('total', \
+                r['wall'], 1000 * r['wall'] / max(1, n)))
+        for k in YACV_BENCH_COMPONENTS:
+            t = r['components'].get(k, 0.0)
+            if not t:
+                continue
+            line = '  {:<10} {:>9.3f}s {:>8.1f}%'.format(k, t, \
+                    100 * t / r['wall'])
+            if k in r['calls']:
+                line += ' {:>7} calls'.format(r['calls'][k])
+            lines.append(line)
+        if n:
+            slowest = max(r['steps'], key=lambda s: s['time'])
+            lines.append('  slowest step {} ({} x{}) {:.3f}s'.format(\
+                    slowest['step'], slowest['action'], slowest['size'], \
+                    slowest['time']))
+        if steps:
+            for s in r['steps']:
+                parts = ', '.join('{} {:.3f}'.format(k, v) for k, v in \
+                        sorted(s['components'].items(), key=lambda x: -x[1]))
+                lines.append('    {:>5} {:<7} x{:<3} {:>8.3f}s {:>5} frames  {}'\
+                        .format(s['step'], s['action'], s['size'], \
+                        s['time'], s['frames'], parts))
+    return '\n'.join(lines)
+
+def bench_main(argv):
+    parser = argparse.ArgumentParser(prog='yacv bench', description='Time ' \
+            'the parsing visualizations of YAML configs')
+    parser.add_argument('configs', nargs='+', help='Config files or ' \
+            'directories containing them')
+    parser.add_argument('--null', action='store_true', help='Interpolate ' \
+            'the animations without rendering or encoding any frame')
+    parser.add_argument('--quality', default='480p', choices=['480p', \
+            '720p', '1080p', '1440p', '2160p'])
+    parser.add_argument('--repeat', type=int, default=1, help='Keep the ' \
+            'fastest of this many runs')
+    parser.add_argument('--steps', action='store_true', help='Print the ' \
+            'timings of every step')
+    parser.add_argument('--json', default=None, help='Also write the ' \
+            'results to this file')
+    args = parser.parse_args(argv)
+    setup_logger()
+    results = run_benchmark(args.configs, args.null, args.quality, \
+            args.repeat)
+    print(format_report(results, args.steps))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
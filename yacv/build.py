@@ -0,0 +1,228 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+import yaml
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from yacv.utils import YACVError, setup_logger
+from yacv.constants import YACV_BUILD_STAMP_FILE, YACV_BUILD_STAMP_VERSION
+
+# `yacv build <dir>` runs every config file below a directory, make style.
+# Every config is a job that depends on its own options and on the contents
+# of its grammar file. After a successful run the hash of both (the stamp)
+# and the files the job wrote are recorded in YACV_BUILD_STAMP_FILE, the job
+# is skipped next time unless the stamp changed or an output is missing.
+# Jobs writing to the same output folder (same grammar name and algorithm)
+# run one after the other, the groups run in a process pool
+
+def discover_configs(root):
+    ret = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        # Skip our own output folders
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('yacv_') \
+                and not d.startswith('.'))
+        for fname in sorted(filenames):
+            if fname.endswith('.yml') or fname.endswith('.yaml'):
+                ret.append(os.path.join(dirpath, fname))
+    return ret
+
+def file_digest(fname):
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def config_stamp(args):
+    # Everything the outputs of a config depend on
+    options = {k: v for k, v in args.__dict__.items() if k != 'grammar'}
+    data = {
+        'version': YACV_BUILD_STAMP_VERSION,
+        'grammar': file_digest(args.grammar),
+        'options': options
+    }
+    text = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def output_folder(args, out_dir):
+    # Same folder as the one `yacv.yacv.run` writes to
+    from yacv.yacv import ROOT_DIR
+    grammar = ''.join(args.grammar.split('/')[-1].split('.')[:-1])
+    return os.path.join(out_dir, ROOT_DIR.format(grammar=grammar), \
+            args.parsing_algo)
+
+def list_files(folder):
+    ret = {}
+    for dirpath, _, filenames in os.walk(folder):
+        for fname in filenames:
+            path = os.path.join(dirpath, fname)
+            ret[path] = os.stat(path).st_mtime_ns
+    return ret
+
+def load_stamps(out_dir):
+    fname = os.path.join(out_dir, YACV_BUILD_STAMP_FILE)
+    if not os.path.exists(fname):
+        return {}
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except ValueError:
+        logging.getLogger('yacv').warning('Ignoring corrupted {}'.format(fname))
+        return {}
+
+def save_stamps(out_dir, stamps):
+    fname = os.path.join(out_dir, YACV_BUILD_STAMP_FILE)
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(stamps, f, indent=1, sort_keys=True)
+    os.replace(fname + '.tmp', fname)
+
+def up_to_date(config, stamp, stamps, out_dir):
+    # Outputs are stored relative to `out_dir`, like the configs to `root`
+    old = stamps.get(config)
+    if old is None or old['stamp'] != stamp:
+        return False
+    return all(os.path.exists(os.path.join(out_dir, x)) \
+            for x in old['outputs'])
+
+def run_group(jobs, out_dir):
+    # Runs the jobs of one output folder in order. Returns a list of
+    # (config, stamp, outputs, seconds, error)
+    from yacv.yacv import run
+    log = logging.getLogger('yacv')
+    if not log.handlers:
+        setup_logger()
+    ret = []
+    for config, args, folder, stamp in jobs:
+        before = list_files(folder)
+        start = time.perf_counter()
+        try:
+            run(args, out_dir)
+            error = None
+        except Exception as e:
+            log.error('{} failed: {}'.format(config, e))
+            error = '{}: {}'.format(type(e).__name__, e)
+        after = list_files(folder)
+        outputs = sorted(os.path.relpath(x, out_dir) \
+                for x, t in after.items() if before.get(x) != t)
+        ret.append((config, stamp, outputs, time.perf_counter() - start, \
+                error))
+    return ret
+
+def plan_build(root, out_dir, stamps, force=False):
+    # Returns (groups of jobs to run, configs skipped as up to date, configs
+    # that could not be loaded)
+    from yacv.yacv import load_config
+    log = logging.getLogger('yacv')
+    groups = {}
+    skipped = []
+    invalid = []
+    for config in discover_configs(root):
+        key = os.path.relpath(config, root)
+        try:
+            args = load_config(config)
+            stamp = config_stamp(args)
+        except (ValueError, TypeError, OSError, yaml.YAMLError) as e:
+            # Not a yacv config, or its grammar is missing
+            log.warning('Skipping {}: {}'.format(config, e))
+            invalid.append((key, str(e)))
+            continue
+        if not force and up_to_date(key, stamp, stamps, out_dir):
+            skipped.append(key)
+            continue
+        folder = output_folder(args, out_dir)
+        groups.setdefault(folder, []).append((key, args, folder, stamp))
+    return list(groups.values()), skipped, invalid
+
+def build(root, out_dir=None, workers=None, force=False, dry_run=False):
+    # Builds every config below `root`, returns the summary as a list of
+    # dicts with `config`, `status` (built/skipped/failed/invalid/pending),
+    # `seconds` and `outputs`
+    log = logging.getLogger('yacv')
+    if not os.path.isdir(root):
+        raise YACVError('{} is not a directory'.format(root))
+    out_dir = out_dir if out_dir is not None else root
+    os.makedirs(out_dir, exist_ok=True)
+    stamps = load_stamps(out_dir)
+    groups, skipped, invalid = plan_build(root, out_dir, stamps, force)
+    summary = [{'config': x, 'status': 'skipped', 'seconds': 0.0, \
+            'outputs': stamps[x]['outputs']} for x in skipped]
+    summary.extend({'config': x, 'status': 'invalid', 'seconds': 0.0, \
+            'outputs': [], 'error': e} for x, e in invalid)
+    if dry_run:
+        for jobs in groups:
+            summary.extend({'config': x[0], 'status': 'pending', \
+                    'seconds': 0.0, 'outputs': []} for x in jobs)
+        return summary
+    workers = min(workers or os.cpu_count() or 1, max(1, len(groups)))
+    log.info('{} jobs in {} groups with {} workers, {} up to date'.format(\
+            sum(len(x) for x in groups), len(groups), workers, len(skipped)))
+    def record(results):
+        for config, stamp, outputs, seconds, error in results:
+            entry = {'config': config, 'seconds': seconds, \
+                    'outputs': outputs}
+            if error is None:
+                entry['status'] = 'built'
+                stamps[config] = {'stamp': stamp, 'outputs': outputs, \
+                        'seconds': seconds}
+            else:
+                entry['status'] = 'failed'
+                entry['error'] = error
+                stamps.pop(config, None)
+            summary.append(entry)
+        # Saved after every group so an interrupted build keeps its progress
+        save_stamps(out_dir, stamps)
+    if workers == 1:
+        for jobs in groups:
+            record(run_group(jobs, out_dir))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_group, jobs, out_dir) \
+                    for jobs in groups]
+            for future in as_completed(futures):
+                record(future.result())
+    return summary
+
+def format_summary(summary):
+    order = {'failed': 0, 'built': 1, 'invalid': 2, 'pending': 3, 'skipped': 4}
+    lines = []
+    for entry in sorted(summary, key=lambda x: (order[x['status']], \
+            x['config'])):
+        line = '{:<8} {:>8.2f}s  {}'.format(entry['status'], \
+                entry['seconds'], entry['config'])
+        if 'error' in entry:
+            line += '  ({})'.format(entry['error'])
+        lines.append(line)
+    counts = {}
+    for entry in summary:
+        counts[entry['status']] = counts.get(entry['status'], 0) + 1
+    lines.append('{} configs: {}, {:.2f}s of jobs'.format(len(summary), \
+            ', '.join('{} {}'.format(v, k) for k, v in sorted(counts.items())), \
+            sum(x['seconds'] for x in summary)))
+    return '\n'.join(lines)
+
+def build_main(argv):
+    parser = argparse.ArgumentParser(prog='yacv build', description='Run ' \
+            'every config below a directory, skipping the up to date ones')
+    parser.add_argument('dir', help='Directory searched for YAML configs')
+    parser.add_argument('--out', default=None, help='Directory the yacv_* ' \
+            'output folders are written to (default: DIR)')
+    parser.add_argument('--jobs', type=int, default=None, help='Number of ' \
+            'worker processes (default: all the cores)')
+    parser.add_argument('--force', action='store_true', help='Rebuild ' \
+            'everything')
+    parser.add_argument('--dry-run', action='store_true', help='Only list ' \
+            'what would be rebuilt')
+    args = parser.parse_args(argv)
+    setup_logger()
+    log = logging.getLogger('yacv')
+    try:
+        summary = build(args.dir, args.out, args.jobs, args.force, \
+                args.dry_run)
+    except YACVError as e:
+        log.fatal(str(e))
+        exit(1)
+    print(format_summary(summary))
+    if any(x['status'] == 'failed' for x in summary):
+        exit(1)
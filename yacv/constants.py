@@ -2,9 +2,17 @@ try:
     from manimlib import *
     manimce = False
 except ImportError as e:
-    from manim import *
+    try:
+        from manim import *
+    except ImportError as e:
+        # manim is needed only for `vis-parsing`, rest of yacv works without it
+        pass
     manimce = True
-import colour 
+try:
+    import colour 
+except ImportError as e:
+    colour = None
+import os
 # Parsing parameters
 YACV_ACTION  = 'ACTION'
 YACV_ACCEPT  = 'ACC'
@@ -14,6 +22,15 @@ YACV_DOT     = '•'
 YACV_REDUCE  = 'r'
 YACV_SHIFT   = 's'
 YACV_EPSILON = ''
+# Associativities of the precedence declarations in grammar files
+YACV_ASSOCIATIVITIES = ['left', 'right', 'nonassoc']
+# Kinds of parsing table cells in the binary export (see tableexport.py)
+YACV_TABLE_ERROR  = 0
+YACV_TABLE_SHIFT  = 1
+YACV_TABLE_REDUCE = 2
+YACV_TABLE_ACCEPT = 3
+YACV_TABLE_GOTO   = 4
+YACV_TABLE_EXPAND = 5
 
 # Graphviz parameters
 YACV_GRAPHVIZ_INFINITY = 2048
@@ -35,22 +52,61 @@ YACV_GRAPHVIZ_COLORS = [
     '#00FF7F', # 'springgreen',
     '#FF6347', # 'tomato'
 ]
+# Graphviz layouts are cached on disk, keyed by the structure of the graph
+YACV_LAYOUT_CACHE_DIR        = os.path.join(os.path.expanduser('~'), \
+                                    '.cache', 'yacv', 'layouts')
+YACV_LAYOUT_CACHE_MAX_BYTES  = 64 * 1024 * 1024
+YACV_LAYOUT_CACHE_MAX_MEMORY = 256
+# Bumped whenever the format of a stored layout changes
+YACV_LAYOUT_CACHE_VERSION    = 2
+# Layout engine for syntax trees, either a graphviz program or 'tidy'
+YACV_LAYOUT_ENGINE = 'dot'
+# Built-in tidy tree layout, all sizes in points like graphviz
+YACV_TIDY_NODE_SEP    = 18
+YACV_TIDY_RANK_SEP    = 54
+YACV_TIDY_CHAR_WIDTH  = 8
+YACV_TIDY_NODE_HEIGHT = 20
+# LR automaton visualization. Bigger automata get kernel-only labels and a
+# force directed layout (sfdp) instead of dot, pages hold at most this many
+# states
+YACV_AUTOMATON_PAGE_SIZE            = 40
+YACV_AUTOMATON_FULL_LABEL_MAX_STATES = 60
+YACV_AUTOMATON_DOT_MAX_STATES       = 150
+# Frontiers with fewer new closures than this are not sent to worker processes
+YACV_LR_PARALLEL_MIN_BATCH          = 32
+# `yacv serve`, number of parsers kept in memory and default address
+YACV_SERVER_CACHE_SIZE = 32
+YACV_SERVER_HOST       = '127.0.0.1'
+YACV_SERVER_PORT       = 8765
+# `yacv build`, file (in the output directory) recording what was built
+YACV_BUILD_STAMP_FILE    = '.yacv-build.json'
+YACV_BUILD_STAMP_VERSION = 2
 
 # Manim parameters
 YACV_MANIM_MAX_AST_WIDTH  = 10
 YACV_MANIM_MAX_AST_HEIGHT = 6.5
 YACV_MANIM_MAX_STACK_VIS  = 6
+YACV_MANIM_SPLINE_SAMPLES = 16 # points per cubic segment of an edge
 YACV_MANIM_TEXT_SCALE     = 0.5
 YACV_MANIM_STATUS_SCALE   = 0.6
 YACV_MANIM_STRING_SCALE   = 0.5
+# Seconds per animation and per pause at normal pace. With a time budget both
+# are scaled down, animations never get shorter than the minimum
+YACV_MANIM_RUN_TIME       = 1
+YACV_MANIM_WAIT_TIME      = 1
+YACV_MANIM_MIN_RUN_TIME   = 0.1
 YACV_MANIM_STRING_LEADER  = '\\textbf{String} $\\rightarrow$ \\textbf{[}' if \
                                 manimce else \
                             'String \\rightarrow ['
 
+# Keyframe (SVG) parameters
+YACV_KEYFRAME_NODE_DX = 60
+YACV_KEYFRAME_NODE_DY = 60
+
 # Hackable config for manim
 yacv_manimce_config =  {
     'assets_dir': './',
-    'background_color': colour.Color('#000'),
+    'background_color': colour.Color('#000') if colour else '#000',
     'background_opacity': 1.0,
     'custom_folders': False,
     'disable_caching': False,
@@ -95,7 +151,7 @@ yacv_manimce_config =  {
 }
 yacv_manim_config = {
     'camera_config': {
-        'background_color': colour.Color('#000'),
+        'background_color': colour.Color('#000') if colour else '#000',
         'frame_rate': 60,
         'pixel_height': 720,
         'pixel_width': 1280
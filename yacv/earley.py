@@ -0,0 +1,317 @@
+import logging
+from yacv.grammar import Grammar
+from yacv.abstractsyntaxtree import AbstractSyntaxTree
+from yacv.utils import YACVError
+from yacv.asyncparse import feed_tokens, parse_async
+from yacv.tokenids import token_id_view, feed_token_ids
+from yacv.layoutcache import layout_graph
+from yacv.treeexport import syntaxtree_to_dot, export_syntaxtree
+from yacv.constants import *
+
+# Earley parser for any context free grammar. Items are (core, origin) pairs
+# of ints where a core numbers a dotted production, every position keeps a
+# list of its items plus a dict from item to back pointer. Nullable
+# nonterminals are skipped at prediction time (Aycock & Horspool, "Practical
+# Earley Parsing", 2002) and completions along deterministic reduction paths
+# jump straight to the topmost item (Leo, "A general context-free parsing
+# algorithm running in linear time on every LR(k) grammar", 1991), which
+# keeps right recursion linear. The tree has the same shape as the one built
+# by `LRParser.parse`
+class EarleyParser(object):
+    def __init__(self, fname='simple-grammar.txt', reduce=False):
+        self.grammar = Grammar(fname, reduce)
+        self.build()
+
+    def build(self):
+        # Every grammar is fine for Earley parsing
+        self.is_valid = True
+        grammar = self.grammar
+        nonterminals = grammar.nonterminals
+        self.rhs = []
+        self.base = []
+        self.next_symbol = []
+        self.core_prod = []
+        for prod_id, prod in enumerate(grammar.prods):
+            rhs = [] if prod.rhs[0] == YACV_EPSILON else list(prod.rhs)
+            self.rhs.append(rhs)
+            self.base.append(len(self.next_symbol))
+            for dot_pos in range(len(rhs) + 1):
+                self.next_symbol.append(rhs[dot_pos] \
+                        if dot_pos < len(rhs) else None)
+                self.core_prod.append(prod_id)
+        self.nullable = set(nt for nt, info in nonterminals.items() \
+                if info['nullable'])
+        # For every nullable nonterminal, a production deriving the empty
+        # string with the fewest steps, used to rebuild skipped subtrees
+        self.empty_prod = {}
+        changed = True
+        while changed:
+            changed = False
+            for prod_id, rhs in enumerate(self.rhs):
+                lhs = grammar.prods[prod_id].lhs
+                if lhs in self.empty_prod:
+                    continue
+                if all(x in self.empty_prod for x in rhs):
+                    self.empty_prod[lhs] = prod_id
+                    changed = True
+
+    def add_production(self, lhs, rhs):
+        prod_id = self.grammar.add_production(lhs, rhs)
+        self.build()
+        return prod_id
+
+    def remove_production(self, prod_id):
+        prod = self.grammar.remove_production(prod_id)
+        self.build()
+        return prod
+
+    def replace_production(self, prod_id, lhs, rhs):
+        prod = self.grammar.replace_production(prod_id, lhs, rhs)
+        self.build()
+        return prod
+
+    def parse(self, string, actions=None, recognize=False):
+        assert len(string) > 0
+        if string[-1] != '$':
+            string.append('$')
+        return feed_tokens(self.parse_steps(actions, recognize), string)
+
+    def recognize(self, string):
+        try:
+            return self.parse(list(string), recognize=True)
+        except YACVError:
+            return False
+
+    def parse_ids(self, ids, actions=None, recognize=False, fmt=None):
+        # `ids` is a buffer of token ids (positions in `grammar.terminals`),
+        # walked in place, see yacv.tokenids
+        return feed_token_ids(self.parse_steps(actions, recognize), \
+                token_id_view(ids, fmt), self.grammar.terminals)
+
+    async def aparse(self, tokens, timeout=None, actions=None, \
+            recognize=False):
+        # `tokens` is an async iterable of terminals, see yacv.asyncparse
+        return await parse_async(self, tokens, timeout, actions, recognize)
+
+    def parse_steps(self, actions=None, recognize=False):
+        # Generator core of the parser, same protocol as
+        # `LRParser.parse_steps`. `actions` are evaluated over the tree
+        log = logging.getLogger('yacv')
+        nonterminals = self.grammar.nonterminals
+        prods = self.grammar.prods
+        next_symbol = self.next_symbol
+        base = self.base
+        rhs_of = self.rhs
+        core_prod = self.core_prod
+        nullable = self.nullable
+        # sets[j] lists the items, back[j] maps them to their back pointer
+        sets = [[(base[0], 0)]]
+        back = [{(base[0], 0): None}]
+        # waiting[j][B] are the items of set j with the dot before B
+        waiting = []
+        # Leo items: leo[(j, B)] is None when set j has no deterministic
+        # reduction path for B, otherwise (top item, next key, item) where
+        # item is the only one of set j waiting for B and next key is the
+        # step above it (None at the top)
+        leo = {}
+        tokens = []
+
+        def add(j, item, pointer):
+            if item not in back[j]:
+                back[j][item] = pointer
+                sets[j].append(item)
+
+        def leo_step(k, symbol):
+            # Returns the topmost item reached from set k by completing
+            # `symbol` along a deterministic path, or None. Filled bottom up
+            # without recursion
+            path = []
+            key = (k, symbol)
+            while key not in leo:
+                pending = waiting[key[0]].get(key[1], ())
+                leo[key] = None
+                if len(pending) != 1 or \
+                        next_symbol[pending[0][0] + 1] is not None:
+                    break
+                path.append(key)
+                core, origin = pending[0]
+                key = (origin, prods[core_prod[core]].lhs)
+            above = leo.get(key)
+            for key in reversed(path):
+                item = waiting[key[0]][key[1]][0]
+                if above is None:
+                    leo[key] = ((item[0] + 1, item[1]), None, item)
+                else:
+                    leo[key] = (above[0], \
+                            (item[1], prods[core_prod[item[0]]].lhs), item)
+                above = leo[key]
+            return leo.get((k, symbol))
+
+        def process(j, a):
+            items = sets[j]
+            waiting.append({})
+            predicted = set()
+            i = 0
+            while i < len(items):
+                core, origin = items[i]
+                i += 1
+                symbol = next_symbol[core]
+                if symbol is None:
+                    if origin == j:
+                        # Empty completions were done when predicting
+                        continue
+                    lhs = prods[core_prod[core]].lhs
+                    step = leo_step(origin, lhs)
+                    if step is not None:
+                        add(j, step[0], ('leo', origin, lhs, core))
+                        continue
+                    for pcore, porigin in waiting[origin].get(lhs, ()):
+                        add(j, (pcore + 1, porigin), ('complete', origin, core))
+                elif symbol in nonterminals:
+                    if symbol in waiting[j]:
+                        waiting[j][symbol].append((core, origin))
+                    else:
+                        waiting[j][symbol] = [(core, origin)]
+                    if symbol not in predicted:
+                        predicted.add(symbol)
+                        for prod_id in nonterminals[symbol]['prods_lhs']:
+                            add(j, (base[prod_id], j), None)
+                    if symbol in nullable:
+                        add(j, (core + 1, origin), ('null', symbol))
+                elif symbol == a:
+                    add(j + 1, (core + 1, origin), ('scan',))
+
+        j = 0
+        a = yield
+        while True:
+            tokens.append(a)
+            sets.append([])
+            back.append({})
+            process(j, a)
+            if not sets[j + 1]:
+                log.error('Parse error')
+                raise YACVError('Cannot parse the remainder of string ' \
+                        'starting at {} (position {})'.format(a, j))
+            j += 1
+            if a == '$':
+                break
+            a = yield
+        process(j, None)
+        accept = (base[0] + len(rhs_of[0]), 0)
+        if accept not in back[j]:
+            log.error('Parse error')
+            raise YACVError('Input ended before the start symbol was complete')
+        if recognize:
+            return True
+        tree = self.build_tree(back, leo, tokens, accept, j)
+        if actions is not None:
+            return self.evaluate(tree, actions)
+        log.info('Parse successful')
+        return tree
+
+    def children(self, back, leo, core, origin, j):
+        # Child specs (left to right) of the symbols before the dot of item
+        # (core, origin) in set j, found by following the back pointers
+        ret = []
+        while core != self.base[self.core_prod[core]]:
+            pointer = back[j][(core, origin)]
+            if pointer[0] == 'scan':
+                j -= 1
+                ret.append(('token', j))
+            elif pointer[0] == 'null':
+                ret.append(('null', pointer[1]))
+            elif pointer[0] == 'complete':
+                _, k, ccore = pointer
+                ret.append(('item', ccore, k, j))
+                j = k
+            else:
+                # Unfold the Leo path from the bottom item up to this one
+                _, k, symbol, ccore = pointer
+                keys = [(k, symbol)]
+                while leo[keys[-1]][1] is not None:
+                    keys.append(leo[keys[-1]][1])
+                child = ('item', ccore, k, j)
+                if len(keys) > 1:
+                    child = ('leo', keys, len(keys) - 2, child)
+                ret.append(child)
+                j = keys[-1][0]
+            core -= 1
+        ret.reverse()
+        return ret
+
+    def build_tree(self, back, leo, tokens, accept, j):
+        prods = self.grammar.prods
+        # The accepting item is S' -> S $ ., the tree is the one of S
+        root_spec = self.children(back, leo, accept[0], accept[1], j)[0]
+        root = AbstractSyntaxTree()
+        stack = [(root, root_spec)]
+        while stack:
+            node, spec = stack.pop(-1)
+            if spec[0] == 'token':
+                node.root = tokens[spec[1]]
+                continue
+            if spec[0] == 'null':
+                prod_id = self.empty_prod[spec[1]]
+                specs = [('null', x) for x in self.rhs[prod_id]]
+            elif spec[0] == 'item':
+                _, core, origin, k = spec
+                prod_id = self.core_prod[core]
+                specs = self.children(back, leo, core, origin, k)
+            else:
+                # Step t of a Leo path advances the only item of set keys[t][0]
+                # waiting for keys[t][1], the step below is its last child
+                _, keys, t, bottom = spec
+                core, origin = leo[keys[t]][2]
+                prod_id = self.core_prod[core]
+                below = ('leo', keys, t - 1, bottom) if t > 0 else bottom
+                specs = self.children(back, leo, core, origin, keys[t][0]) + \
+                        [below]
+            node.root = prods[prod_id].lhs
+            node.prod_id = prod_id
+            if not specs:
+                node.desc = [AbstractSyntaxTree(YACV_EPSILON)]
+                continue
+            node.desc = [AbstractSyntaxTree() for _ in specs]
+            for child, child_spec in zip(node.desc, specs):
+                stack.append((child, child_spec))
+        return root
+
+    def evaluate(self, tree, actions):
+        # Post order fold of the tree with the semantic actions, same rules
+        # as `LRParser.parse_steps`
+        values = {}
+        stack = [(tree, False)]
+        while stack:
+            node, done = stack.pop(-1)
+            if not node.desc:
+                values[id(node)] = node.root
+                continue
+            if not done:
+                stack.append((node, True))
+                stack.extend((x, False) for x in node.desc)
+                continue
+            children = [values.pop(id(x)) for x in node.desc \
+                    if x.root != YACV_EPSILON or x.desc]
+            if node.prod_id in actions:
+                values[id(node)] = actions[node.prod_id](*children)
+            else:
+                values[id(node)] = children[0] if children else None
+        return values[id(tree)]
+
+    def visualize_syntaxtree(self, string, colors=None):
+        log = logging.getLogger('yacv')
+        import pygraphviz as pgv
+        colors = colors if colors is not None else YACV_GRAPHVIZ_COLORS
+        tree = self.parse(string)
+        G = pgv.AGraph(string=syntaxtree_to_dot(tree, self.grammar.terminals, \
+                colors))
+        layout_graph(G)
+        log.info('Earley parse tree successfully visualized')
+        return G
+
+    def export_syntaxtree(self, string, fname, colors=None, fmt=None, \
+            layout='dot', stream=False):
+        # Writes the syntax tree to `fname`, see yacv.treeexport
+        tree = self.parse(string)
+        return export_syntaxtree(tree, self.grammar.terminals, fname, \
+                colors, fmt, layout, stream)
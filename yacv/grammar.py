@@ -1,11 +1,19 @@
 import logging 
-from collections import OrderedDict
+import os
+import re
+from collections import OrderedDict, deque
 from pprint import pprint
 from yacv.constants import *
+from yacv.utils import YACVError
+# A `#` token followed by a space starts a comment
+comment_pattern = re.compile(r'(?:^|(?<=\s))#[ \t]')
+
 class Production(object):
-    def __init__(self, lhs=None, rhs=[]):
+    def __init__(self, lhs=None, rhs=[], prec=None):
         self.lhs = lhs
         self.rhs = rhs
+        # Terminal named by `%prec`, if any (see `Grammar.prod_precedence`)
+        self.prec = prec
 
     def __str__(self):
         rhs = 'ϵ' if self.rhs[0] == YACV_EPSILON else ''.join(self.rhs)
@@ -24,159 +32,437 @@ class Production(object):
 def first(g, s):
     # g: Grammar object
     # s: RHS or Part of RHS as list
+    # Uses the FIRST sets of the nonterminals, so they must be built already
     if not s:
         return set() # empty set
-    if s[0] == YACV_EPSILON:
-        return set([YACV_EPSILON]) # set with epsilon in it
-    if s[0] not in g.nonterminals.keys():
-        return set([s[0]])
-    # At this point, s[0] must be a non terminal
     ret = set()
-    for prodno in g.nonterminals[s[0]]['prods_lhs']:
-        rhs = g.prods[prodno].rhs
-        if rhs[0] == s[0]:
-            # left recursion
+    for symbol in s:
+        if symbol == YACV_EPSILON:
             continue
-        x = first(g, rhs)
-        ret = ret.union(x)
-
-    if YACV_EPSILON in ret:
-        x = first(g, s[1:])
-        ret = ret.union(x)
+        if symbol not in g.nonterminals:
+            ret.discard(YACV_EPSILON)
+            ret.add(symbol)
+            return ret
+        f = g.nonterminals[symbol]['first']
+        ret.update(f)
+        if YACV_EPSILON not in f:
+            ret.discard(YACV_EPSILON)
+            return ret
+    # every symbol of s is nullable
+    ret.add(YACV_EPSILON)
     return ret
 
+def grammar_lines(source):
+    # `source` is a path, a file object or any iterable of lines
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source) as f:
+            for line in f:
+                yield line
+        return
+    for line in source:
+        yield line.decode('utf-8') if isinstance(line, bytes) else line
+
+def read_productions(source, precedence=None):
+    # Yields (line number, lhs, rhs, %prec terminal or None) for every
+    # production in `source`, one line at a time. A line is either
+    # `A -> a B | c`, a continuation `| d` of the previous line's LHS, a
+    # precedence declaration, empty or a comment. A comment is a line
+    # starting with `#`, or the rest of a line from a `#` token followed by a
+    # space, so `#`, `#if` or `##` can still be terminals. Declarations
+    # (`%left`, `%right`, `%nonassoc` followed by terminals) are stored in
+    # the `precedence` dict as terminal -> (level, associativity), later
+    # lines bind tighter like yacc
+    if precedence is None:
+        precedence = {}
+    level = 0
+    lhs = None
+    for lineno, line in enumerate(grammar_lines(source), 1):
+        if line.lstrip().startswith('#'):
+            continue
+        comment = comment_pattern.search(line)
+        if comment is not None:
+            line = line[:comment.start()]
+        tokens = line.split()
+        if not tokens:
+            continue
+        if tokens[0].startswith('%'):
+            assoc = tokens[0][1:]
+            if assoc not in YACV_ASSOCIATIVITIES:
+                raise YACVError('Line {}: unknown declaration {}, expected ' \
+                        'one of {}'.format(lineno, tokens[0], ', '.join(\
+                            '%' + x for x in YACV_ASSOCIATIVITIES)))
+            if len(tokens) == 1:
+                raise YACVError('Line {}: {} without any terminal'.format(\
+                        lineno, tokens[0]))
+            level += 1
+            for terminal in tokens[1:]:
+                if terminal in precedence:
+                    raise YACVError('Line {}: precedence of {} is declared ' \
+                            'twice'.format(lineno, terminal))
+                precedence[terminal] = (level, assoc)
+            # Productions can't continue across a declaration
+            lhs = None
+            continue
+        if tokens[0] == '|':
+            if lhs is None:
+                raise YACVError('Line {}: alternative without a production ' \
+                        'to continue'.format(lineno))
+            rhs = tokens[1:]
+        else:
+            text = ' '.join(tokens)
+            if '->' not in text:
+                raise YACVError('Line {}: expected "<nonterminal> -> ' \
+                        '<symbols>", got "{}"'.format(lineno, line.strip()))
+            lhs, rhs = text.split('->', 1)
+            lhs, rhs = lhs.split(), rhs.split()
+            if len(lhs) != 1:
+                raise YACVError('Line {}: LHS must be a single nonterminal, ' \
+                        'got "{}"'.format(lineno, ' '.join(lhs)))
+            lhs = lhs[0]
+        if any('->' in x for x in rhs):
+            raise YACVError('Line {}: more than one "->" in "{}"'.format(
+                lineno, line.strip()))
+        alternatives = [[]]
+        for token in rhs:
+            if token == '|':
+                alternatives.append([])
+            else:
+                alternatives[-1].append(YACV_EPSILON if token == "\'\'" \
+                        else token)
+        for alt in alternatives:
+            prec = None
+            if '%prec' in alt:
+                if alt.index('%prec') != len(alt) - 2:
+                    raise YACVError('Line {}: %prec must be followed by ' \
+                            'exactly one terminal at the end of an ' \
+                            'alternative'.format(lineno))
+                prec = alt[-1]
+                if prec not in precedence:
+                    raise YACVError('Line {}: %prec {} has no declared ' \
+                            'precedence'.format(lineno, prec))
+                alt = alt[:-2]
+            if not alt:
+                raise YACVError('Line {}: empty alternative for {}, use \'\' ' \
+                        'for epsilon'.format(lineno, lhs))
+            yield lineno, lhs, alt, prec
+
 class Grammar(object):
-    def __init__(self, fname='simple-grammar.txt'):
-        lines = [x.strip() for x in open(fname).readlines()] 
-        self.prods = [] # list containing all the productions
-        all_symbols = set()
-        for line in lines:
-            # TODO: If ValueError is generated when splitting
-            # report unrecognized grammar
-            if line == '':
-                continue
-            lhs, rhs = line.split('->')
-            lhs = lhs.strip()
-            rhs = [x for x in rhs.split(' ') if x]
-            # TODO: find a better way to do this
-            for i, _ in enumerate(rhs):
-                if rhs[i] == "\'\'":
-                    rhs[i] = YACV_EPSILON
-            self.prods.append(
-                Production(lhs, rhs)
-            )
-            all_symbols = all_symbols.union(rhs)
+    def __init__(self, fname='simple-grammar.txt', reduce=False):
+        # Index 0 is the augmented production
+        self.prods = [None] # list containing all the productions
+        # terminal -> (level, associativity) from the %left, %right and
+        # %nonassoc declarations
+        self.precedence = {}
+        for lineno, lhs, rhs, prec in read_productions(fname, self.precedence):
+            self.prods.append(Production(lhs, rhs, prec))
+        if len(self.prods) == 1:
+            raise YACVError('Grammar does not contain any productions')
         # Augment the grammar
-        self.prods.insert(0, Production('S\'', [self.prods[0].lhs, '$']))
-        # Accumulate nonterminal information
+        self.prods[0] = Production('S\'', [self.prods[1].lhs, '$'])
+        self.removed = None
+        # Symbols affected by the last edit (see `update`)
+        self.changed = set()
+        self.build_tables()
+        declared = [x for x in self.precedence if x in self.nonterminals]
+        if declared:
+            raise YACVError('Precedence can only be declared for terminals, ' \
+                    'got {}'.format(', '.join(declared)))
+        if reduce:
+            self.reduce(rebuild=False)
+        self.build_first()
+        self.build_follow()
+
+    def prod_precedence(self, prod_id):
+        # (level, associativity) of a production: the one of its %prec
+        # terminal, otherwise the one of its last terminal. None when that
+        # terminal has no declared precedence
+        prod = self.prods[prod_id]
+        if prod.prec is not None:
+            return self.precedence[prod.prec]
+        for symbol in reversed(prod.rhs):
+            if symbol not in self.nonterminals and symbol != YACV_EPSILON:
+                return self.precedence.get(symbol)
+        return None
+
+    def build_tables(self):
+        # Nonterminals, terminals and RHS occurences of every nonterminal in
+        # a single pass over the productions
         self.nonterminals = OrderedDict()
-        for i, prod in enumerate(self.prods):
+        all_symbols = set()
+        # (prodno, position) of every occurence of every symbol on a RHS
+        occurences = {}
+        for prodno, prod in enumerate(self.prods):
             lhs, rhs = prod.lhs, prod.rhs
-            if lhs not in self.nonterminals.keys():
+            all_symbols.update(rhs)
+            for i, symbol in enumerate(rhs):
+                if symbol in occurences:
+                    occurences[symbol].append((prodno, i))
+                else:
+                    occurences[symbol] = [(prodno, i)]
+            if lhs not in self.nonterminals:
                 self.nonterminals[lhs] = {
                     # number of productions this nonterminal is on the LHS of
-                    'prods_lhs' : [i],
+                    'prods_lhs' : [prodno],
                     # where does this non terminal appear on RHS ? 
                     # what prod and what place ?
                     'prods_rhs' : [],
                     'first'     : set(),
                     'follow'    : set(),
-                    'nullable'  : False
+                    'nullable'  : False,
+                    # LR closure template, built on demand by yacv.lr
+                    'closure'   : None
                 }
             else:
-                self.nonterminals[lhs]['prods_lhs'].append(i)
-        self.terminals = all_symbols.difference(set(self.nonterminals.keys()))
-        if YACV_EPSILON in self.terminals:
-            self.terminals = self.terminals.difference(set([YACV_EPSILON]))
+                self.nonterminals[lhs]['prods_lhs'].append(prodno)
+        for nt, info in self.nonterminals.items():
+            info['prods_rhs'] = occurences.get(nt, [])
+        self.terminals = all_symbols.difference(self.nonterminals.keys())
+        self.terminals.discard(YACV_EPSILON)
         self.terminals.add('$')
         self.terminals = sorted(self.terminals)
-        # Update nonterminals_on_rhs for every prod using above data
-        for prodno, prod in enumerate(self.prods):
-            lhs, rhs = prod.lhs, prod.rhs
-            for i, symbol in enumerate(rhs):
-                if symbol in self.nonterminals.keys():
-                    self.nonterminals[symbol]['prods_rhs'].append((prodno, i))
-        self.build_first()
-        self.build_follow()
-
-    def build_first(self):
-        # inefficient method, but should work fine for most small grammars
-        for nt in self.nonterminals.keys():
-            tmp = first(self, [nt])
-            self.nonterminals[nt]['first'] = tmp
-            for prod_id in self.nonterminals[nt]['prods_lhs']:
-                if self.prods[prod_id].rhs[0] == YACV_EPSILON:
-                    self.nonterminals[nt]['nullable'] = True 
-        
-        changed = True
-        while changed:
-            changed = False 
-            for nt in self.nonterminals.keys():
-                for prod_id in self.nonterminals[nt]['prods_lhs']:
-                    rhs = self.prods[prod_id].rhs
-                    count = 0
-                    for symbol in rhs:
-                        if symbol in self.nonterminals.keys() and \
-                        self.nonterminals[symbol]['nullable']:
-                            count += 1
-                    if count == len(rhs) and not self.nonterminals[nt]['nullable']:
-                        self.nonterminals[nt]['nullable'] = True
-                        changed = True
-
-        for nt in self.nonterminals.keys():
-            f = self.nonterminals[nt]['first']
-            if self.nonterminals[nt]['nullable']:
-                self.nonterminals[nt]['first'] = f.union(set([YACV_EPSILON]))
-            else:
-                self.nonterminals[nt]['first'] = f.difference(set([YACV_EPSILON]))
 
-    def build_follow(self):
+    def reduce(self, rebuild=True):
+        # Removes the productions that use unproductive nonterminals (ones that
+        # never derive a string of terminals) and then the productions of
+        # nonterminals that are unreachable from S'. Both analyses are linear
+        # worklists over `prods_lhs`/`prods_rhs`
         log = logging.getLogger('yacv')
-        self.nonterminals[self.prods[0].lhs]['follow'].add('$')
-        for nt in self.nonterminals.keys():
-            # Where does this symbol occur on RHS ?
-            s = set()
-            for prodno, idx in self.nonterminals[nt]['prods_rhs']:
-                log.debug('Needed FIRST({}) = {} for FOLLOW({})'.format(
-                    self.prods[prodno].rhs[idx+1:], 
-                    first(self, self.prods[prodno].rhs[idx+1:]), 
-                    nt
-                ))
-                f = first(self, self.prods[prodno].rhs[idx+1:])
-                if not f or YACV_EPSILON in f:
-                    f.add('$')
-                s = s.union(f)
-                s = s.difference(set([YACV_EPSILON]))
-            self.nonterminals[nt]['follow'] = s
-            log.debug('FOLLOW({}) = {}'.format(nt, s))
-        for prod in self.prods:
-            log.debug('At production {}'.format(prod))
-            # Is there a production A -> BC such that C is NULLABLE ?
-            lhs, rhs = prod.lhs, prod.rhs
-            reversed_rhs = rhs[::-1]
-            for i, symbol in enumerate(reversed_rhs):
-                log.debug('i = {}, symbol = {}'.format(i, symbol))
-                if symbol not in self.nonterminals.keys():
-                    break
-                if self.nonterminals[symbol]['nullable'] and (i+1) < len(rhs):
-                    if reversed_rhs[i+1] in self.terminals:
-                        continue
-                    s1 = self.nonterminals[reversed_rhs[i+1]]['follow']
-                    s2 = self.nonterminals[lhs]['follow']
-                    s1 = s1.union(s2)
-                    self.nonterminals[reversed_rhs[i+1]]['follow'] = s1
-                    if i == 0:
-                        s3 = self.nonterminals[symbol]['follow']
-                        s3 = s3.union(s2)
-                        self.nonterminals[symbol]['follow'] = s3
-                        log.debug('Production {} has nullable symbol {} at the end, updated FOLLOW({}) = {}'.format(prod, symbol, symbol, s3))
-                    log.debug('Production {} has nullable symbol {}, changed FOLLOW({}) to {}'.format(prod, symbol, reversed_rhs[i+1], s1))
-            if rhs[-1] in self.nonterminals.keys():
-                self.nonterminals[rhs[-1]]['follow'] = \
-                        self.nonterminals[rhs[-1]]['follow'].union(
-                            self.nonterminals[lhs]['follow']
-                        )
-            log.debug('End of iteration' + 16*'-')
+        nonterminals = self.nonterminals
+        # Number of unproductive nonterminal occurences on every RHS
+        pending = [0] * len(self.prods)
+        for nt, info in nonterminals.items():
+            for prodno, _ in info['prods_rhs']:
+                pending[prodno] += 1
+        productive = set()
+        worklist = [prodno for prodno, x in enumerate(pending) if x == 0]
+        while worklist:
+            lhs = self.prods[worklist.pop(-1)].lhs
+            if lhs in productive:
+                continue
+            productive.add(lhs)
+            for prodno, _ in nonterminals[lhs]['prods_rhs']:
+                pending[prodno] -= 1
+                if pending[prodno] == 0:
+                    worklist.append(prodno)
+        start = self.prods[0].lhs
+        if start not in productive:
+            raise YACVError('Start symbol {} does not derive any string of ' \
+                    'terminals'.format(self.prods[0].rhs[0]))
+        reachable = set([start])
+        worklist = [start]
+        while worklist:
+            nt = worklist.pop(-1)
+            for prodno in nonterminals[nt]['prods_lhs']:
+                if pending[prodno] > 0:
+                    continue
+                for symbol in self.prods[prodno].rhs:
+                    if symbol in nonterminals and symbol not in reachable:
+                        reachable.add(symbol)
+                        worklist.append(symbol)
+        keep = [prodno for prodno, prod in enumerate(self.prods) \
+                if pending[prodno] == 0 and prod.lhs in reachable]
+        self.removed = {
+            'unproductive': [nt for nt in nonterminals if nt not in productive],
+            'unreachable': [nt for nt in nonterminals \
+                    if nt in productive and nt not in reachable],
+            'prods': [self.prods[prodno] for prodno in \
+                    sorted(set(range(len(self.prods))).difference(keep))]
+        }
+        if self.removed['prods']:
+            log.info('Grammar reduced: removed {} production(s), ' \
+                    'unproductive = {}, unreachable = {}'.format(
+                        len(self.removed['prods']), \
+                        self.removed['unproductive'], \
+                        self.removed['unreachable']))
+            for prod in self.removed['prods']:
+                log.debug('Removed production {}'.format(prod))
+            self.prods = [self.prods[prodno] for prodno in keep]
+            self.build_tables()
+            if rebuild:
+                self.build_first()
+                self.build_follow()
+        return self.removed
+
+    def upward_closure(self, symbols):
+        # Nonterminals whose FIRST set can depend on any of `symbols`
+        ret = set(x for x in symbols if x in self.nonterminals)
+        stack = list(ret)
+        while stack:
+            nt = stack.pop(-1)
+            for prodno, _ in self.nonterminals[nt]['prods_rhs']:
+                lhs = self.prods[prodno].lhs
+                if lhs not in ret:
+                    ret.add(lhs)
+                    stack.append(lhs)
+        return ret
+
+    def downward_closure(self, symbols):
+        # Nonterminals whose FOLLOW set can depend on any of `symbols`
+        ret = set(x for x in symbols if x in self.nonterminals)
+        stack = list(ret)
+        while stack:
+            nt = stack.pop(-1)
+            for prodno in self.nonterminals[nt]['prods_lhs']:
+                for symbol in self.prods[prodno].rhs:
+                    if symbol in self.nonterminals and symbol not in ret:
+                        ret.add(symbol)
+                        stack.append(symbol)
+        return ret
+
+    def build_first(self, affected=None):
+        # Least fixpoint of FIRST (with epsilon for nullable nonterminals)
+        # over the `affected` nonterminals, FIRST of every other nonterminal
+        # is assumed to be up to date. A nonterminal is revisited only when
+        # FIRST of a nonterminal on one of its RHS changes
+        nonterminals = self.nonterminals
+        if affected is None:
+            affected = nonterminals.keys()
+        affected = [nt for nt in nonterminals if nt in set(affected)]
+        for nt in affected:
+            nonterminals[nt]['first'] = set()
+            nonterminals[nt]['nullable'] = False
+        affected_set = set(affected)
+        worklist = deque(affected)
+        queued = set(affected)
+        while worklist:
+            nt = worklist.popleft()
+            queued.discard(nt)
+            f = set()
+            for prod_id in nonterminals[nt]['prods_lhs']:
+                f.update(first(self, self.prods[prod_id].rhs))
+            if f == nonterminals[nt]['first']:
+                continue
+            nonterminals[nt]['first'] = f
+            nonterminals[nt]['nullable'] = YACV_EPSILON in f
+            for prodno, _ in nonterminals[nt]['prods_rhs']:
+                lhs = self.prods[prodno].lhs
+                if lhs in affected_set and lhs not in queued:
+                    queued.add(lhs)
+                    worklist.append(lhs)
+
+    def build_follow(self, affected=None):
+        # Least fixpoint of FOLLOW over the `affected` nonterminals, same
+        # contract as `build_first`
+        nonterminals = self.nonterminals
+        if affected is None:
+            affected = nonterminals.keys()
+        affected = [nt for nt in nonterminals if nt in set(affected)]
+        start = self.prods[0].lhs
+        for nt in affected:
+            nonterminals[nt]['follow'] = set(['$']) if nt == start else set()
+        affected_set = set(affected)
+        worklist = deque(affected)
+        queued = set(affected)
+        while worklist:
+            nt = worklist.popleft()
+            queued.discard(nt)
+            f = set(nonterminals[nt]['follow'])
+            for prodno, idx in nonterminals[nt]['prods_rhs']:
+                prod = self.prods[prodno]
+                rest = first(self, prod.rhs[idx+1:])
+                if not rest or YACV_EPSILON in rest:
+                    f.update(nonterminals[prod.lhs]['follow'])
+                f.update(rest)
+            f.discard(YACV_EPSILON)
+            if f == nonterminals[nt]['follow']:
+                continue
+            nonterminals[nt]['follow'] = f
+            for prodno in nonterminals[nt]['prods_lhs']:
+                for symbol in self.prods[prodno].rhs:
+                    if symbol in affected_set and symbol not in queued:
+                        queued.add(symbol)
+                        worklist.append(symbol)
+
+    def update(self, changed):
+        # Rebuilds the tables after `prods` was edited and recomputes FIRST
+        # and FOLLOW only for the nonterminals that can be affected by the
+        # `changed` (added and removed) productions. Returns the set of
+        # symbols whose FIRST may have changed
+        old_nonterminals = self.nonterminals
+        old_terminals = set(self.terminals)
+        self.build_tables()
+        nonterminals = self.nonterminals
+        # Symbols that turned from terminals into nonterminals or back
+        flipped = set(old_nonterminals.keys()).symmetric_difference(
+                nonterminals.keys())
+        flipped.update(old_terminals.symmetric_difference(self.terminals))
+        flipped.discard('$')
+        seeds = set(prod.lhs for prod in changed)
+        seeds.update(flipped)
+        if flipped:
+            for prod in self.prods:
+                if any(x in flipped for x in prod.rhs):
+                    seeds.add(prod.lhs)
+        for nt, info in nonterminals.items():
+            if nt in old_nonterminals:
+                old = old_nonterminals[nt]
+                info['first'] = old['first']
+                info['follow'] = old['follow']
+                info['nullable'] = old['nullable']
+        first_affected = self.upward_closure(seeds)
+        self.build_first(first_affected)
+        # FOLLOW changes for the symbols on changed RHS, for the symbols in
+        # front of a symbol whose FIRST changed and for everything that
+        # inherits FOLLOW from those
+        follow_seeds = set(flipped)
+        for prod in changed:
+            follow_seeds.update(prod.rhs)
+        for nt in first_affected:
+            for prodno, idx in nonterminals[nt]['prods_rhs']:
+                follow_seeds.update(self.prods[prodno].rhs[:idx])
+        self.build_follow(self.downward_closure(follow_seeds))
+        self.changed = first_affected.union(flipped)
+        return self.changed
+
+    def check_production(self, prod):
+        if not isinstance(prod, Production):
+            lhs, rhs = prod
+            if isinstance(rhs, str):
+                rhs = rhs.split()
+            rhs = [YACV_EPSILON if x == "\'\'" else x for x in rhs]
+            prod = Production(lhs, rhs or [YACV_EPSILON])
+        if prod.lhs == self.prods[0].lhs or '$' in prod.rhs:
+            raise YACVError('Production {} uses a reserved symbol'.format(prod))
+        return prod
+
+    def add_production(self, lhs, rhs):
+        # `rhs` is a list of symbols or a space separated string
+        prod = self.check_production((lhs, rhs))
+        self.prods.append(prod)
+        self.update([prod])
+        return len(self.prods) - 1
+
+    def remove_production(self, prod_id):
+        # Productions after `prod_id` move up by one
+        if prod_id <= 0 or prod_id >= len(self.prods):
+            raise YACVError('Production {} does not exist or is the ' \
+                    'augmented production'.format(prod_id))
+        prod = self.prods.pop(prod_id)
+        # A nonterminal without productions would silently become a terminal
+        if len(self.prods) == 1 or (\
+                all(prod.lhs != x.lhs for x in self.prods) and \
+                any(prod.lhs in x.rhs for x in self.prods)):
+            self.prods.insert(prod_id, prod)
+            raise YACVError('Cannot remove the only production of {}, ' \
+                    'remove its uses first'.format(prod.lhs))
+        self.update([prod])
+        return prod
+
+    def replace_production(self, prod_id, lhs, rhs):
+        if prod_id <= 0 or prod_id >= len(self.prods):
+            raise YACVError('Production {} does not exist or is the ' \
+                    'augmented production'.format(prod_id))
+        prod = self.check_production((lhs, rhs))
+        old = self.prods[prod_id]
+        self.prods[prod_id] = prod
+        # The start symbol (RHS of the augmented production) never changes
+        start = self.prods[0].rhs[0]
+        if all(x.lhs != start for x in self.prods[1:]):
+            self.prods[prod_id] = old
+            raise YACVError('Cannot replace the only production of the ' \
+                    'start symbol {}'.format(start))
+        self.update([old, prod])
+        return old
 
 if __name__ == '__main__':
     import sys
@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+from xml.sax.saxutils import escape
+from yacv.abstractsyntaxtree import AbstractSyntaxTree
+from yacv.constants import YACV_GRAPHVIZ_COLORS, YACV_EPSILON, \
+        YACV_KEYFRAME_NODE_DX, YACV_KEYFRAME_NODE_DY
+from yacv.replay import ll1_parse_trace, lr_parse_trace, LL1Replay, LRReplay
+
+# Keyframes are plain data, no manim, LaTeX or ffmpeg is needed to make them
+def unescape_symbol(x):
+    # Visualizers escape `$` for LaTeX, keyframes carry the raw symbol
+    return x.replace('\\$', '$')
+
+def prod_text(prod):
+    if prod.rhs[0] == YACV_EPSILON:
+        return '{} -> ϵ'.format(prod.lhs)
+    return '{} -> {}'.format(prod.lhs, ' '.join(prod.rhs))
+
+def prod_color(prod_id, colors):
+    return colors[prod_id % len(colors)]
+
+def forest_layout(roots, terminals, colors):
+    # Ordered forest layout: leaves are placed left to right in DFS order,
+    # parents are centered over their children and terminals sit on the
+    # last level (same as the `rank=sink` subgraph used with graphviz)
+    nodes = {}
+    edges = []
+    order = []
+    next_x = 0
+    max_depth = 0
+    for root in roots:
+        stack = [(root, 0, False)]
+        while stack:
+            tree, depth, expanded = stack.pop(-1)
+            desc = [d for d in tree.desc if d.root != YACV_EPSILON]
+            if not expanded:
+                label = unescape_symbol(tree.root)
+                if len(desc) < len(tree.desc):
+                    label += ' = ϵ'
+                color = None if tree.prod_id is None else \
+                        prod_color(tree.prod_id, colors)
+                nodes[tree.node_id] = {
+                    'id': tree.node_id,
+                    'label': label,
+                    'color': color,
+                    'depth': depth,
+                    'terminal': tree.root in terminals or \
+                        unescape_symbol(tree.root) in terminals
+                }
+                order.append(tree.node_id)
+                max_depth = max(max_depth, depth)
+                for d in desc:
+                    edges.append({
+                        'from': tree.node_id,
+                        'to': d.node_id,
+                        'color': color
+                    })
+                if not desc:
+                    nodes[tree.node_id]['x'] = next_x
+                    next_x += 1
+                    continue
+                stack.append((tree, depth, True))
+                for d in reversed(desc):
+                    stack.append((d, depth + 1, False))
+            else:
+                first, last = nodes[desc[0].node_id], nodes[desc[-1].node_id]
+                nodes[tree.node_id]['x'] = (first['x'] + last['x']) / 2
+    for node_id in order:
+        node = nodes[node_id]
+        node['y'] = max_depth if node['terminal'] else node['depth']
+    return [nodes[n] for n in order], edges
+
+def stack_labels(stack):
+    ret = []
+    for elem in stack:
+        if isinstance(elem, AbstractSyntaxTree):
+            ret.append(unescape_symbol(elem.root))
+        else:
+            ret.append(str(elem))
+    return ret
+
+def keyframe(replay, step, action, status, production, forest, terminals, \
+        colors):
+    nodes, edges = forest_layout(forest, terminals, colors)
+    return {
+        'step': step,
+        'action': action,
+        'status': status,
+        'production': production,
+        'stack': stack_labels(replay.stack),
+        'input': list(replay.remaining),
+        'tree': {
+            'nodes': nodes,
+            'edges': edges
+        }
+    }
+
+def parse_keyframes(algo, parser, string, colors=None):
+    # One keyframe for the initial state and one after every parsing step
+    colors = colors if colors else YACV_GRAPHVIZ_COLORS
+    prods = parser.grammar.prods
+    terminals = set(parser.grammar.terminals)
+    if algo == 'll1':
+        replay = LL1Replay()
+        trace = ll1_parse_trace(parser, string)
+        forest = lambda: replay.popped_stack[:1]
+    else:
+        replay = LRReplay()
+        trace = lr_parse_trace(parser, string)
+        forest = lambda: [x for x in replay.stack \
+                if isinstance(x, AbstractSyntaxTree)]
+    replay.parser = parser
+    replay.reset(string)
+    frames = [keyframe(replay, 0, 'start', 'START', None, forest(), \
+            terminals, colors)]
+    for step, action in enumerate(trace):
+        replay.apply_step(action)
+        production = None
+        if action[0] == 'shift':
+            status = 'SHIFT {}'.format(action[1])
+        elif action[0] == 'match':
+            status = 'Match {}'.format(action[1])
+        elif action[0] == 'accept':
+            status = 'ACCEPT'
+        else:
+            prod_id = action[1]
+            status = prod_text(prods[prod_id])
+            production = {
+                'id': prod_id,
+                'text': status,
+                'color': prod_color(prod_id, colors)
+            }
+        frames.append(keyframe(replay, step + 1, action[0], status, \
+                production, forest(), terminals, colors))
+    return frames
+
+def keyframe_to_svg(frame):
+    dx, dy = YACV_KEYFRAME_NODE_DX, YACV_KEYFRAME_NODE_DY
+    nodes = frame['tree']['nodes']
+    tree_width = (max([n['x'] for n in nodes]) + 1) * dx if nodes else 0
+    tree_height = (max([n['y'] for n in nodes]) + 1) * dy if nodes else 0
+    stack_width = 120
+    width = stack_width + tree_width + 40
+    height = max(tree_height, 30 * len(frame['stack'])) + 140
+    pos = {}
+    for n in nodes:
+        pos[n['id']] = (stack_width + 20 + n['x'] * dx + dx / 2, \
+                80 + n['y'] * dy)
+    out = []
+    out.append('<svg xmlns="http://www.w3.org/2000/svg" width="{:.0f}" '
+            'height="{:.0f}" font-family="sans-serif" font-size="16">'.format(
+                width, height))
+    out.append('<rect width="100%" height="100%" fill="black"/>')
+    status_color = 'yellow' if frame['action'] == 'accept' else \
+            (frame['production']['color'] if frame['production'] else 'white')
+    out.append('<text x="20" y="30" fill="{}">{}</text>'.format(
+        status_color, escape(frame['status'])))
+    for e in frame['tree']['edges']:
+        (x1, y1), (x2, y2) = pos[e['from']], pos[e['to']]
+        out.append('<line x1="{:.1f}" y1="{:.1f}" x2="{:.1f}" y2="{:.1f}" '
+                'stroke="{}"/>'.format(x1, y1 + 8, x2, y2 - 14, \
+                    e['color'] or 'white'))
+    for n in nodes:
+        x, y = pos[n['id']]
+        out.append('<text x="{:.1f}" y="{:.1f}" fill="{}" '
+                'text-anchor="middle">{}</text>'.format(x, y + 5, \
+                    n['color'] or 'white', escape(n['label'])))
+    y = height - 70
+    for i, label in enumerate(frame['stack']):
+        color = 'red' if i == len(frame['stack']) - 1 else 'white'
+        out.append('<text x="60" y="{}" fill="{}" text-anchor="middle">'
+                '{}</text>'.format(y - 30 * i, color, escape(label)))
+    out.append('<text x="60" y="{}" fill="white" text-anchor="middle">'
+            'Stack</text>'.format(height - 45))
+    string = ' '.join(frame['input'])
+    out.append('<text x="{:.0f}" y="{}" fill="white" text-anchor="middle">'
+            'String → [{}]</text>'.format(width / 2, height - 15, \
+                escape(string)))
+    out.append('</svg>')
+    return '\n'.join(out)
+
+def export_keyframes(algo, parser, string, folder, colors=None, svg=False):
+    log = logging.getLogger('yacv')
+    os.makedirs(folder, exist_ok=True)
+    frames = parse_keyframes(algo, parser, string, colors)
+    fname = os.path.join(folder, 'keyframes.json')
+    with open(fname, 'w') as f:
+        json.dump({
+            'algorithm': algo,
+            'string': list(string),
+            'steps': frames
+        }, f, ensure_ascii=False, indent=1)
+    log.info('{} keyframes exported to {}'.format(len(frames), fname))
+    if svg:
+        for frame in frames:
+            svg_fname = os.path.join(folder, \
+                    'step-{:04d}.svg'.format(frame['step']))
+            with open(svg_fname, 'w') as f:
+                f.write(keyframe_to_svg(frame))
+        log.info('SVG keyframes exported to {}'.format(folder))
+    return fname
@@ -0,0 +1,243 @@
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from yacv.constants import YACV_LAYOUT_CACHE_DIR, YACV_LAYOUT_CACHE_MAX_BYTES, \
+        YACV_LAYOUT_CACHE_MAX_MEMORY, YACV_LAYOUT_CACHE_VERSION, \
+        YACV_LAYOUT_ENGINE
+from yacv.treelayout import tidy_layout
+
+# Attributes that only change how a graph is painted and never where
+# graphviz places things. These are left out of the cache key so that
+# re-rendering with a different color scheme reuses the old layout
+YACV_LAYOUT_IGNORED_ATTRS = set(['color', 'fontcolor', 'fillcolor', 'bgcolor'])
+# Defaults graphviz declares on its own the first time it lays out a graph
+# (they then show up on every graph created later in the process). They are
+# graphviz's built-in behaviour anyway, so they are left out of the key
+YACV_LAYOUT_IMPLICIT_ATTRS = set([('label', '\\N')])
+
+class LayoutCache(object):
+    def __init__(self, directory=YACV_LAYOUT_CACHE_DIR, \
+            max_bytes=YACV_LAYOUT_CACHE_MAX_BYTES, \
+            max_memory=YACV_LAYOUT_CACHE_MAX_MEMORY, enabled=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_memory = max_memory
+        self.enabled = enabled
+        # Layouts seen in this process, most recently used last
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        log = logging.getLogger('yacv')
+        if not self.enabled:
+            return None
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        if self.directory is None:
+            return None
+        fname = self.path(key)
+        try:
+            with open(fname) as f:
+                layout = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Touching the file marks it as recently used for eviction
+        try:
+            os.utime(fname, None)
+        except OSError:
+            pass
+        log.debug('Layout {} loaded from {}'.format(key, fname))
+        self.remember(key, layout)
+        return layout
+
+    def put(self, key, layout):
+        log = logging.getLogger('yacv')
+        if not self.enabled:
+            return
+        self.remember(key, layout)
+        if self.directory is None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = self.path(key) + '.{}.tmp'.format(os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(layout, f, separators=(',', ':'))
+            os.replace(tmp, self.path(key))
+        except OSError as e:
+            log.warning('Could not write layout cache entry: {}'.format(e))
+            return
+        self.evict()
+
+    def remember(self, key, layout):
+        self.memory[key] = layout
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory:
+            self.memory.popitem(last=False)
+
+    def evict(self):
+        # Least recently used entries (oldest mtime) go first
+        if self.max_bytes is None:
+            return
+        entries = []
+        total = 0
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            fname = os.path.join(self.directory, name)
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fname))
+            total += st.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, fname in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(fname)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        self.memory.clear()
+        if self.directory is None or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.directory, name))
+
+layout_cache = LayoutCache()
+layout_engine = YACV_LAYOUT_ENGINE
+
+def set_layout_engine(prog=YACV_LAYOUT_ENGINE):
+    global layout_engine
+    layout_engine = prog
+
+def configure_layout_cache(directory=YACV_LAYOUT_CACHE_DIR, \
+        max_bytes=YACV_LAYOUT_CACHE_MAX_BYTES, enabled=True):
+    layout_cache.directory = directory
+    layout_cache.max_bytes = max_bytes
+    layout_cache.enabled = enabled
+    layout_cache.memory.clear()
+    return layout_cache
+
+def canonical_attrs(attrs):
+    return sorted((k, v) for k, v in attrs.items() \
+            if k not in YACV_LAYOUT_IGNORED_ATTRS and v != '' \
+            and (k, v) not in YACV_LAYOUT_IMPLICIT_ATTRS)
+
+def layout_key(G, prog='dot'):
+    # Canonical description of everything graphviz looks at when placing
+    # nodes: structure, labels, subgraph ranks and default attributes. Nodes,
+    # edges and subgraphs are fed in declaration order, dot breaks ties (e.g.
+    # the order of siblings on a rank) by that order, so the same graph
+    # declared in a different order is a different layout
+    h = hashlib.sha1()
+    def feed(x):
+        h.update(repr(x).encode('utf-8'))
+        h.update(b'\n')
+    feed(YACV_LAYOUT_CACHE_VERSION)
+    feed(prog)
+    feed(G.is_directed())
+    feed(canonical_attrs(G.graph_attr))
+    feed(canonical_attrs(G.node_attr))
+    feed(canonical_attrs(G.edge_attr))
+    for n in G.nodes():
+        feed(('node', str(n), canonical_attrs(n.attr)))
+    for e in G.edges():
+        feed(('edge', str(e[0]), str(e[1]), canonical_attrs(e.attr)))
+    stack = list(G.subgraphs())
+    while stack:
+        sg = stack.pop(0)
+        feed(('subgraph', sg.name, canonical_attrs(sg.graph_attr), \
+                [str(n) for n in sg.nodes()]))
+        stack.extend(sg.subgraphs())
+    return h.hexdigest()
+
+def keyed_edges(G):
+    # Yields (u, v, key, edge) for every edge. `G.get_edge(u, v)` only finds
+    # the first of several parallel edges (e.g. two LR transitions between
+    # the same states), so each one is told apart by its key: the edge's name
+    # if it has one, otherwise its position among the unnamed (u, v) edges
+    seen = {}
+    for e in G.edges():
+        u, v = str(e[0]), str(e[1])
+        key = e.name
+        if key is None:
+            key = seen.get((u, v), 0)
+            seen[(u, v)] = key + 1
+        yield u, v, key, e
+
+def extract_layout(G):
+    layout = {
+        'bb': G.graph_attr['bb'],
+        'nodes': {},
+        'edges': []
+    }
+    for n in G.nodes():
+        layout['nodes'][str(n)] = [n.attr['pos'], n.attr['width'], \
+                n.attr['height']]
+    for u, v, key, e in keyed_edges(G):
+        layout['edges'].append([u, v, key, e.attr['pos'], e.attr['lp']])
+    return layout
+
+def apply_layout(G, layout):
+    G.graph_attr['bb'] = layout['bb']
+    for n, (pos, width, height) in layout['nodes'].items():
+        node = G.get_node(n)
+        node.attr['pos'] = pos
+        if width:
+            node.attr['width'] = width
+        if height:
+            node.attr['height'] = height
+    edges = {(u, v, key): e for u, v, key, e in keyed_edges(G)}
+    for u, v, key, pos, lp in layout['edges']:
+        edge = edges[(u, v, key)]
+        if pos:
+            edge.attr['pos'] = pos
+        if lp:
+            edge.attr['lp'] = lp
+    # `draw()` will now reuse the positions instead of running dot again
+    G.has_layout = True
+
+def layout_graph(G, prog=None, cache=None):
+    # Drop in replacement for `G.layout(prog)` that consults the cache first.
+    # The built-in 'tidy' engine runs in process and is not worth caching
+    log = logging.getLogger('yacv')
+    prog = layout_engine if prog is None else prog
+    if prog == 'tidy':
+        return tidy_layout(G)
+    cache = layout_cache if cache is None else cache
+    if not cache.enabled:
+        G.layout(prog)
+        return G
+    key = layout_key(G, prog)
+    layout = cache.get(key)
+    if layout is not None:
+        try:
+            apply_layout(G, layout)
+            cache.hits += 1
+            log.debug('Layout cache hit for {}'.format(key))
+            return G
+        except KeyError:
+            # Stale entry (e.g. hash collision), recompute below
+            log.debug('Layout cache entry {} does not match graph'.format(key))
+    cache.misses += 1
+    G.layout(prog)
+    cache.put(key, extract_layout(G))
+    return G
@@ -3,11 +3,18 @@ import pandas as pd
 from pprint import pprint
 from yacv.grammar import Grammar, first
 from yacv.abstractsyntaxtree import AbstractSyntaxTree
-from yacv.utils import YACVError 
+from yacv.utils import YACVError
+from yacv.asyncparse import feed_tokens, parse_async
+from yacv.tokenids import token_id_view, feed_token_ids
+from yacv.layoutcache import layout_graph
+from yacv.treeexport import syntaxtree_to_dot, export_syntaxtree 
 from yacv.constants import *
 class LL1Parser(object):
-    def __init__(self, fname='ll1-expression-grammar.txt'):
-        self.grammar = Grammar(fname)
+    def __init__(self, fname='ll1-expression-grammar.txt', reduce=False):
+        self.grammar = Grammar(fname, reduce)
+        self.build()
+
+    def build(self):
         # Check for left recursion
         for prod in self.grammar.prods:
             if prod.lhs == prod.rhs[0]:
@@ -19,9 +26,25 @@ class LL1Parser(object):
         )
         self.parsing_table.loc[:,:] = YACV_ERROR
         self.is_ll1 = True
+        self.compiled = None
         # pprint(self.parsing_table)
         self.build_parsing_table()
 
+    def add_production(self, lhs, rhs):
+        prod_id = self.grammar.add_production(lhs, rhs)
+        self.build()
+        return prod_id
+
+    def remove_production(self, prod_id):
+        prod = self.grammar.remove_production(prod_id)
+        self.build()
+        return prod
+
+    def replace_production(self, prod_id, lhs, rhs):
+        prod = self.grammar.replace_production(prod_id, lhs, rhs)
+        self.build()
+        return prod
+
     def build_parsing_table(self):
         for prod in self.grammar.prods:
             lhs, rhs = prod.lhs, prod.rhs
@@ -47,30 +70,127 @@ class LL1Parser(object):
         else:
             logging.getLogger('yacv').warning('Grammar is not LL(1). 2 or more entries present in at least one cell in parsing table')
 
-    def parse(self, string):
-        log = logging.getLogger('yacv')
-        if not self.is_ll1:
-            print(self.grammar.nonterminals)
-            raise YACVError('Grammar is not LL(1). The parsing cannot proceed')
+    def parse(self, string, actions=None, recognize=False):
         # string: list of terminals
         if string[-1] != '$':
             string.append('$')
+        return feed_tokens(self.parse_steps(actions, recognize), string)
+
+    def recognize(self, string):
+        # Only checks whether the string is in the language, no tree or value
+        # is built
+        try:
+            return self.parse(list(string), recognize=True)
+        except YACVError:
+            return False
+
+    def parse_ids(self, ids, actions=None, recognize=False, fmt=None):
+        # `ids` is a buffer of token ids (positions in `grammar.terminals`),
+        # walked in place, see yacv.tokenids
+        return feed_token_ids(self.parse_steps(actions, recognize), \
+                token_id_view(ids, fmt), self.grammar.terminals)
+
+    async def aparse(self, tokens, timeout=None, actions=None, \
+            recognize=False):
+        # `tokens` is an async iterable of terminals, see yacv.asyncparse
+        return await parse_async(self, tokens, timeout, actions, recognize)
+
+    def compiled_table(self):
+        # table[nonterminal][terminal] is the id of the production to expand,
+        # error entries are left out
+        if self.compiled is not None:
+            return self.compiled
+        table = {}
+        for nt, row in zip(self.parsing_table.index, \
+                self.parsing_table.itertuples(index=False)):
+            table[nt] = {}
+            for terminal, entry in zip(self.parsing_table.columns, row):
+                if isinstance(entry, list):
+                    table[nt][terminal] = self.grammar.prods.index(entry[0])
+        self.compiled = table
+        return table
+
+    def parse_steps(self, actions=None, recognize=False):
+        # Generator core of the parser: `a = yield` asks the driver for the
+        # next terminal, the syntax tree is the return value. With `actions`
+        # (a dict of production id -> callable) no tree is built: expanding a
+        # production leaves its id on the stack below the children, once the
+        # children are matched the marker is popped and the production's
+        # value is `actions[prod_id](*values of the children)`. Terminals are
+        # their own value and productions without an action take the value
+        # of their first child (None when empty). The value of the start
+        # symbol is returned. With `recognize` only grammar symbols are kept
+        # on the stack and True is returned
+        log = logging.getLogger('yacv')
+        if not self.is_ll1:
+            raise YACVError('Grammar is not LL(1). The parsing cannot proceed')
+        table = self.compiled_table()
+        prods = self.grammar.prods
+        terminals = set(self.grammar.terminals)
+        debug = log.isEnabledFor(logging.DEBUG)
+        # Position of `a` in the input, for the error messages
+        i = 0
+        if actions is not None or recognize:
+            stack = ['S\'']
+            values = []
+            a = yield
+            while stack[-1] != '$':
+                top = stack[-1]
+                if isinstance(top, int):
+                    stack.pop(-1)
+                    rhs = prods[top].rhs
+                    n = 0 if rhs[0] == YACV_EPSILON else len(rhs)
+                    children = values[len(values)-n:]
+                    del values[len(values)-n:]
+                    if top in actions:
+                        values.append(actions[top](*children))
+                    else:
+                        values.append(children[0] if children else None)
+                elif top == a:
+                    stack.pop(-1)
+                    if not recognize:
+                        values.append(a)
+                    a = yield
+                    i += 1
+                elif top in terminals:
+                    raise YACVError('Expected {} but got {} (position {})'\
+                            .format(top, a, i))
+                else:
+                    prod_id = table[top].get(a)
+                    if prod_id is None:
+                        raise YACVError('No production of {} starts with {} '\
+                                '(position {})'.format(top, a, i))
+                    stack.pop(-1)
+                    if not recognize:
+                        stack.append(prod_id)
+                    rhs = prods[prod_id].rhs
+                    if rhs[0] != YACV_EPSILON:
+                        stack.extend(reversed(rhs))
+            if a != '$':
+                raise YACVError('Cannot parse the remainder of string ' \
+                        'starting at {} (position {})'.format(a, i))
+            return True if recognize else values[-1]
         stack = [AbstractSyntaxTree('S\'')]
         popped_stack = []
+        a = yield
         while stack[-1].root != '$':
             # Don't assign, destroys the tree ref
-            a = string[0]
             if stack[-1].root == a:
                 popped_stack.append(stack.pop(-1))
-                a = string.pop(0)
-            elif stack[-1].root in self.grammar.terminals:
-                raise ValueError('Error because top = {}, terminal'.format(top))
-            elif self.parsing_table.at[stack[-1].root, a] == YACV_ERROR:
-                raise ValueError('Error because parsing table errored out')
-            elif self.parsing_table.at[stack[-1].root, a] != YACV_ACCEPT:
-                prod = self.parsing_table.at[stack[-1].root, a][0]
-                stack[-1].prod_id = self.grammar.prods.index(prod)
-                log.debug('Expanding production : {}'.format(prod))
+                a = yield
+                i += 1
+            elif stack[-1].root in terminals:
+                raise YACVError('Expected {} but got {} (position {})'.format(\
+                        stack[-1].root, a, i))
+            elif a not in table[stack[-1].root]:
+                raise YACVError('No production of {} starts with {} ' \
+                        '(position {})'.format(stack[-1].root, a, i))
+            else:
+                prod_id = table[stack[-1].root][a]
+                prod = prods[prod_id]
+                stack[-1].prod_id = prod_id
+                if debug:
+                    log.debug('Expanding production : {}'.format(prod))
                 desc_list = []
                 for symbol in prod.rhs:
                     x = AbstractSyntaxTree(symbol)
@@ -80,11 +200,12 @@ class LL1Parser(object):
                 if prod.rhs[0] != YACV_EPSILON:
                     for i in range(len(desc_list)-1, -1, -1):
                         stack.append(desc_list[i])
-                log.debug(list(reversed(stack)))
-                log.debug('End of iteration' + 16*'-')
-        if len(string) > 0 and string[0] != '$':
-            raise YACVError('Cannot parse the remainder of string {}'.format(
-                ''.join(string)))
+                if debug:
+                    log.debug(list(reversed(stack)))
+                    log.debug('End of iteration' + 16*'-')
+        if a != '$':
+            raise YACVError('Cannot parse the remainder of string starting ' \
+                    'at {} (position {})'.format(a, i))
         return popped_stack[0]
     
     def visualize_syntaxtree(self, string, colors=None):
@@ -98,84 +219,21 @@ class LL1Parser(object):
         log.info('String successfully parsed')
         if tree.root == 'S\'':
             tree = tree.desc[0]
-        G = pgv.AGraph(name='AbstractSyntaxTree', directed=True)
-        node_id = 0
-        stack = [(tree, node_id)]
-        terminals = self.grammar.terminals
-        prods = []
-        while stack:
-            top, node = stack.pop(0)
-            if str(node) not in G.nodes():
-                G.add_node(node_id, label=top.root)
-                node_id += 1
-            if top.prod_id is not None:
-                color = YACV_GRAPHVIZ_COLORS[top.prod_id % len(YACV_GRAPHVIZ_COLORS)]
-                G.get_node(node).attr['fontcolor'] = color
-            desc_ids = []
-            for desc in top.desc:
-                if desc.root == YACV_EPSILON:
-                   label = G.get_node(node).attr['label'] 
-                   label = '<' + label + ' = &#x3B5;>'
-                   G.get_node(node).attr['label'] = label
-                   break
-                G.add_node(node_id, label=desc.root)
-                G.add_edge(node, node_id, color=color)
-                desc_ids.append(node_id)
-                stack.append((desc, node_id))
-                node_id += 1
-            prods.append(desc_ids)
-
-        # Perform a DFS to get proper order of terminals
-        terminal_nodes = []
-        stack = [G.nodes()[0]]
-        visited = []
-        while stack:
-            node = stack.pop(-1)
-            if node not in visited:
-                visited.append(node)
-                if node.attr['label'] in terminals:
-                    terminal_nodes.append(node)
-                for i in range(len(G.successors(node))-1, -1, -1):
-                    stack.append(G.successors(node)[i])
-                # stack.extend(G.successors(node))
-        log.debug('Terminal nodes : {}'.format(terminal_nodes))
-        for i, prod in enumerate(prods):
-            nonterminals = []
-            for node_id in prod:
-                if G.get_node(node_id).attr['label'] in terminals:
-                    continue
-                nonterminals.append(G.get_node(node_id))
-            if len(nonterminals) <= 1:
-                continue
-            nt = G.subgraph(nonterminals, name='Production' + str(i))
-            nt.graph_attr['rank'] = 'same'
-            for j in range(len(nt.nodes())-1):
-                log.debug('Adding edge from c.nodes()[{}]={} to c.nodes()[{}]={}'.format(
-                    j, nonterminals[j], j+1, nonterminals[j+1]
-                ))
-                nt.add_edge(nonterminals[j], nonterminals[j+1], \
-                        style='invis', weight=YACV_GRAPHVIZ_INFINITY)
-        
-        t = G.add_subgraph(terminal_nodes, name='Terminals')
-        t.graph_attr['rank'] = 'max'
-        for i in range(len(t.nodes())-1):
-            log.debug('Adding edge from c.nodes()[{}]={} to c.nodes()[{}]={}'.format(
-                i, terminal_nodes[i], i+1, terminal_nodes[i+1]
-            ))
-            t.add_edge(terminal_nodes[i], terminal_nodes[i+1], style='invis')
-        
-
-        G.edge_attr['dir'] = 'none'
-        G.node_attr['ordering'] = 'out'
-        G.node_attr['shape'] = 'none'
-        G.node_attr['height'] = 0
-        G.node_attr['width'] = 0
-        G.node_attr['margin'] = 0.1
-        G.layout('dot')
-        G.write('thumbnail_sample.dot')
+        G = pgv.AGraph(string=syntaxtree_to_dot(tree, self.grammar.terminals, \
+                YACV_GRAPHVIZ_COLORS))
+        layout_graph(G)
         log.info('Parse tree successfully visualized')
         return G
 
+    def export_syntaxtree(self, string, fname, colors=None, fmt=None, \
+            layout='dot', stream=False):
+        # Writes the syntax tree to `fname`, see yacv.treeexport
+        tree = self.parse(string)
+        if tree.root == 'S\'':
+            tree = tree.desc[0]
+        return export_syntaxtree(tree, self.grammar.terminals, fname, \
+                colors, fmt, layout, stream)
+
 
 
 if __name__ == '__main__':
@@ -1,11 +1,19 @@
 import logging
+import os
+import numpy as np
 import pandas as pd
 from pprint import pprint
 from copy import deepcopy
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from yacv.grammar import Grammar, first
-from yacv.abstractsyntaxtree import AbstractSyntaxTree
+from yacv.abstractsyntaxtree import AbstractSyntaxTree, wrap_units, \
+        restore_units
 from yacv.utils import YACVError
+from yacv.asyncparse import feed_tokens, parse_async
+from yacv.tokenids import token_id_view, feed_token_ids
+from yacv.layoutcache import layout_graph
+from yacv.treeexport import syntaxtree_to_dot, export_syntaxtree
 from yacv.constants import *
 class LRItem(object):
     def __init__(self, production=None, dot_pos=0, lookaheads=[]):
@@ -89,10 +97,168 @@ class LRAutomatonState(object):
     def __ne__(self, other):
         return not self == other
 
+def closure_template(grammar, nt):
+    # Grammar level closure of `nt`, i.e. of any item `X -> a . nt b`. When
+    # the item `nt -> . c` gets the lookaheads L, every nonterminal B in the
+    # closure gets `spont[B]` plus L if B is in `prop`. `leads` are the
+    # nonterminals right after the dot in the productions of `nt`, in order
+    info = grammar.nonterminals[nt]
+    if info['closure'] is not None:
+        return info['closure']
+    nonterminals = grammar.nonterminals
+    leads = []
+    order = [nt]
+    spont = {nt: set()}
+    prop = set([nt])
+    # Every `C -> . B rest` in the closure as (B, FIRST(rest) - e, nullable)
+    edges = {}
+    i = 0
+    while i < len(order):
+        lhs = order[i]
+        i += 1
+        edges[lhs] = []
+        for prod_id in nonterminals[lhs]['prods_lhs']:
+            rhs = grammar.prods[prod_id].rhs
+            symbol = rhs[0]
+            if symbol not in nonterminals:
+                continue
+            f = first(grammar, rhs[1:])
+            edges[lhs].append((symbol, f.difference([YACV_EPSILON]), \
+                    not f or YACV_EPSILON in f))
+            if lhs == nt and symbol not in leads:
+                leads.append(symbol)
+            if symbol not in spont:
+                spont[symbol] = set()
+                order.append(symbol)
+    # Least fixpoint of the lookaheads, a nonterminal is revisited only when
+    # its own lookaheads grow
+    worklist = deque(order)
+    queued = set(order)
+    while worklist:
+        lhs = worklist.popleft()
+        queued.discard(lhs)
+        for symbol, f, nullable in edges[lhs]:
+            new = f.union(spont[lhs]) if nullable else f
+            grows = not new.issubset(spont[symbol])
+            if nullable and lhs in prop and symbol not in prop:
+                prop.add(symbol)
+                grows = True
+            if grows:
+                spont[symbol].update(new)
+                if symbol not in queued:
+                    queued.add(symbol)
+                    worklist.append(symbol)
+    info['closure'] = {'leads': leads, 'spont': spont, 'prop': prop}
+    return info['closure']
+
+def compute_closure(grammar, i):
+    # Union of the closure templates of the nonterminals after the dot. The
+    # items are ordered like a breadth first expansion of the kernel, which
+    # only depends on the order the nonterminals are first expanded in
+    items = list(i) if isinstance(i, list) else [i]
+    nonterminals = grammar.nonterminals
+    ret = []
+    lookaheads = []
+    index = {}
+    for item in items:
+        assert isinstance(item, LRItem)
+        # Cores compare like their strings, duplicate productions are merged
+        key = (item.production.lhs, tuple(item.production.rhs), item.dot_pos)
+        if key in index:
+            lookaheads[index[key]].update(item.lookaheads)
+            continue
+        index[key] = len(ret)
+        ret.append((item.production, item.dot_pos))
+        lookaheads.append(set(item.lookaheads))
+    expanded = []
+    seen = set()
+    la = {}
+    for (prod, dot_pos), item_lookaheads in zip(list(ret), list(lookaheads)):
+        if dot_pos == len(prod.rhs):
+            continue
+        symbol = prod.rhs[dot_pos]
+        if symbol not in nonterminals:
+            continue
+        if symbol not in seen:
+            seen.add(symbol)
+            expanded.append(symbol)
+            la.setdefault(symbol, set())
+        if not item_lookaheads:
+            continue
+        f = first(grammar, prod.rhs[dot_pos+1:])
+        if not f or YACV_EPSILON in f:
+            f = f.union(item_lookaheads)
+        f.discard(YACV_EPSILON)
+        template = closure_template(grammar, symbol)
+        for nt, spont in template['spont'].items():
+            if nt not in la:
+                la[nt] = set()
+            la[nt].update(spont)
+            if nt in template['prop']:
+                la[nt].update(f)
+    j = 0
+    while j < len(expanded):
+        for symbol in closure_template(grammar, expanded[j])['leads']:
+            if symbol not in seen:
+                seen.add(symbol)
+                expanded.append(symbol)
+                la.setdefault(symbol, set())
+        j += 1
+    for nt in expanded:
+        for prod_id in nonterminals[nt]['prods_lhs']:
+            prod = grammar.prods[prod_id]
+            key = (prod.lhs, tuple(prod.rhs), 0)
+            if key in index:
+                lookaheads[index[key]].update(la[nt])
+                continue
+            index[key] = len(ret)
+            ret.append((prod, 0))
+            lookaheads.append(la[nt])
+    return [LRItem(prod, dot_pos, sorted(item_lookaheads)) \
+            for (prod, dot_pos), item_lookaheads in zip(ret, lookaheads)]
+
+# Closures computed by the parallel LR builder's worker processes. Items are
+# sent as (production id, dot position, lookaheads) tuples, each worker keeps
+# its own copy of the grammar
+closure_worker_grammar = None
+
+def init_closure_worker(grammar):
+    global closure_worker_grammar
+    closure_worker_grammar = grammar
+
+def closure_worker(kernels):
+    grammar = closure_worker_grammar
+    prod_ids = {id(prod): i for i, prod in enumerate(grammar.prods)}
+    ret = []
+    for kernel in kernels:
+        items = [LRItem(grammar.prods[prod_id], dot_pos, list(lookaheads)) \
+                for prod_id, dot_pos, lookaheads in kernel]
+        ret.append([(prod_ids[id(item.production)], item.dot_pos, \
+                tuple(item.lookaheads)) for item in compute_closure(grammar, items)])
+    return ret
+
 class LRParser(object):
-    def __init__(self, fname='another-grammar.txt'):
-        self.grammar = Grammar(fname)
+    def __init__(self, fname='another-grammar.txt', reduce=False, workers=1, \
+            bypass_units=False, lazy_units=False):
+        self.grammar = Grammar(fname, reduce)
+        # Closures of kernels, reused when the automaton is rebuilt after
+        # the grammar is edited. Only the kernels used by the last build are
+        # kept (`closure_used`), so edits don't grow it without bound
+        self.closure_cache = {}
+        self.closure_used = set()
+        # Processes used to build the automaton, None means all the cores
+        self.workers = workers
+        # Skip unit reductions in `parse`, see `unit_gotos`. With
+        # `lazy_units` the skipped nodes are not built, they are recorded on
+        # the node instead (see `restore_units`)
+        self.bypass_units = bypass_units
+        self.lazy_units = lazy_units
+        self.build()
+
+    def build(self):
         self.is_valid = True
+        self.compiled = None
+        self.closure_used = set()
         self.automaton_states = []
         self.automaton_transitions = OrderedDict()
         self.automaton_built = False
@@ -109,175 +275,428 @@ class LRParser(object):
         self.parsing_table_built = False
         self.build_parsing_table()
 
-    def closure(self, i):
+    def rebuild(self, changed):
+        # Drops the cached closures that involve any of the `changed` symbols
+        # and rebuilds the automaton and the parsing table, every other
+        # closure is reused
         log = logging.getLogger('yacv')
-        queue = i if isinstance(i, list) else [i]
-        ret = []
-        log.debug('Computing closure of {}'.format(queue))
-        while queue:
-            item = queue.pop(0)
-            assert isinstance(item, LRItem)
-            ret.append(item)
-            log.debug('item = {}, reduce = {}'.format(item, item.reduce))
-            if item.reduce:
-                continue
-            next_symbol = item.production.rhs[item.dot_pos]
-            log.debug('next_symbol = {}'.format(next_symbol))
-            if next_symbol == YACV_EPSILON \
-            or next_symbol in self.grammar.terminals:
-                continue
-            prod_ids = self.grammar.nonterminals[next_symbol]['prods_lhs']
-            log.debug('new_prod_ids = {}'.format(prod_ids))
-            for prod_id in prod_ids:
-                prod = self.grammar.prods[prod_id]
-                log.debug(type(item.lookaheads))
-                if item.lookaheads:
-                    f = first(self.grammar, 
-                            item.production.rhs[item.dot_pos+1:])
-                    if not f or YACV_EPSILON in f:
-                        f = f.union(set(item.lookaheads))
-                    f = f.difference([YACV_EPSILON])
-                else:
-                    f = []
-                new_item = LRItem(prod, 0, f)
-                log.debug('new_item = {}'.format(new_item))
-                if new_item not in queue and new_item not in ret:
-                    queue.append(new_item)
-        kernel_lookaheads = OrderedDict()
-        for item in ret:
-            kernel = LRItem(item.production, item.dot_pos)
-            key = str(kernel)
-            if key not in kernel_lookaheads.keys():
-                kernel_lookaheads[key] = {
-                    'kernel': kernel,
-                    'lookaheads': []
-                }
-            curr = kernel_lookaheads[key]['lookaheads']
-            curr = sorted(list(set(curr).union(item.lookaheads)))
-            kernel_lookaheads[key]['lookaheads'] = curr
-        ret = []
-        for key, val in kernel_lookaheads.items():
-            kernel, lookaheads = val['kernel'], val['lookaheads']
-            item = LRItem(kernel.production, kernel.dot_pos, lookaheads)
-            ret.append(item)
-        return ret
+        changed = set(changed)
+        stale = [key for key, (symbols, _) in self.closure_cache.items() \
+                if not symbols.isdisjoint(changed)]
+        for key in stale:
+            del self.closure_cache[key]
+        log.info('Rebuilding LR automaton, {} of {} cached closures are ' \
+                'stale'.format(len(stale), len(stale) + len(self.closure_cache)))
+        self.build()
+        unused = [key for key in self.closure_cache \
+                if key not in self.closure_used]
+        for key in unused:
+            del self.closure_cache[key]
+        log.debug('Dropped {} closures not used by the new automaton'.format(\
+                len(unused)))
+
+    def add_production(self, lhs, rhs):
+        prod_id = self.grammar.add_production(lhs, rhs)
+        self.rebuild(self.grammar.changed)
+        return prod_id
+
+    def remove_production(self, prod_id):
+        prod = self.grammar.remove_production(prod_id)
+        self.rebuild(self.grammar.changed)
+        return prod
+
+    def replace_production(self, prod_id, lhs, rhs):
+        prod = self.grammar.replace_production(prod_id, lhs, rhs)
+        self.rebuild(self.grammar.changed)
+        return prod
+
+    def closure_key(self, items):
+        return tuple((item.production.lhs, tuple(item.production.rhs), \
+                item.dot_pos, tuple(sorted(item.lookaheads))) for item in items)
+
+    def cache_closure(self, key, closure):
+        symbols = set()
+        for item in closure:
+            symbols.add(item.production.lhs)
+            symbols.update(item.production.rhs)
+        self.closure_cache[key] = (frozenset(symbols), \
+                [(item.production, item.dot_pos, item.lookaheads) \
+                    for item in closure])
+
+    def closure(self, i):
+        items = i if isinstance(i, list) else [i]
+        key = self.closure_key(items)
+        if key not in self.closure_cache:
+            self.cache_closure(key, self.compute_closure(items))
+        self.closure_used.add(key)
+        # States own their items (LALR(1) merges lookaheads in place)
+        return [LRItem(prod, dot_pos, list(lookaheads)) \
+                for prod, dot_pos, lookaheads in self.closure_cache[key][1]]
+
+    def compute_closure(self, i):
+        return compute_closure(self.grammar, i)
 
     def build_automaton_from_init(self, init):
         log = logging.getLogger('yacv')
         if self.automaton_built:
             log.warn('Automaton is already built!')
             return
+        if self.workers != 1:
+            self.build_automaton_parallel(init)
+            return
+        # States are compared through their items, indexed by the same key
+        state_key = lambda state: tuple(str(item) for item in state.items)
+        state_ids = {state_key(init): 0}
         self.automaton_states.append(init)
         self.automaton_transitions[0] = OrderedDict()
-        visited_states = []
-        to_visit = [init]
+        to_visit = deque([0])
         while to_visit:
-            curr = to_visit.pop(0)
-            curr_idx = self.automaton_states.index(curr)
+            curr_idx = to_visit.popleft()
+            curr = self.automaton_states[curr_idx]
             log.debug('curr = {}'.format(curr))
-            visited_states.append(curr)
-            tmp_items = deepcopy(curr.items)
-            next_symbols = OrderedDict()
-            for item in tmp_items:
-                if item.reduce:
-                    continue
-                key = item.production.rhs[item.dot_pos]
-                if key not in next_symbols.keys():
-                    next_symbols[key] = []
-                item.dot_pos += 1
-                item.update_reduce()
-                next_symbols[key].append(item)
-            for key, items in next_symbols.items():
+            for key, items in self.goto_kernels(curr).items():
                 next_state = LRAutomatonState(self.closure(items))
                 log.debug(next_state)
-                if next_state not in self.automaton_states:
+                skey = state_key(next_state)
+                if skey not in state_ids:
                     # Is next_state completely new ?
                     log.debug('Adding new state {}'.format(next_state))
+                    state_ids[skey] = len(self.automaton_states)
                     self.automaton_states.append(next_state)
                     self.automaton_transitions[len(self.automaton_states)-1] = \
                         OrderedDict()
-                    to_visit.append(next_state)
-                elif next_state not in visited_states:
-                    # next_state is not new but is not visited either
-                    to_visit.append(next_state)
+                    to_visit.append(state_ids[skey])
                 else:
-                    # next_state already exists and is visited
-                    log.debug('State {} is already visited'.format(next_state))
-                next_idx = self.automaton_states.index(next_state)
-                self.automaton_transitions[curr_idx][key] = next_idx
+                    # next_state already exists
+                    log.debug('State {} is already known'.format(next_state))
+                self.automaton_transitions[curr_idx][key] = state_ids[skey]
         log.debug('to_visit = empty')
         self.automaton_built = True
 
+    def goto_kernels(self, state):
+        # Kernels of the successors of `state`, in the order the serial
+        # builder discovers them
+        next_symbols = OrderedDict()
+        for item in state.items:
+            if item.reduce:
+                continue
+            key = item.production.rhs[item.dot_pos]
+            if key not in next_symbols.keys():
+                next_symbols[key] = []
+            next_symbols[key].append(LRItem(item.production, \
+                item.dot_pos + 1, item.lookaheads))
+        return next_symbols
+
+    def build_automaton_parallel(self, init):
+        # Breadth first like `build_automaton_from_init`, one frontier at a
+        # time. The goto kernels of the whole frontier are collected and
+        # deduplicated here, in the serial discovery order, and only the
+        # closures of new kernels are computed in the worker processes. A
+        # goto state is fully determined by its kernel, so the numbering (and
+        # the parsing table) is identical to the serial builder
+        log = logging.getLogger('yacv')
+        workers = self.workers or os.cpu_count() or 1
+        prod_ids = {id(prod): i for i, prod in enumerate(self.grammar.prods)}
+        kernel_ids = {}
+        executor = None
+        self.automaton_states.append(init)
+        self.automaton_transitions[0] = OrderedDict()
+        frontier = [0]
+        try:
+            while frontier:
+                new_kernels = []
+                for curr_idx in frontier:
+                    curr = self.automaton_states[curr_idx]
+                    for symbol, items in self.goto_kernels(curr).items():
+                        key = tuple((prod_ids[id(item.production)], \
+                                item.dot_pos, tuple(sorted(item.lookaheads))) \
+                                for item in items)
+                        if key not in kernel_ids:
+                            kernel_ids[key] = len(self.automaton_states) + \
+                                    len(new_kernels)
+                            new_kernels.append((key, items))
+                        self.automaton_transitions[curr_idx][symbol] = \
+                                kernel_ids[key]
+                todo = [(key, items) for key, items in new_kernels \
+                        if self.closure_key(items) not in self.closure_cache]
+                if workers > 1 and len(todo) >= YACV_LR_PARALLEL_MIN_BATCH:
+                    if executor is None:
+                        executor = ProcessPoolExecutor(workers, \
+                                initializer=init_closure_worker, \
+                                initargs=(self.grammar,))
+                    size = -(-len(todo) // (4 * workers))
+                    chunks = [todo[j:j+size] for j in range(0, len(todo), size)]
+                    results = executor.map(closure_worker, \
+                            [[key for key, _ in chunk] for chunk in chunks])
+                    for chunk, closures in zip(chunks, results):
+                        for (_, items), closure in zip(chunk, closures):
+                            self.cache_closure(self.closure_key(items), \
+                                [LRItem(self.grammar.prods[prod_id], dot_pos, \
+                                    list(lookaheads)) \
+                                    for prod_id, dot_pos, lookaheads in closure])
+                frontier = []
+                for _, items in new_kernels:
+                    self.automaton_states.append(LRAutomatonState(\
+                            self.closure(items)))
+                    frontier.append(len(self.automaton_states) - 1)
+                    self.automaton_transitions[frontier[-1]] = OrderedDict()
+                log.debug('Frontier of {} states, {} closures computed in ' \
+                        'parallel'.format(len(frontier), len(todo)))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        log.info('LR automaton with {} states built using {} workers'.format(\
+                len(self.automaton_states), workers))
+        self.automaton_built = True
+
     def build_parsing_table(self):
         pass
 
-    def parse(self, string):
+    def fill_parsing_table(self, cells):
+        # `cells` maps (state, column) to an entry, everything else is an error
+        table = self.parsing_table
+        columns = {col: i for i, col in enumerate(table.columns)}
+        values = np.full(table.shape, YACV_ERROR, dtype=object)
+        for (state_id, col), entry in cells.items():
+            values[state_id, columns[col]] = entry
+        self.parsing_table = pd.DataFrame(values, index=table.index, \
+                columns=table.columns)
+
+    def resolve_conflicts(self, cells):
+        # Shift/reduce conflicts between a terminal and a production that
+        # both have a declared precedence are settled like yacc: the higher
+        # level wins, on the same level %left reduces, %right shifts and
+        # %nonassoc makes the cell an error. Other conflicts are kept. Updates
+        # `cells` and `is_valid` in place, returns the number of resolved cells
+        log = logging.getLogger('yacv')
+        grammar = self.grammar
+        if not grammar.precedence:
+            return 0
+        resolved = 0
+        for key in list(cells.keys()):
+            entries = cells[key]
+            kind, symbol = key[1]
+            if kind != YACV_ACTION or not isinstance(entries, list) or \
+                    len(entries) < 2:
+                continue
+            shifts = [x for x in entries if x[0] == YACV_SHIFT]
+            reduces = [x for x in entries if x[0] == YACV_REDUCE]
+            terminal = grammar.precedence.get(symbol)
+            if len(shifts) != 1 or len(reduces) != 1 or terminal is None:
+                continue
+            prod = grammar.prod_precedence(int(reduces[0][1:]))
+            if prod is None:
+                continue
+            if prod[0] != terminal[0]:
+                keep = reduces if prod[0] > terminal[0] else shifts
+            elif terminal[1] == 'left':
+                keep = reduces
+            elif terminal[1] == 'right':
+                keep = shifts
+            else:
+                keep = []
+            log.debug('State {}, {}: {} resolved to {}'.format(key[0], \
+                    symbol, entries, keep if keep else YACV_ERROR))
+            if keep:
+                cells[key] = keep
+            else:
+                del cells[key]
+            resolved += 1
+        self.is_valid = all(not isinstance(x, list) or len(x) < 2 \
+                for x in cells.values())
+        if resolved:
+            log.info('Resolved {} shift/reduce conflicts with precedence ' \
+                    'declarations'.format(resolved))
+        return resolved
+
+    def parse(self, string, actions=None, recognize=False):
+        assert len(string) > 0
+        if string[-1] != '$':
+            string.append('$')
+        return feed_tokens(self.parse_steps(actions, recognize), string)
+
+    def recognize(self, string):
+        # Only checks whether the string is in the language, no tree or value
+        # is built
+        try:
+            return self.parse(list(string), recognize=True)
+        except (YACVError, ValueError):
+            return False
+
+    def parse_ids(self, ids, actions=None, recognize=False, fmt=None):
+        # `ids` is a buffer of token ids (positions in `grammar.terminals`),
+        # walked in place, see yacv.tokenids
+        return feed_token_ids(self.parse_steps(actions, recognize), \
+                token_id_view(ids, fmt), self.grammar.terminals)
+
+    async def aparse(self, tokens, timeout=None, actions=None, \
+            recognize=False):
+        # `tokens` is an async iterable of terminals, see yacv.asyncparse
+        return await parse_async(self, tokens, timeout, actions, recognize)
+
+    def compiled_table(self):
+        # The parsing table as plain dicts for the parser's inner loop:
+        # action[state][terminal] is ('s', state), ('r', prod_id, lhs, number
+        # of symbols popped) or ('acc',) and goto[state][nonterminal] is a
+        # state. Error entries are left out, conflicting cells use their first
+        # entry like `parse` always did
+        if self.compiled is not None:
+            return self.compiled
+        assert self.parsing_table_built
+        action = {}
+        goto = {}
+        prods = self.grammar.prods
+        for state_id, row in zip(self.parsing_table.index, \
+                self.parsing_table.itertuples(index=False)):
+            action[state_id] = {}
+            goto[state_id] = {}
+            for (kind, symbol), entry in zip(self.parsing_table.columns, row):
+                if isinstance(entry, list):
+                    entry = entry[0]
+                if entry == YACV_ERROR:
+                    continue
+                if kind == YACV_GOTO:
+                    goto[state_id][symbol] = int(entry)
+                elif entry == YACV_ACCEPT:
+                    action[state_id][symbol] = ('acc',)
+                elif entry[0] == 's':
+                    action[state_id][symbol] = ('s', int(entry[1:]))
+                else:
+                    prod = prods[int(entry[1:])]
+                    n = 0 if prod.rhs[0] == YACV_EPSILON else len(prod.rhs)
+                    action[state_id][symbol] = ('r', int(entry[1:]), \
+                            prod.lhs, n)
+        units = self.unit_gotos(action, goto) if self.bypass_units else {}
+        self.compiled = (action, goto, units)
+        return self.compiled
+
+    def unit_gotos(self, action, goto):
+        # Unit reductions (A -> B, B a nonterminal) taken right after a goto
+        # on B, precomputed per lookahead. units[state][B][a] is (final state,
+        # elided production ids, innermost first): after a reduction to B that
+        # exposes `state` with lookahead `a`, the parser jumps to the final
+        # state as if it had reduced by every elided production. The states
+        # visited are exactly the ones the plain table would visit, so errors
+        # are detected at the same token
+        prods = self.grammar.prods
+        nonterminals = self.grammar.nonterminals
+        unit = set(prod_id for prod_id, prod in enumerate(prods) \
+                if len(prod.rhs) == 1 and prod.rhs[0] in nonterminals)
+        units = {}
+        elided_count = 0
+        for state_id, row in goto.items():
+            for symbol, target in row.items():
+                hops = {}
+                for a in action[target]:
+                    elided = []
+                    state = target
+                    while len(elided) < len(unit):
+                        entry = action[state].get(a)
+                        if entry is None or entry[0] != 'r' or \
+                                entry[1] not in unit:
+                            break
+                        next_state = row.get(entry[2])
+                        if next_state is None:
+                            break
+                        elided.append(entry[1])
+                        state = next_state
+                    if elided:
+                        hops[a] = (state, tuple(elided))
+                        elided_count += 1
+                if hops:
+                    units.setdefault(state_id, {})[symbol] = hops
+        logging.getLogger('yacv').debug('{} goto/lookahead pairs skip unit ' \
+                'reductions'.format(elided_count))
+        return units
+
+    def parse_steps(self, actions=None, recognize=False):
+        # Generator core of the parser: `a = yield` asks the driver for the
+        # next terminal, the syntax tree is the return value. With `actions`
+        # (a dict of production id -> callable) no tree is built, the value
+        # of a reduction is `actions[prod_id](*values of the children)`,
+        # terminals are their own value and productions without an action
+        # take the value of their first child (None when empty). With
+        # `recognize` only the state stack is kept and True is returned
         log = logging.getLogger('yacv')
         if not self.is_valid:
             raise YACVError('Given grammar is not valid for chosen parsing algorithm. Parsing will not continue')
         # page 7 at below link is really helpful
         # https://www2.cs.duke.edu/courses/spring02/cps140/lects/sectlrparseS.pdf
         assert self.parsing_table_built
-        assert len(string) > 0
-        terminals = self.grammar.terminals
-        if string[-1] != '$':
-            string.append('$')
-        stack = [0]
+        action, goto, units = self.compiled_table()
+        lazy = self.lazy_units
+        prods = self.grammar.prods
+        debug = log.isEnabledFor(logging.DEBUG)
+        build_tree = actions is None and not recognize
+        states = [0]
+        values = []
+        a = yield
         while True:
-            top = stack[-1]
-            a = string[0]
-            entry = self.parsing_table.at[top, (YACV_ACTION, a)]
-            if entry == YACV_ERROR:
-                log.error('Parse error')
+            top = states[-1]
+            entry = action[top].get(a)
+            if entry is None:
+                if not recognize:
+                    log.error('Parse error')
                 raise YACVError('YACV_ERROR entry for top = {}, a = {}'.format(top, a))
-            if isinstance(entry, list):
-                entry = entry[0]
-            log.debug('stack top = {}, a = {}, entry = {}'.format(top, a, entry))
+            if debug:
+                log.debug('stack top = {}, a = {}, entry = {}'.format(top, a, entry))
             if entry[0] == 's':
-                stack.append(AbstractSyntaxTree(a))
-                stack.append(int(entry[1:]))
-                string.pop(0)
+                states.append(entry[1])
+                if build_tree:
+                    values.append(AbstractSyntaxTree(a))
+                elif not recognize:
+                    values.append(a)
+                a = yield
             elif entry[0] == 'r':
-                prod_id =int(entry[1:])
-                prod = self.grammar.prods[prod_id]
-                new_tree = AbstractSyntaxTree(prod.lhs)
-                new_tree.prod_id = prod_id
-                popped_list = []
-                if prod.rhs[0] != YACV_EPSILON:
-                    for _ in range(len(prod.rhs)):
-                        if not stack:
-                            raise YACVError('Stack prematurely empty')
-                        stack.pop(-1) # pops the state number
-                        if not stack:
-                            raise YACVError('Stack prematurely empty')
-                        popped_list.append(stack.pop(-1)) # pops the symbol
-                else:
-                    new_tree.desc.append(AbstractSyntaxTree(YACV_EPSILON))
-                for i in range(len(popped_list)-1, -1, -1):
-                    new_tree.desc.append(popped_list[i])
-                new_top = stack[-1]
-                nonterminal = prod.lhs
-                new_state = self.parsing_table.at[new_top, (YACV_GOTO, nonterminal)]
-                stack.append(new_tree)
-                if isinstance(new_state, list):
-                    new_state = new_state[0]
-                stack.append(int(new_state))
-            elif entry == YACV_ACCEPT:
-                prod = self.grammar.prods[0]
-                assert prod.rhs[-1] == '$' and len(prod.rhs) == 2
-                if not stack:
-                    raise ValueError() # TODO: Convert this to YACVError stating an error has occurred due to stack becoming empty prematurely
-                stack.pop(-1)
-                if not stack:
-                    raise ValueError() # TODO: Convert this to YACVError stating an error has occurred due to stack becoming empty prematurely
-                tree = stack.pop(-1)
-                log.info('Parse successful')
-                log.debug('Final tree = {}'.format(tree))
-                return tree
-                break
+                _, prod_id, nonterminal, n = entry
+                if n >= len(states):
+                    raise YACVError('Stack prematurely empty')
+                if n:
+                    del states[-n:]
+                if not recognize:
+                    children = values[len(values)-n:]
+                    del values[len(values)-n:]
+                    if build_tree:
+                        new_tree = AbstractSyntaxTree(nonterminal)
+                        new_tree.prod_id = prod_id
+                        new_tree.desc = children if n else \
+                                [AbstractSyntaxTree(YACV_EPSILON)]
+                        values.append(new_tree)
+                    elif prod_id in actions:
+                        values.append(actions[prod_id](*children))
+                    else:
+                        values.append(children[0] if children else None)
+                hops = units.get(states[-1])
+                hop = hops.get(nonterminal) if hops else None
+                hop = hop.get(a) if hop else None
+                if hop is not None:
+                    new_state, elided = hop
+                    if build_tree:
+                        if lazy:
+                            new_tree.units = elided
+                        else:
+                            values[-1] = wrap_units(new_tree, elided, prods)
+                    elif not recognize:
+                        for unit_id in elided:
+                            if unit_id in actions:
+                                values[-1] = actions[unit_id](values[-1])
+                    states.append(new_state)
+                    continue
+                new_state = goto[states[-1]].get(nonterminal)
+                if new_state is None:
+                    raise YACVError('No GOTO entry for top = {}, {}'.format(\
+                            states[-1], nonterminal))
+                states.append(new_state)
             else:
-                raise YACVError('Unknown error while parsing')
-                break
+                if recognize:
+                    return True
+                if not values:
+                    raise YACVError('Stack prematurely empty')
+                if build_tree:
+                    log.info('Parse successful')
+                    if debug:
+                        log.debug('Final tree = {}'.format(values[-1]))
+                return values[-1]
 
     def visualize_syntaxtree(self, string, colors=None):
         global YACV_GRAPHVIZ_COLORS
@@ -286,93 +705,158 @@ class LRParser(object):
         if colors is not None:
             YACV_GRAPHVIZ_COLORS = colors 
         # Create the parse tree
-        tree = self.parse(string)
+        tree = restore_units(self.parse(string), self.grammar.prods)
+        G = pgv.AGraph(string=syntaxtree_to_dot(tree, self.grammar.terminals, \
+                YACV_GRAPHVIZ_COLORS))
+        layout_graph(G)
+        log.info('LR parse tree successfully visualized')
+        return G
 
-        G = pgv.AGraph(name='AbstractSyntaxTree', directed=True)
-        node_id = 0
-        stack = [(tree, node_id)]
-        terminals = self.grammar.terminals
-        prods = []
-        while stack:
-            top, node = stack.pop(0)
-            if str(node) not in G.nodes():
-                G.add_node(node_id, label=top.root)
-                node_id += 1
-            if top.prod_id is not None:
-                color = YACV_GRAPHVIZ_COLORS[top.prod_id % len(YACV_GRAPHVIZ_COLORS)]
-                G.get_node(node).attr['fontcolor'] = color
-            desc_ids = []
-            for desc in top.desc:
-                if desc.root == YACV_EPSILON:
-                   label = G.get_node(node).attr['label'] 
-                   label = '<' + label + ' = &#x3B5;>'
-                   G.get_node(node).attr['label'] = label
-                   break
-                G.add_node(node_id, label=desc.root)
-                G.add_edge(node, node_id, color=color)
-                desc_ids.append(node_id)
-                stack.append((desc, node_id))
-                node_id += 1
-            prods.append(desc_ids)
-
-        # Perform a DFS to get proper order of terminals
-        terminal_nodes = []
-        stack = [G.nodes()[0]]
-        visited = []
-        while stack:
-            node = stack.pop(-1)
-            if node not in visited:
-                visited.append(node)
-                if node.attr['label'] in terminals:
-                    terminal_nodes.append(node)
-                log.debug(node.attr['label'])
-                for i in range(len(G.successors(node))-1, -1, -1):
-                    stack.append(G.successors(node)[i])
-        for i, prod in enumerate(prods):
-            nonterminals = []
-            for node_id in prod:
-                if G.get_node(node_id).attr['label'] in terminals:
-                    continue
-                nonterminals.append(G.get_node(node_id))
-            if len(nonterminals) <= 1:
+    def export_syntaxtree(self, string, fname, colors=None, fmt=None, \
+            layout='dot', stream=False):
+        # Writes the syntax tree to `fname`, see yacv.treeexport
+        tree = restore_units(self.parse(string), self.grammar.prods)
+        return export_syntaxtree(tree, self.grammar.terminals, fname, \
+                colors, fmt, layout, stream)
+
+    def kernel_items(self, state):
+        # Items that are not added by the closure, everything else can be
+        # derived from them
+        start = self.grammar.prods[0]
+        return [item for item in state.items \
+                if item.dot_pos > 0 or item.production == start]
+
+    def automaton_neighborhood(self, states, hops=1):
+        # States at most `hops` transitions away (in either direction) from
+        # any of the given states
+        neighbors = {i: set() for i in self.automaton_transitions.keys()}
+        for state, transitions in self.automaton_transitions.items():
+            for new_state in transitions.values():
+                neighbors[state].add(new_state)
+                neighbors[new_state].add(state)
+        for state in states:
+            if state not in neighbors:
+                raise YACVError('State {} does not exist in the LR automaton'\
+                        .format(state))
+        seen = set(states)
+        frontier = list(states)
+        for _ in range(hops):
+            next_frontier = []
+            for state in frontier:
+                for x in neighbors[state]:
+                    if x not in seen:
+                        seen.add(x)
+                        next_frontier.append(x)
+            frontier = next_frontier
+        return sorted(seen)
+
+    def automaton_depths(self):
+        # BFS depth of every state starting at state 0
+        depth = {0: 0}
+        queue = [0]
+        for state in queue:
+            for new_state in self.automaton_transitions[state].values():
+                if new_state not in depth:
+                    depth[new_state] = depth[state] + 1
+                    queue.append(new_state)
+        return depth
+
+    def automaton_sccs(self):
+        # Tarjan's algorithm (iterative), components come out in reverse
+        # topological order so they are reversed before returning
+        index, low = {}, {}
+        on_stack = set()
+        stack = []
+        sccs = []
+        counter = 0
+        for root in self.automaton_transitions.keys():
+            if root in index:
                 continue
-            nt = G.subgraph(nonterminals, name='Production' + str(i))
-            nt.graph_attr['rank'] = 'same'
-            for j in range(len(nt.nodes())-1):
-                log.debug('Adding edge from c.nodes()[{}]={} to c.nodes()[{}]={}'.format(
-                    j, nonterminals[j], j+1, nonterminals[j+1]
-                ))
-                nt.add_edge(nonterminals[j], nonterminals[j+1], \
-                        style='invis', weight=YACV_GRAPHVIZ_INFINITY)
-
-        t = G.add_subgraph(terminal_nodes, name='Terminals')
-        t.graph_attr['rank'] = 'max'
-        for i in range(len(t.nodes())-1):
-            log.debug('Adding edge from c.nodes()[{}]={} to c.nodes()[{}]={}'.format(
-                i, terminal_nodes[i], i+1, terminal_nodes[i+1]
-            ))
-            t.add_edge(terminal_nodes[i], terminal_nodes[i+1], style='invis')
-
-
-        G.edge_attr['dir'] = 'none'
-        G.node_attr['ordering'] = 'out'
-        G.node_attr['shape'] = 'none'
-        G.node_attr['height'] = 0
-        G.node_attr['width'] = 0
-        G.node_attr['margin'] = 0.1
-        G.layout('dot')
+            work = [(root, iter(self.automaton_transitions[root].values()))]
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                v, it = work[-1]
+                w = next(it, None)
+                if w is not None:
+                    if w not in index:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack.add(w)
+                        work.append((w, \
+                            iter(self.automaton_transitions[w].values())))
+                    elif w in on_stack:
+                        low[v] = min(low[v], index[w])
+                    continue
+                work.pop(-1)
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[v])
+                if low[v] == index[v]:
+                    scc = []
+                    while True:
+                        w = stack.pop(-1)
+                        on_stack.discard(w)
+                        scc.append(w)
+                        if w == v:
+                            break
+                    sccs.append(sorted(scc))
+        sccs.reverse()
+        return sccs
 
-        log.info('LR parse tree successfully visualized')
-        return G
+    def automaton_pages(self, by='scc', page_size=YACV_AUTOMATON_PAGE_SIZE):
+        # Splits the states into pages of at most `page_size` states. With
+        # 'depth' the states are taken in BFS order, with 'scc' strongly
+        # connected components are packed in topological order and only
+        # components bigger than a page are split (in BFS order)
+        depth = self.automaton_depths()
+        bfs_order = lambda x: sorted(x, key=lambda s: (depth.get(s, 0), s))
+        if by == 'depth':
+            groups = [bfs_order(self.automaton_transitions.keys())]
+        elif by == 'scc':
+            groups = [bfs_order(x) for x in self.automaton_sccs()]
+        else:
+            raise YACVError('Unknown automaton paging "{}", expected one of ' \
+                    '[\'scc\', \'depth\']'.format(by))
+        pages = []
+        curr = []
+        for group in groups:
+            if curr and len(curr) + len(group) > page_size:
+                pages.append(curr)
+                curr = []
+            while len(group) > page_size:
+                pages.append(group[:page_size])
+                group = group[page_size:]
+            curr.extend(group)
+        if curr:
+            pages.append(curr)
+        return pages
 
-    def visualize_automaton(self):
+    def visualize_automaton(self, states=None, kernel_only=None, prog=None):
+        # With `states`, only those states are drawn and the transitions that
+        # leave them end in dashed placeholder nodes. `kernel_only` and `prog`
+        # default to values that depend on the number of states drawn
         log = logging.getLogger('yacv')
         import pygraphviz as pgv
+        if states is None:
+            states = list(self.automaton_transitions.keys())
+        states = sorted(set(states))
+        selected = set(states)
+        if kernel_only is None:
+            kernel_only = len(states) > YACV_AUTOMATON_FULL_LABEL_MAX_STATES
+        if prog is None:
+            prog = 'dot' if len(states) <= YACV_AUTOMATON_DOT_MAX_STATES \
+                    else 'sfdp'
         G = pgv.AGraph(rankdir='LR', directed=True)
-        G.add_node(-1, style='invis')
-        for i, state in enumerate(self.automaton_states):
+        if 0 in selected:
+            G.add_node(-1, style='invis')
+        for i in states:
+            state = self.automaton_states[i]
+            items = self.kernel_items(state) if kernel_only else state.items
             label = '<U><B>State {}<BR/></B></U>'.format(i) + \
-                    state.__str__(join_on='<BR/>') 
+                    '<BR/>'.join([str(item) for item in items])
             label = label.replace(YACV_DOT, '&#xB7;')
             label = label.replace('->', '&#10132;')
             label = '<' + label + '>'
@@ -386,19 +870,36 @@ class LRParser(object):
             else:
                 G.add_node(i, label=label)
                 log.debug('Added node')
-        G.add_edge(-1, 0)
+        if 0 in selected:
+            G.add_edge(-1, 0)
         for state, transitions in self.automaton_transitions.items():
             for symbol, new_state in transitions.items():
+                if state not in selected and new_state not in selected:
+                    continue
+                for x in [state, new_state]:
+                    if x not in selected and not G.has_node(x):
+                        G.add_node(x, label='State {}'.format(x), \
+                                style='dashed')
                 G.add_edge(state, new_state, label=symbol)
 
         G.node_attr['shape'] = 'box'
         G.node_attr['height'] = 0
         G.node_attr['width'] = 0
         G.node_attr['margin'] = 0.05
-        G.layout('dot')
-        log.info('LR automaton successfully visualized')
+        if prog != 'dot':
+            G.graph_attr['overlap'] = 'prism'
+            G.graph_attr['splines'] = 'true'
+        layout_graph(G, prog)
+        log.info('LR automaton successfully visualized ({} states, {})'.format(
+            len(states), prog))
         return G
 
+    def visualize_automaton_pages(self, by='scc', \
+            page_size=YACV_AUTOMATON_PAGE_SIZE, kernel_only=None, prog=None):
+        # Yields one graph per page so only one of them is in memory at a time
+        for page in self.automaton_pages(by, page_size):
+            yield self.visualize_automaton(page, kernel_only, prog)
+
 class LR0Parser(LRParser):
     # TODO: Can we support epsilon LR(0) parsers ?
     # Ref: Parsing Techniques - Practical Guide 2nd Edition Sec.9.5.4
@@ -416,23 +917,25 @@ class LR0Parser(LRParser):
             return
         if not self.automaton_built:
             raise YACVError('LR state automaton must be built before building parsing table')
+        # Cells are collected in a dict and written to the frame at once
+        cells = {}
         terminals = self.grammar.terminals
         for state_id, transitions in self.automaton_transitions.items():
             state = self.automaton_states[state_id]
             if state.accept:
                 col = (YACV_ACTION, '$')
-                self.parsing_table.at[state_id, col] = YACV_ACCEPT
+                cells[state_id, col] = YACV_ACCEPT
             elif len(state.reduce_items) > 0:
                 for t in self.grammar.terminals:
                     col = (YACV_ACTION, t)
-                    if self.parsing_table.at[state_id, col] == YACV_ERROR:
-                        self.parsing_table.at[state_id, col] = []
+                    if cells.get((state_id, col), YACV_ERROR) == YACV_ERROR:
+                        cells[state_id, col] = []
                     for item in state.items:
                         if item.reduce:
                             prod_id = self.grammar.prods.index(item.production)
                             entry = YACV_REDUCE + str(prod_id)
-                            self.parsing_table.at[state_id, col].append(entry)
-                            if len(self.parsing_table.at[state_id, col]) > 1:
+                            cells[state_id, col].append(entry)
+                            if len(cells[state_id, col]) > 1:
                                 self.is_valid = False
             for symbol, new_state_id in transitions.items():
                 if symbol in terminals:
@@ -441,12 +944,13 @@ class LR0Parser(LRParser):
                 else:
                     entry = str(new_state_id)
                     col = (YACV_GOTO, symbol)
-                if self.parsing_table.at[state_id, col] == YACV_ERROR:
-                    self.parsing_table.at[state_id, col] = []
-                self.parsing_table.at[state_id, col].append(entry)
-                if len(self.parsing_table.at[state_id, col]) > 1:
+                if cells.get((state_id, col), YACV_ERROR) == YACV_ERROR:
+                    cells[state_id, col] = []
+                cells[state_id, col].append(entry)
+                if len(cells[state_id, col]) > 1:
                     self.is_valid = False
 
+        self.fill_parsing_table(cells)
         self.parsing_table_built = True
         if not self.is_valid:
             log.warning('Grammar is not LR(0)')
@@ -461,12 +965,14 @@ class SLR1Parser(LR0Parser):
             return
         if not self.automaton_built:
             raise YACVError('LR state automaton must be built before building parsing table')
+        # Cells are collected in a dict and written to the frame at once
+        cells = {}
         terminals = self.grammar.terminals
         for state_id, transitions in self.automaton_transitions.items():
             state = self.automaton_states[state_id]
             if state.accept:
                 col = (YACV_ACTION, '$')
-                self.parsing_table.at[state_id, col] = YACV_ACCEPT
+                cells[state_id, col] = YACV_ACCEPT
             elif len(state.reduce_items) > 0:
                 for item in state.items:
                     if item.reduce:
@@ -476,10 +982,10 @@ class SLR1Parser(LR0Parser):
                         entry = YACV_REDUCE + str(prod_id)
                         for symbol in follow:
                             col = (YACV_ACTION, symbol)
-                            if self.parsing_table.at[state_id, col] == YACV_ERROR:
-                                self.parsing_table.at[state_id, col] = []
-                            self.parsing_table.at[state_id, col].append(entry)
-                            if len(self.parsing_table.at[state_id, col]) > 1:
+                            if cells.get((state_id, col), YACV_ERROR) == YACV_ERROR:
+                                cells[state_id, col] = []
+                            cells[state_id, col].append(entry)
+                            if len(cells[state_id, col]) > 1:
                                 self.is_valid = False
             for symbol, new_state_id in transitions.items():
                 if symbol in terminals:
@@ -488,12 +994,14 @@ class SLR1Parser(LR0Parser):
                 else:
                     entry = str(new_state_id)
                     col = (YACV_GOTO, symbol)
-                if self.parsing_table.at[state_id, col] == YACV_ERROR:
-                    self.parsing_table.at[state_id, col] = []
-                self.parsing_table.at[state_id, col].append(entry)
-                if len(self.parsing_table.at[state_id, col]) > 1:
+                if cells.get((state_id, col), YACV_ERROR) == YACV_ERROR:
+                    cells[state_id, col] = []
+                cells[state_id, col].append(entry)
+                if len(cells[state_id, col]) > 1:
                     self.is_valid = False
 
+        self.resolve_conflicts(cells)
+        self.fill_parsing_table(cells)
         self.parsing_table_built = True
         if not self.is_valid:
             log.warning('Grammar is not SLR(1)')
@@ -517,6 +1025,8 @@ class LR1Parser(LRParser):
             return 
         if not self.automaton_built:
             raise YACVError('LR state automaton must be built before building parsing table')
+        # Cells are collected in a dict and written to the frame at once
+        cells = {}
         terminals = self.grammar.terminals
         for state_id, transitions in self.automaton_transitions.items():
             state = self.automaton_states[state_id]
@@ -529,16 +1039,16 @@ class LR1Parser(LRParser):
                         prod_id = self.grammar.prods.index(prod)
                         if prod_id == 0:
                             col = (YACV_ACTION, '$')
-                            self.parsing_table.at[state_id, col] = YACV_ACCEPT
+                            cells[state_id, col] = YACV_ACCEPT
                             continue
                         lookaheads = item.lookaheads
                         entry = 'r' + str(prod_id)
                         for symbol in item.lookaheads:
                             col = (YACV_ACTION, symbol)
-                            if self.parsing_table.at[state_id, col] == YACV_ERROR:
-                                self.parsing_table.at[state_id, col] = []
-                            self.parsing_table.at[state_id, col].append(entry)
-                            if len(self.parsing_table.at[state_id, col]) > 1:
+                            if cells.get((state_id, col), YACV_ERROR) == YACV_ERROR:
+                                cells[state_id, col] = []
+                            cells[state_id, col].append(entry)
+                            if len(cells[state_id, col]) > 1:
                                 self.is_valid = False
             for symbol, new_state_id in transitions.items():
                 if symbol in terminals:
@@ -547,11 +1057,13 @@ class LR1Parser(LRParser):
                 else:
                     entry = str(new_state_id)
                     col = (YACV_GOTO, symbol)
-                if self.parsing_table.at[state_id, col] == YACV_ERROR:
-                    self.parsing_table.at[state_id, col] = []
-                self.parsing_table.at[state_id, col].append(entry)
-                if len(self.parsing_table.at[state_id, col]) > 1:
+                if cells.get((state_id, col), YACV_ERROR) == YACV_ERROR:
+                    cells[state_id, col] = []
+                cells[state_id, col].append(entry)
+                if len(cells[state_id, col]) > 1:
                     self.is_valid = False
+        self.resolve_conflicts(cells)
+        self.fill_parsing_table(cells)
         self.parsing_table_built = True
         if not self.is_valid:
             log.warning('Grammar is not valid')
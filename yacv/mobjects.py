@@ -5,6 +5,7 @@ except ImportError as e:
     from manim import *
     manimce = True
 import numpy as np 
+from math import factorial
 import pygraphviz as pgv
 import logging 
 from yacv.abstractsyntaxtree import AbstractSyntaxTree
@@ -13,12 +14,40 @@ from yacv.ll1 import *
 from yacv.lr import *
 from yacv.constants import *
 from yacv.utils import *
+from yacv.layoutcache import layout_graph
+class LabelPool(object):
+    # Labels in a scene come from a tiny vocabulary (grammar symbols, state
+    # numbers, status strings). Each distinct label is built (and its LaTeX
+    # compiled/SVG parsed) once, every user gets a cheap copy of it
+    def __init__(self):
+        self.labels = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, cls, *args):
+        key = (cls.__name__, args)
+        if key not in self.labels:
+            self.labels[key] = cls(*args)
+            self.misses += 1
+        else:
+            self.hits += 1
+        return self.labels[key].copy()
+
+    def tex(self, *args):
+        return self.get(Tex, *args)
+
+    def text(self, *args):
+        return self.get(Text, *args)
+
 class GraphvizMobject(VGroup):
-    # do note that graph must have .layout() called on it already
-    def __init__(self, graph, **kwargs):
+    # graphs without a layout are laid out here (through the layout cache)
+    def __init__(self, graph, pool=None, **kwargs):
         # digest_config doesn't work in ManimCE
         # digest_config(self, kwargs, locals())
         super().__init__(**kwargs)
+        self.pool = pool if pool is not None else LabelPool()
+        if not graph.graph_attr['bb']:
+            layout_graph(graph)
         self.new_bbox = None
         self.scale_x = None
         self.scale_y = None 
@@ -30,51 +59,45 @@ class GraphvizMobject(VGroup):
         self.add_graph(graph) 
 
     # Manim grid is only 14x8, we need to fit the graphviz graph in this
-    def gridify(self, x, y):
+    def fit_bounding_box(self):
         log = logging.getLogger('yacv')
         assert self.bounding_box is not None and len(self.bounding_box) == 4
         global YACV_MANIM_MAX_AST_HEIGHT, YACV_MANIM_MAX_AST_WIDTH
         bounding_box = self.bounding_box
+        width = bounding_box[2] - bounding_box[0]
+        height = bounding_box[3] - bounding_box[1]
+        ratio = width / height 
+        # Find the maximum bbox that fits the screen "nicely"
+        new_bbox = (0, 0)
+        for new_height in np.linspace(1.0, YACV_MANIM_MAX_AST_HEIGHT, num=100):
+            new_width = ratio * new_height 
+            if new_width <= YACV_MANIM_MAX_AST_WIDTH:
+                new_bbox = (new_width, new_height) 
+        new_width, new_height = new_bbox
+        new_bbox = [-new_width/2, -new_height/2, new_width/2, new_height/2]
+        self.scale_x = new_width / width 
+        self.scale_y = new_height / height 
+        self.new_bbox = new_bbox 
+        log.debug('New bbox = {}'.format(self.new_bbox))
+
+    def gridify(self, x, y):
         if self.new_bbox is None:
-            width = bounding_box[2] - bounding_box[0]
-            height = bounding_box[3] - bounding_box[1]
-            ratio = width / height 
-            # Find the maximum bbox that fits the screen "nicely"
-            new_bbox = (0, 0)
-            for new_height in np.linspace(1.0, YACV_MANIM_MAX_AST_HEIGHT, num=100):
-                new_width = ratio * new_height 
-                if new_width <= YACV_MANIM_MAX_AST_WIDTH:
-                    new_bbox = (new_width, new_height) 
-            new_width, new_height = new_bbox
-            new_bbox = [-new_width/2, -new_height/2, new_width/2, new_height/2]
-            self.scale_x = new_width / width 
-            self.scale_y = new_height / height 
-            self.new_bbox = new_bbox 
-            log.debug('New bbox = {}'.format(self.new_bbox))
+            self.fit_bounding_box()
         assert self.scale_x is not None and self.scale_y is not None 
         new_x = self.new_bbox[0] + self.scale_x * float(x) 
         new_y = self.new_bbox[1] + self.scale_y * float(y) 
-        log.debug('({},{}) -> ({},{})'.format(x, y, new_x, new_y))
         return new_x, new_y 
 
-    # https://codereview.stackexchange.com/questions/240710/pure-python-b%C3%A9zier-curve-implementation
-    # I'm not sure how the internal manim bezier is written so cannot test it 
+    # Same as `gridify` but for an (N, 2) array of graphviz points
+    def gridify_points(self, points):
+        if self.new_bbox is None:
+            self.fit_bounding_box()
+        offset = np.array(self.new_bbox[:2], dtype=float)
+        scale = np.array([self.scale_x, self.scale_y], dtype=float)
+        return offset + scale * points
+
     def bezier_curve(self, control_points, n=11):
-        return [
-            self.bezier_point(control_points, t)
-            for t in (
-                i * 1. / (n - 1) for i in range(n)
-            )
-        ]
-
-    def bezier_point(self, control_points, t):
-        if len(control_points) == 1:
-            result, = control_points
-            return result 
-        control_linestring = zip(control_points[:-1], control_points[1:])
-        return self.bezier_point([
-            (1 - t) * p1 + t * p2 for p1, p2 in control_linestring
-        ], t)
+        return list(bezier_curves([np.asarray(control_points)], n)[0])
 
     def coord(self, x, y, z=0):
         return np.array([x, y, z])
@@ -90,7 +113,7 @@ class GraphvizMobject(VGroup):
             replacement = '$\\epsilon$' if manimce else '\\epsilon'
             label = prepare_text(n.attr['label'])
             label = label.replace('&#x3B5;', replacement)
-            dot = Tex('{{' + label + '}}')
+            dot = self.pool.tex('{{' + label + '}}')
             x, y = n.attr['pos'].split(',')
             log.debug('Label = {}'.format(label))
             x, y = self.gridify(x, y)
@@ -101,15 +124,18 @@ class GraphvizMobject(VGroup):
             self.add(dot)
             self.nodes[str(n)] = dot 
             log.debug('End of iteration for adding a node')
+        # All the edges are evaluated together, see `spline_curves`
+        edges = []
+        splines = []
         for e in g.edges():
             if e.attr['style'] == 'invis':
                 continue 
-            points = [np.asarray(self.gridify(*x.split(',')[-2:]))\
-                    for x in e.attr['pos'].split(' ')]
-            # We call bezier on the "gridified" points
-            # TODO: will it be more accurate to use raw coords ?
-            bezier_pts = self.bezier_curve(points, n=101)
-            bezier_pts = [self.coord(*x) for x in bezier_pts]
+            edges.append(e)
+            splines.append(self.gridify_points(parse_spline(e.attr['pos'])))
+        curves = spline_curves(splines, YACV_MANIM_SPLINE_SAMPLES)
+        for e, points in zip(edges, curves):
+            bezier_pts = np.zeros((len(points), 3))
+            bezier_pts[:, :2] = points
             path = VMobject()
             path.set_points_smoothly(bezier_pts)
             if e.attr['color']:
@@ -120,6 +146,60 @@ class GraphvizMobject(VGroup):
             log.debug('End of iteration for adding an edge')
         self.graph_added = True 
 
+def parse_spline(pos):
+    # Graphviz writes edge splines as "[e,x,y] [s,x,y] x1,y1 x2,y2 ..." where
+    # the optional `s` and `e` points are arrowhead endpoints and the rest
+    # are 3n+1 control points of n piecewise cubic bezier segments
+    points = [x.split(',') for x in pos.split(' ') if x]
+    points = [x for x in points if x[0] not in ['s', 'e']]
+    return np.array(points, dtype=float)
+
+def bernstein_basis(degree, n):
+    # (n, degree+1) matrix, row i holds the bernstein polynomials at t_i
+    t = np.linspace(0.0, 1.0, n)[:, None]
+    k = np.arange(degree + 1)[None, :]
+    binom = np.array([factorial(degree) // (factorial(i) * \
+            factorial(degree - i)) for i in range(degree + 1)], \
+            dtype=float)[None, :]
+    return binom * t ** k * (1.0 - t) ** (degree - k)
+
+def bezier_curves(control_points, n):
+    # Evaluates many bezier curves at `n` equally spaced parameter values.
+    # Curves of the same degree go through a single matrix product
+    ret = [None] * len(control_points)
+    by_degree = {}
+    for i, points in enumerate(control_points):
+        by_degree.setdefault(len(points) - 1, []).append(i)
+    for degree, idx in by_degree.items():
+        basis = bernstein_basis(degree, n)
+        stacked = np.stack([control_points[i] for i in idx])
+        curves = np.einsum('tk,skd->std', basis, stacked)
+        for i, curve in zip(idx, curves):
+            ret[i] = curve
+    return ret
+
+def spline_curves(splines, n):
+    # Each spline is split into its cubic segments, all segments of all the
+    # splines are evaluated at once and stitched back together per spline
+    segments = []
+    bounds = []
+    for points in splines:
+        start = len(segments)
+        if len(points) >= 4 and (len(points) - 1) % 3 == 0:
+            for i in range(0, len(points) - 1, 3):
+                segments.append(points[i:i+4])
+        else:
+            # Not a graphviz spline, treat all points as one bezier curve
+            segments.append(points)
+        bounds.append((start, len(segments)))
+    curves = bezier_curves(segments, n)
+    ret = []
+    for start, end in bounds:
+        parts = [curves[i][:-1] for i in range(start, end - 1)]
+        parts.append(curves[end - 1])
+        ret.append(np.concatenate(parts))
+    return ret
+
 def transform_graphviz_graphs(old, new):
     log = logging.getLogger('yacv')
     common_nodes = set(old.nodes.keys()).intersection(set(new.nodes.keys()))
@@ -286,88 +366,128 @@ def stack_to_graphviz(stack, grammar, colors=None):
     ret.node_attr['margin'] = 0.1
     ret.node_attr['shape'] = 'none'
 
-    ret.layout('dot')
-    ret.draw('sample.png')
+    layout_graph(ret)
     return ret
 
 def coord(x, y, z=0):
     return np.array([x, y, z])
 
 class StackMobject(VGroup):
-    def __init__(self, stack=None, **kwargs):
+    # Persistent view of the parser stack. `set_stack` moves it to a new
+    # stack and returns the animations of the change, only the elements that
+    # were pushed (or scrolled back into view) get new mobjects, everything
+    # else is moved or kept as is
+    def __init__(self, stack=None, pool=None, **kwargs):
         # digest_config doesn't work in CE
         # digest_config(self, kwargs, locals())
         super().__init__(**kwargs)
-        bottom_line = Line(start=[-6, -3, 0], end=[-5, -3, 0])
-        left_line = Line(start=[-6, -3, 0], end=[-6, 2, 0])
-        right_line = Line(start=[-5, -3, 0], end=[-5, 2, 0])
-        bottom_text = Tex('\\dots')
-        bottom_text.next_to(bottom_line, UP)
-        self.add(bottom_line)
-        self.add(left_line)
-        self.add(right_line)
-        self.add(Line(start=[-5, -3, 0], end=[-5, 2, 0]))
-        self.bottom = bottom_line 
-        self.left = left_line 
-        self.right = right_line 
-
+        self.pool = pool if pool is not None else LabelPool()
+        self.line = Line(start=[-6, -3, 0], end=[-5, -3, 0])
+        self.dots = None
+        self.left = Line(start=[-6, -3, 0], end=[-6, 2, 0])
+        self.right = Line(start=[-5, -3, 0], end=[-5, 2, 0])
+        self.add(self.line)
+        self.add(self.left)
+        self.add(self.right)
+        self.bottom = self.line
+        self.stack = []
         self.elements = {}
-        prev_mobject = self.bottom
-        if stack is not None:
-            self.stack_len = len(stack)
-            if self.stack_len > YACV_MANIM_MAX_STACK_VIS:
-                self.remove(bottom_line)
-                self.add(bottom_text)
-                self.bottom = bottom_text
-                prev_mobject = bottom_text
-            if len(stack) > YACV_MANIM_MAX_STACK_VIS:
-                start_idx = stack.index(stack[-YACV_MANIM_MAX_STACK_VIS])
-            else:
-                start_idx = 0
-            stack = stack[-YACV_MANIM_MAX_STACK_VIS:]
-            for i, elem in enumerate(stack):
-                if isinstance(elem, AbstractSyntaxTree):
-                    text = elem.root 
-                else:
-                    text = str(elem) 
-                new_mobject = Tex(prepare_text(text))
-                new_mobject.next_to(prev_mobject, UP)
-                new_mobject.scale(YACV_MANIM_TEXT_SCALE)
-                self.add(new_mobject)
-                prev_mobject = new_mobject
-                self.elements[start_idx + i] = new_mobject 
-        prev_mobject.set_color(RED)
-        self.arrow = Tex('$\\downarrow$') if manimce else Tex('\\downarrow')
-        self.arrow.next_to(prev_mobject, UP)
+        self.stack_len = 0
+        self.arrow = self.pool.tex('$\\downarrow$') if manimce else \
+                self.pool.tex('\\downarrow')
         self.arrow.set_color(RED)
         self.add(self.arrow)
-
-        self.indicator = Tex('Stack')
+        self.indicator = self.pool.tex('Stack')
         self.indicator.next_to(self.bottom, DOWN)
         self.indicator.scale(YACV_MANIM_TEXT_SCALE)
         self.add(self.indicator)
+        self.bottom.set_color(RED)
+        self.set_stack(stack if stack is not None else [], animate=False)
 
-def transform_stacks(old, new):
-    # Should we animate the bottom_line ?
-    anims = []
-    anims.append(ReplacementTransform(old.left, new.left))
-    anims.append(ReplacementTransform(old.right, new.right))
-    anims.append(ReplacementTransform(old.bottom, new.bottom))
-    common_idx = set(old.elements.keys()).intersection(new.elements.keys())
-    old_idx = set(old.elements.keys()).difference(common_idx)
-    new_idx = set(new.elements.keys()).difference(common_idx)
-    for i in common_idx:
-        anims.append(ReplacementTransform(old.elements[i], new.elements[i]))
-
-    for i in old_idx:
-        anims.append(FadeOut(old.elements[i]))
-
-    for i in new_idx:
-        anims.append(FadeIn(new.elements[i]))
-    min_idx = min(old.elements.keys())
-    for i in new_idx:
-        if i > min_idx:
-            anims.append(Flash(new.elements[i], color=GREEN))
-    anims.append(ReplacementTransform(old.arrow, new.arrow))
-    anims.append(ReplacementTransform(old.indicator, new.indicator))
-    return anims
+    def same_element(self, x, y):
+        if isinstance(x, AbstractSyntaxTree) or isinstance(y, AbstractSyntaxTree):
+            return x is y
+        return x == y
+
+    def top(self):
+        if self.elements:
+            return self.elements[self.stack_len - 1]
+        return self.bottom
+
+    def move(self, mobject, point, anims, animate):
+        if np.allclose(mobject.get_center(), point):
+            return
+        if animate:
+            mobject.generate_target()
+            mobject.target.move_to(point)
+            anims.append(MoveToTarget(mobject))
+        else:
+            mobject.move_to(point)
+
+    def push(self, *elems):
+        return self.set_stack(self.stack + list(elems))
+
+    def pop(self, n=1):
+        return self.set_stack(self.stack[:len(self.stack)-n])
+
+    def set_stack(self, stack, animate=True):
+        anims = []
+        common = 0
+        n = min(len(self.stack), len(stack))
+        while common < n and self.same_element(self.stack[common], stack[common]):
+            common += 1
+        old_top = self.top()
+        first = max(0, len(stack) - YACV_MANIM_MAX_STACK_VIS)
+        # Popped elements and the ones scrolled out of view below
+        for i in list(self.elements.keys()):
+            if i >= common or i < first:
+                mobject = self.elements.pop(i)
+                self.remove(mobject)
+                anims.append(FadeOut(mobject))
+        if len(stack) > YACV_MANIM_MAX_STACK_VIS:
+            if self.dots is None:
+                self.dots = self.pool.tex('\\dots')
+                self.dots.next_to(self.line, UP)
+            bottom = self.dots
+        else:
+            bottom = self.line
+        if bottom is not self.bottom:
+            self.remove(self.bottom)
+            anims.append(FadeOut(self.bottom))
+            self.add(bottom)
+            anims.append(FadeIn(bottom))
+            self.bottom = bottom
+        # Elements are stacked above the bottom, existing ones only move
+        # when the part of the stack below them changed
+        x = self.bottom.get_center()[0]
+        y = self.bottom.get_top()[1]
+        elements = {}
+        for i in range(first, len(stack)):
+            mobject = self.elements.get(i)
+            if mobject is None:
+                elem = stack[i]
+                text = elem.root if isinstance(elem, AbstractSyntaxTree) \
+                        else str(elem)
+                mobject = self.pool.tex(prepare_text(text))
+                mobject.scale(YACV_MANIM_TEXT_SCALE)
+                y += DEFAULT_MOBJECT_TO_MOBJECT_BUFFER + mobject.get_height()/2
+                mobject.move_to(coord(x, y))
+                self.add(mobject)
+                anims.append(FadeIn(mobject))
+                if i >= common and self.stack:
+                    anims.append(Flash(mobject, color=GREEN))
+            else:
+                y += DEFAULT_MOBJECT_TO_MOBJECT_BUFFER + mobject.get_height()/2
+                self.move(mobject, coord(x, y), anims, animate)
+            y += mobject.get_height()/2
+            elements[i] = mobject
+        self.elements = elements
+        self.stack = list(stack)
+        self.stack_len = len(stack)
+        top = self.top()
+        if top is not old_top:
+            old_top.set_color(WHITE)
+            top.set_color(RED)
+        y += DEFAULT_MOBJECT_TO_MOBJECT_BUFFER + self.arrow.get_height()/2
+        self.move(self.arrow, coord(x, y), anims, animate)
+        return anims
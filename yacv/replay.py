@@ -0,0 +1,177 @@
+from yacv.abstractsyntaxtree import AbstractSyntaxTree
+from yacv.constants import YACV_ACTION, YACV_GOTO, YACV_ERROR, YACV_ACCEPT, \
+        YACV_EPSILON
+
+def ll1_parse_trace(parser, string):
+    # Actions taken by LL(1) parser on `string`, one entry per animated step
+    # ('match', terminal) or ('expand', prod_id)
+    p = parser
+    string = list(string)
+    if string[-1] != '$':
+        string.append('$')
+    stack = [p.grammar.prods[0].lhs]
+    trace = []
+    while stack[-1] != '$':
+        a = string[0]
+        top = stack[-1]
+        if top == a:
+            stack.pop(-1)
+            string.pop(0)
+            trace.append(('match', a))
+        elif top in p.grammar.terminals:
+            raise ValueError('Error because top = {}, terminal'.format(top))
+        elif p.parsing_table.at[top, a] == YACV_ERROR:
+            raise ValueError('Error entry in the parsing table for top = {}, a = {}'.format(top, a))
+        else:
+            prod = p.parsing_table.at[top, a][0]
+            stack.pop(-1)
+            if prod.rhs[0] != YACV_EPSILON:
+                stack.extend(reversed(prod.rhs))
+            trace.append(('expand', p.grammar.prods.index(prod)))
+    return trace
+
+def lr_parse_trace(parser, string):
+    # Actions taken by LR parser on `string`, one entry per animated step
+    # ('shift', state), ('reduce', prod_id, goto_state) or ('accept',)
+    p = parser
+    string = list(string)
+    if string[-1] != '$':
+        string.append('$')
+    stack = [0]
+    trace = []
+    while True:
+        top = stack[-1]
+        a = string[0]
+        entry = p.parsing_table.at[top, (YACV_ACTION, a)]
+        if entry == YACV_ERROR:
+            raise ValueError('Parsing error. Got YACV_ERROR entry for top = {}, a = {}'.format(top, a))
+        if isinstance(entry, list):
+            entry = entry[0]
+        if entry[0] == 's':
+            stack.append(int(entry[1:]))
+            string.pop(0)
+            trace.append(('shift', int(entry[1:])))
+        elif entry[0] == 'r':
+            prod_id = int(entry[1:])
+            prod = p.grammar.prods[prod_id]
+            if prod.rhs[0] != YACV_EPSILON:
+                if len(stack) <= len(prod.rhs):
+                    raise ValueError('Parsing Error: Stack prematurely empty')
+                del stack[-len(prod.rhs):]
+            new_state = p.parsing_table.at[stack[-1], (YACV_GOTO, prod.lhs)]
+            if isinstance(new_state, list):
+                new_state = new_state[0]
+            stack.append(int(new_state))
+            trace.append(('reduce', prod_id, int(new_state)))
+        elif entry == YACV_ACCEPT:
+            trace.append(('accept',))
+            return trace
+        else:
+            raise ValueError('Unknown error while parsing')
+
+def coalesce_trace(trace):
+    # Groups runs of consecutive shifts and of consecutive reductions (chain
+    # reductions such as F -> id, T -> F, E -> T) of an LR trace so each run
+    # is animated as one step. Returns (start, end) ranges of trace indices,
+    # accept is always a step of its own
+    ret = []
+    start = 0
+    for i in range(1, len(trace) + 1):
+        if i == len(trace) or trace[i][0] != trace[start][0] or \
+                trace[i][0] == 'accept':
+            ret.append((start, i))
+            start = i
+    return ret
+
+class LL1Replay(object):
+    # Replays LL(1) parse trace on the tree/stack/input state, used by both
+    # the manim visualizer and the keyframe exporter. Needs `self.parser`
+    def reset(self, string):
+        self.remaining = list(string)
+        if self.remaining[-1] != '$':
+            self.remaining.append('$')
+        tree = AbstractSyntaxTree('S\'')
+        self.curr_node_id = 0 # Assigning the node ids as we build the tree 
+        tree.node_id = self.curr_node_id 
+        self.curr_node_id += 1
+        self.stack = [tree]
+        self.popped_stack = []
+
+    def apply_step(self, action):
+        stack = self.stack
+        if action[0] == 'match':
+            self.popped_stack.append(stack.pop(-1))
+            self.remaining.pop(0)
+            return
+        prod_id = action[1]
+        prod = self.parser.grammar.prods[prod_id]
+        stack[-1].prod_id = prod_id
+        desc_list = []
+        for symbol in prod.rhs:
+            symbol = symbol.replace('$', '\\$')
+            x = AbstractSyntaxTree(symbol)
+            x.node_id = self.curr_node_id 
+            self.curr_node_id += 1
+            stack[-1].desc.append(x)
+            desc_list.append(x)
+        self.popped_stack.append(stack.pop(-1))
+        if prod.rhs[0] != YACV_EPSILON:
+            for i in range(len(desc_list)-1,-1,-1):
+                stack.append(desc_list[i])
+
+class LRReplay(object):
+    # Same as `LL1Replay` but for LR parse traces
+    def reset(self, string):
+        self.remaining = list(string)
+        if self.remaining[-1] != '$':
+            self.remaining.append('$')
+        self.stack = [0]
+        self.curr_node_id = 0 # Assigning the node ids as we build the tree 
+
+    def shift(self, state):
+        t = AbstractSyntaxTree(self.remaining[0])
+        t.node_id = self.curr_node_id 
+        self.curr_node_id += 1
+        self.stack.append(t)
+        self.stack.append(state)
+        self.remaining.pop(0)
+
+    def reduce_pop(self, prod_id):
+        prod = self.parser.grammar.prods[prod_id]
+        new_tree = AbstractSyntaxTree(prod.lhs)
+        new_tree.prod_id = prod_id 
+        new_tree.node_id = self.curr_node_id 
+        self.curr_node_id += 1
+        # I'm getting the popped list and then traversing it in 
+        # reverse direction again just so that memory references 
+        # are proper
+        # TODO: can this be optimized ?
+        popped_list = []
+        stack = self.stack
+        if prod.rhs[0] != YACV_EPSILON:
+            for _ in range(len(prod.rhs)):
+                if not stack:
+                    raise ValueError('Parsing Error: Stack prematurely empty')
+                stack.pop(-1)
+                if not stack:
+                    raise ValueError('Parsing Error: Stack prematurely empty')
+                popped_list.append(stack.pop(-1))
+        else:
+            # Note here that we don't need to increment `curr_node_id`
+            # This is because `epsilon` nodes are merged with their 
+            # parents when converting AST to Graphviz
+            new_tree.desc.append(AbstractSyntaxTree(YACV_EPSILON))
+        for i in range(len(popped_list)-1,-1,-1):
+            new_tree.desc.append(popped_list[i])
+        return new_tree
+
+    def reduce_push(self, new_tree, state):
+        self.stack.append(new_tree)
+        self.stack.append(state)
+
+    def apply_step(self, action):
+        if action[0] == 'shift':
+            self.shift(action[1])
+        elif action[0] == 'reduce':
+            new_tree = self.reduce_pop(action[1])
+            self.reduce_push(new_tree, action[2])
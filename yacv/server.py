@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import stat
+import time
+from collections import OrderedDict
+from yacv.abstractsyntaxtree import restore_units
+from yacv.constants import YACV_SERVER_CACHE_SIZE, YACV_SERVER_HOST, \
+        YACV_SERVER_PORT
+from yacv.utils import YACVError, setup_logger
+
+# `yacv serve` keeps parsers in memory and answers requests sent as JSON
+# lines over a unix socket or localhost TCP. Every request is one JSON object
+# on one line and gets exactly one JSON line back, in order:
+#   {"id": 1, "op": "parse", "grammar": "E -> E + T | T ...", "algo": "lalr1",
+#    "string": "id + id"}
+# `grammar` is the grammar text (`grammar_path` reads it from a file below the
+# `--grammar-root` the server was started with), `string` may also be a list
+# of tokens and `strings` parses a whole batch. `validate`
+# only reports whether the strings are accepted, `stats` returns cache
+# statistics and `ping` does nothing
+YACV_SERVER_OPS = ['parse', 'validate', 'stats', 'ping']
+
+class ParserCache(object):
+    # LRU of built parsers keyed by (hash of the grammar text, algorithm).
+    # `bypass_units` and `lazy_units` are passed to every LR parser built
+    def __init__(self, max_size=YACV_SERVER_CACHE_SIZE, bypass_units=False, \
+            lazy_units=False):
+        self.max_size = max_size
+        self.bypass_units = bypass_units
+        self.lazy_units = lazy_units
+        self.parsers = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # One lock per parser being built, so concurrent requests for the
+        # same cold grammar wait for a single build
+        self.locks = {}
+
+    def key(self, grammar, algo, reduce=False):
+        from yacv.yacv import parser_map
+        if algo not in parser_map:
+            raise YACVError('Unknown parsing algorithm "{}", expected one of ' \
+                    '{}'.format(algo, list(parser_map.keys())))
+        digest = hashlib.sha1(grammar.encode('utf-8')).hexdigest()
+        return (digest, algo, bool(reduce))
+
+    def lookup(self, key):
+        if key not in self.parsers:
+            return None
+        self.hits += 1
+        self.parsers.move_to_end(key)
+        return self.parsers[key]
+
+    def build(self, key, grammar):
+        from yacv.yacv import parser_map
+        log = logging.getLogger('yacv')
+        digest, algo, reduce = key
+        start = time.perf_counter()
+        if algo in ['ll1', 'earley']:
+            parser = parser_map[algo](grammar.splitlines(), reduce)
+        else:
+            parser = parser_map[algo](grammar.splitlines(), reduce, \
+                    bypass_units=self.bypass_units, lazy_units=self.lazy_units)
+        log.info('Built {} parser for grammar {} in {:.3f}s'.format(algo, \
+                digest[:12], time.perf_counter() - start))
+        return parser
+
+    def store(self, key, parser):
+        self.parsers[key] = parser
+        while len(self.parsers) > self.max_size:
+            self.parsers.popitem(last=False)
+
+    def get(self, grammar, algo, reduce=False):
+        key = self.key(grammar, algo, reduce)
+        parser = self.lookup(key)
+        if parser is None:
+            self.misses += 1
+            parser = self.build(key, grammar)
+            self.store(key, parser)
+        return parser
+
+    async def aget(self, grammar, algo, reduce=False, executor=None):
+        # Like `get` but a cold parser is built in `executor` (the loop's
+        # default thread pool when None), the event loop keeps serving the
+        # other connections meanwhile
+        key = self.key(grammar, algo, reduce)
+        parser = self.lookup(key)
+        if parser is not None:
+            return parser
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                parser = self.lookup(key)
+                if parser is None:
+                    self.misses += 1
+                    loop = asyncio.get_running_loop()
+                    parser = await loop.run_in_executor(executor, \
+                            self.build, key, grammar)
+                    self.store(key, parser)
+        finally:
+            if not lock.locked() and self.locks.get(key) is lock:
+                del self.locks[key]
+        return parser
+
+    def stats(self):
+        return {
+            'size': len(self.parsers),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+def tokenize(string):
+    tokens = string.split(' ') if isinstance(string, str) else list(string)
+    tokens = [x.strip() for x in tokens]
+    tokens = [x for x in tokens if x]
+    if not tokens or tokens[-1] != '$':
+        tokens.append('$')
+    return tokens
+
+def parse_one(parser, string, want_tree):
+    try:
+        tree = parser.parse(tokenize(string), recognize=not want_tree)
+    except (YACVError, KeyError, IndexError) as e:
+        # Malformed input surfaces as lookup errors in the parsing table
+        return {'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}
+    ret = {'ok': True}
+    if want_tree:
+        # Unit productions skipped by `--lazy-units` are put back first
+        tree = restore_units(tree, parser.grammar.prods)
+        ret['tree'] = tree.to_dict()
+    return ret
+
+def read_grammar_path(path, grammar_root):
+    # Only files below `grammar_root` can be read, anything else would let
+    # clients read (and get echoed back) any file the server can read
+    if grammar_root is None:
+        raise YACVError('"grammar_path" is disabled, start the server with ' \
+                '--grammar-root to enable it')
+    root = os.path.realpath(grammar_root)
+    fname = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, fname]) != root:
+        raise YACVError('"grammar_path" must be inside the grammar root')
+    with open(fname) as f:
+        return f.read()
+
+def check_request(request, grammar_root=None):
+    # Returns (op, grammar, algo, reduce), grammar is None for ops that
+    # don't need a parser
+    if not isinstance(request, dict):
+        raise YACVError('Request must be a JSON object')
+    op = request.get('op', 'parse')
+    if op not in YACV_SERVER_OPS:
+        raise YACVError('Unknown op "{}", expected one of {}'.format(op, \
+                YACV_SERVER_OPS))
+    if op in ['ping', 'stats']:
+        return op, None, None, False
+    grammar = request.get('grammar')
+    if grammar is None and 'grammar_path' in request:
+        grammar = read_grammar_path(request['grammar_path'], grammar_root)
+    if grammar is None:
+        raise YACVError('Request needs either "grammar" or "grammar_path"')
+    return op, grammar, request.get('algo', 'lalr1'), request.get('reduce', False)
+
+def respond(request, op, parser, cache, response):
+    response['ok'] = True
+    if op == 'stats':
+        response['stats'] = cache.stats()
+    if parser is None:
+        return response
+    want_tree = op == 'parse'
+    if 'strings' in request:
+        response['results'] = [parse_one(parser, x, want_tree) \
+                for x in request['strings']]
+    else:
+        response.update(parse_one(parser, request.get('string', ''), \
+                want_tree))
+    return response
+
+def error_response(response, e):
+    response['ok'] = False
+    response['error'] = '{}: {}'.format(type(e).__name__, e)
+    return response
+
+def handle_request(request, cache, grammar_root=None):
+    # Returns the response for one decoded request, never raises
+    response = {'id': request.get('id')} if isinstance(request, dict) else {}
+    try:
+        op, grammar, algo, reduce = check_request(request, grammar_root)
+        parser = None
+        if grammar is not None:
+            parser = cache.get(grammar, algo, reduce)
+        return respond(request, op, parser, cache, response)
+    except Exception as e:
+        return error_response(response, e)
+
+async def handle_request_async(request, cache, grammar_root=None):
+    # `handle_request` for the server, parsers are built and strings are
+    # parsed off the event loop so a long request doesn't stall the others
+    response = {'id': request.get('id')} if isinstance(request, dict) else {}
+    try:
+        op, grammar, algo, reduce = check_request(request, grammar_root)
+        parser = None
+        if grammar is not None:
+            parser = await cache.aget(grammar, algo, reduce)
+        if parser is None:
+            return respond(request, op, parser, cache, response)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, respond, request, op, \
+                parser, cache, response)
+    except Exception as e:
+        return error_response(response, e)
+
+async def handle_connection(reader, writer, cache, grammar_root=None):
+    log = logging.getLogger('yacv')
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = {'ok': False, 'error': 'Invalid JSON: {}'.format(e)}
+            else:
+                response = await handle_request_async(request, cache, \
+                        grammar_root)
+            writer.write(json.dumps(response, ensure_ascii=False).encode(\
+                'utf-8') + b'\n')
+            await writer.drain()
+    except ConnectionError as e:
+        log.debug('Connection closed: {}'.format(e))
+    finally:
+        writer.close()
+
+async def run_server(socket_path=None, host=YACV_SERVER_HOST, \
+        port=YACV_SERVER_PORT, cache_size=YACV_SERVER_CACHE_SIZE, \
+        grammar_root=None, bypass_units=False, lazy_units=False):
+    log = logging.getLogger('yacv')
+    cache = ParserCache(cache_size, bypass_units, lazy_units)
+    handler = lambda r, w: handle_connection(r, w, cache, grammar_root)
+    # Requests can be large batches, so lines are not limited to 64 KB
+    limit = 1 << 30
+    if socket_path is not None:
+        if os.path.lexists(socket_path):
+            # Only a stale socket from an earlier server is replaced
+            if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                raise YACVError('{} exists and is not a socket'.format(\
+                        socket_path))
+            os.remove(socket_path)
+        server = await asyncio.start_unix_server(handler, socket_path, \
+                limit=limit)
+        log.info('yacv server listening on {}'.format(socket_path))
+    else:
+        server = await asyncio.start_server(handler, host, port, limit=limit)
+        log.info('yacv server listening on {}:{}'.format(host, port))
+    async with server:
+        await server.serve_forever()
+
+def send_requests(requests, socket_path=None, host=YACV_SERVER_HOST, \
+        port=YACV_SERVER_PORT):
+    # Small blocking client, sends all the requests on one connection and
+    # returns the responses in the same order
+    if socket_path is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+    else:
+        sock = socket.create_connection((host, port))
+    with sock, sock.makefile('rwb') as f:
+        for request in requests:
+            f.write(json.dumps(request).encode('utf-8') + b'\n')
+        f.flush()
+        sock.shutdown(socket.SHUT_WR)
+        return [json.loads(line) for line in f]
+
+def serve_main(argv):
+    parser = argparse.ArgumentParser(prog='yacv serve', description='Serve ' \
+            'parse requests (JSON lines) with warm parsers')
+    parser.add_argument('--socket', default=None, help='Unix socket to ' \
+            'listen on, localhost TCP is used when not given')
+    parser.add_argument('--host', default=YACV_SERVER_HOST)
+    parser.add_argument('--port', type=int, default=YACV_SERVER_PORT)
+    parser.add_argument('--cache-size', type=int, \
+            default=YACV_SERVER_CACHE_SIZE, help='Number of parsers kept')
+    parser.add_argument('--grammar-root', default=None, help='Directory ' \
+            'requests can read grammars from with "grammar_path", disabled ' \
+            'when not given')
+    parser.add_argument('--bypass-units', action='store_true', help='Skip ' \
+            'unit productions while LR parsing (see lr-bypass-units)')
+    parser.add_argument('--lazy-units', action='store_true', help='Record ' \
+            'skipped unit productions instead of building their nodes')
+    args = parser.parse_args(argv)
+    setup_logger()
+    try:
+        asyncio.run(run_server(args.socket, args.host, args.port, \
+                args.cache_size, args.grammar_root, args.bypass_units, \
+                args.lazy_units))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,314 @@
+import csv
+import json
+import logging
+import os
+import numpy as np
+from yacv.constants import YACV_ACTION, YACV_GOTO, YACV_ACCEPT, YACV_ERROR, \
+        YACV_SHIFT, YACV_REDUCE, YACV_EPSILON, YACV_TABLE_ERROR, \
+        YACV_TABLE_SHIFT, YACV_TABLE_REDUCE, YACV_TABLE_ACCEPT, \
+        YACV_TABLE_GOTO, YACV_TABLE_EXPAND
+from yacv.utils import YACVError
+
+# Parsing tables as typed arrays. Every cell is a (kind, value) pair where
+# kind is one of the YACV_TABLE_* codes and value is a state number (shift,
+# goto) or production number (reduce, expand), -1 otherwise. Cells with more
+# than one entry (conflicts) keep their first entry in the dense tables and
+# list all their entries in `conflicts` as (row, column, kind, value) rows.
+# Columns of `action_*` are `terminals`, columns of `goto` are `nonterminals`.
+# Symbols in `prod_rhs` are numbered terminals first, then nonterminals and
+# an epsilon right hand side is stored as an empty slice
+YACV_TABLE_ARRAYS = ['action_kind', 'action_value', 'goto', 'conflicts', \
+        'prod_lhs', 'prod_rhs_offsets', 'prod_rhs', 'state_accept', \
+        'state_kernel_offsets', 'state_kernel']
+
+class ParsingTables(object):
+    def __init__(self, algo, terminals, nonterminals, arrays):
+        self.algo = algo
+        self.terminals = list(terminals)
+        self.nonterminals = list(nonterminals)
+        for name in YACV_TABLE_ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @property
+    def symbols(self):
+        return self.terminals + self.nonterminals
+
+    def production(self, prod_id):
+        symbols = self.symbols
+        start, end = self.prod_rhs_offsets[prod_id:prod_id+2]
+        rhs = [symbols[x] for x in self.prod_rhs[start:end]]
+        return self.nonterminals[self.prod_lhs[prod_id]], rhs
+
+    def production_text(self, prod_id):
+        lhs, rhs = self.production(prod_id)
+        return '{} -> {}'.format(lhs, ''.join(rhs) if rhs else 'ϵ')
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in YACV_TABLE_ARRAYS}
+
+    def meta(self):
+        return {
+            'algorithm': self.algo,
+            'terminals': self.terminals,
+            'nonterminals': self.nonterminals,
+            'arrays': {name: [str(x.dtype), list(x.shape)] \
+                    for name, x in self.arrays().items()}
+        }
+
+def encode_entry(entry):
+    # Parsing table entries are 's4', 'r3', '4' (goto), 'ACC' or productions
+    if entry == YACV_ACCEPT:
+        return YACV_TABLE_ACCEPT, -1
+    if isinstance(entry, str):
+        if entry[0] == YACV_SHIFT:
+            return YACV_TABLE_SHIFT, int(entry[1:])
+        if entry[0] == YACV_REDUCE:
+            return YACV_TABLE_REDUCE, int(entry[1:])
+        return YACV_TABLE_GOTO, int(entry)
+    return YACV_TABLE_EXPAND, entry
+
+def parsing_tables(parser, algo=None):
+    # Encodes `parser.parsing_table` (LR or LL(1)) into a ParsingTables
+    grammar = parser.grammar
+    terminals = list(grammar.terminals)
+    nonterminals = list(grammar.nonterminals.keys())
+    symbol_id = {x: i for i, x in enumerate(terminals + nonterminals)}
+    prods = grammar.prods
+    prod_id = {}
+    for i, prod in enumerate(prods):
+        prod_id.setdefault(str(prod), i)
+    lr = hasattr(parser, 'automaton_states')
+    if algo is None:
+        algo = 'lr' if lr else 'll1'
+    table = parser.parsing_table
+    cells = table.to_numpy()
+    if lr:
+        n_rows = len(table.index)
+        action_cols = [list(table.columns).index((YACV_ACTION, t)) \
+                for t in terminals]
+        goto_cols = [list(table.columns).index((YACV_GOTO, nt)) \
+                for nt in nonterminals]
+    else:
+        n_rows = len(nonterminals)
+        action_cols = [list(table.columns).index(t) for t in terminals]
+        goto_cols = []
+    action_kind = np.zeros((n_rows, len(terminals)), dtype=np.int8)
+    action_value = np.full((n_rows, len(terminals)), -1, dtype=np.int32)
+    goto = np.full((n_rows, len(goto_cols)), -1, dtype=np.int32)
+    conflicts = []
+    for r in range(n_rows):
+        for c, col in enumerate(action_cols + goto_cols):
+            entries = cells[r, col]
+            if isinstance(entries, str):
+                entries = [] if entries == YACV_ERROR else [entries]
+            if not entries:
+                continue
+            encoded = []
+            for entry in entries:
+                kind, value = encode_entry(entry)
+                if kind == YACV_TABLE_EXPAND:
+                    value = prod_id[str(value)]
+                encoded.append((kind, value))
+            if c < len(action_cols):
+                action_kind[r, c], action_value[r, c] = encoded[0]
+            else:
+                goto[r, c - len(action_cols)] = encoded[0][1]
+            if len(encoded) > 1:
+                conflicts.extend([(r, c, k, v) for k, v in encoded])
+    conflicts = np.array(conflicts, dtype=np.int32).reshape(-1, 4)
+
+    prod_lhs = np.array([nonterminals.index(p.lhs) for p in prods], \
+            dtype=np.int32)
+    rhs = [[symbol_id[x] for x in p.rhs if x != YACV_EPSILON] for p in prods]
+    prod_rhs_offsets = np.zeros(len(prods) + 1, dtype=np.int32)
+    prod_rhs_offsets[1:] = np.cumsum([len(x) for x in rhs])
+    prod_rhs = np.array([x for r in rhs for x in r], dtype=np.int32)
+
+    if lr:
+        states = parser.automaton_states
+        state_accept = np.array([s.accept for s in states], dtype=np.bool_)
+        kernels = [[(prod_id[str(item.production)], item.dot_pos) \
+                for item in parser.kernel_items(s)] for s in states]
+    else:
+        state_accept = np.zeros(0, dtype=np.bool_)
+        kernels = []
+    state_kernel_offsets = np.zeros(len(kernels) + 1, dtype=np.int32)
+    state_kernel_offsets[1:] = np.cumsum([len(x) for x in kernels])
+    state_kernel = np.array([x for k in kernels for x in k], \
+            dtype=np.int32).reshape(-1, 2)
+    return ParsingTables(algo, terminals, nonterminals, {
+        'action_kind': action_kind,
+        'action_value': action_value,
+        'goto': goto,
+        'conflicts': conflicts,
+        'prod_lhs': prod_lhs,
+        'prod_rhs_offsets': prod_rhs_offsets,
+        'prod_rhs': prod_rhs,
+        'state_accept': state_accept,
+        'state_kernel_offsets': state_kernel_offsets,
+        'state_kernel': state_kernel
+    })
+
+def decode_entry(tables, kind, value):
+    if kind == YACV_TABLE_SHIFT:
+        return YACV_SHIFT + str(value)
+    if kind == YACV_TABLE_REDUCE:
+        return YACV_REDUCE + str(value)
+    if kind == YACV_TABLE_ACCEPT:
+        return YACV_ACCEPT
+    if kind == YACV_TABLE_EXPAND:
+        return tables.production_text(value)
+    return str(value)
+
+def write_parsing_table_csv(tables, f):
+    # Same layout as `parsing_table.to_csv()` but written row by row from the
+    # typed arrays, so no frame of strings is ever built
+    writer = csv.writer(f, lineterminator='\n')
+    lr = tables.algo != 'll1'
+    conflicts = {}
+    for r, c, kind, value in tables.conflicts.tolist():
+        conflicts.setdefault((r, c), []).append(decode_entry(tables, kind, \
+                value))
+    n_actions = len(tables.terminals)
+    if lr:
+        writer.writerow([''] + [YACV_ACTION] * n_actions + \
+                [YACV_GOTO] * len(tables.nonterminals))
+        writer.writerow([''] + tables.symbols)
+        rows = range(tables.action_kind.shape[0])
+    else:
+        writer.writerow([''] + tables.terminals)
+        rows = tables.nonterminals
+    for r, row_name in enumerate(rows):
+        row = [row_name]
+        kinds, values = tables.action_kind[r].tolist(), \
+                tables.action_value[r].tolist()
+        for c in range(n_actions):
+            if (r, c) in conflicts:
+                entries = conflicts[(r, c)]
+            elif kinds[c] == YACV_TABLE_ERROR:
+                row.append(YACV_ERROR)
+                continue
+            elif kinds[c] == YACV_TABLE_ACCEPT:
+                row.append(YACV_ACCEPT)
+                continue
+            else:
+                entries = [decode_entry(tables, kinds[c], values[c])]
+            if lr:
+                row.append(str(entries))
+            else:
+                row.append('[' + ', '.join(entries) + ']')
+        for c, value in enumerate(tables.goto[r].tolist()):
+            if (r, c + n_actions) in conflicts:
+                row.append(str(conflicts[(r, c + n_actions)]))
+            else:
+                row.append(YACV_ERROR if value < 0 else str([str(value)]))
+        writer.writerow(row)
+
+def save_npy_dir(tables, path):
+    # Raw format: one `.npy` file per array plus `meta.json` with the symbol
+    # names, dtypes and shapes. Every array can be memory mapped on its own
+    os.makedirs(path, exist_ok=True)
+    for name, x in tables.arrays().items():
+        np.save(os.path.join(path, name + '.npy'), x)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(tables.meta(), f, ensure_ascii=False, indent=1)
+
+def save_npz(tables, path):
+    meta = np.array(json.dumps(tables.meta(), ensure_ascii=False))
+    np.savez(path, meta=meta, **tables.arrays())
+
+def save_parquet(tables, path):
+    # One row per cell that is not an error (long format). The dense tables,
+    # productions and state info are rebuilt from the schema metadata
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    rows, cols = np.nonzero(tables.action_kind)
+    goto_rows, goto_cols = np.nonzero(tables.goto >= 0)
+    n_actions = len(tables.terminals)
+    data = {
+        'row': np.concatenate([rows, goto_rows]).astype(np.int32),
+        'column': np.concatenate([cols, goto_cols + n_actions])\
+                .astype(np.int32),
+        'kind': np.concatenate([tables.action_kind[rows, cols], \
+                np.full(len(goto_rows), YACV_TABLE_GOTO)]).astype(np.int8),
+        'value': np.concatenate([tables.action_value[rows, cols], \
+                tables.goto[goto_rows, goto_cols]]).astype(np.int32)
+    }
+    meta = tables.meta()
+    meta['shape'] = [int(tables.action_kind.shape[0]), n_actions, \
+            int(tables.goto.shape[1])]
+    extra = {}
+    for name in YACV_TABLE_ARRAYS[3:]:
+        x = getattr(tables, name)
+        extra[name] = x.tolist()
+    meta['extra'] = extra
+    table = pa.table(data).replace_schema_metadata({
+        'yacv': json.dumps(meta, ensure_ascii=False)
+    })
+    pq.write_table(table, path)
+
+def load_parquet(path):
+    import pyarrow.parquet as pq
+    table = pq.read_table(path)
+    meta = json.loads(table.schema.metadata[b'yacv'])
+    n_rows, n_actions, n_gotos = meta['shape']
+    arrays = {
+        'action_kind': np.zeros((n_rows, n_actions), dtype=np.int8),
+        'action_value': np.full((n_rows, n_actions), -1, dtype=np.int32),
+        'goto': np.full((n_rows, n_gotos), -1, dtype=np.int32)
+    }
+    row, col = table['row'].to_numpy(), table['column'].to_numpy()
+    kind, value = table['kind'].to_numpy(), table['value'].to_numpy()
+    action = col < n_actions
+    arrays['action_kind'][row[action], col[action]] = kind[action]
+    arrays['action_value'][row[action], col[action]] = value[action]
+    arrays['goto'][row[~action], col[~action] - n_actions] = value[~action]
+    for name, x in meta['extra'].items():
+        dtype, shape = meta['arrays'][name]
+        arrays[name] = np.array(x, dtype=dtype).reshape(shape)
+    return ParsingTables(meta['algorithm'], meta['terminals'], \
+            meta['nonterminals'], arrays)
+
+def save_parsing_tables(tables, path, fmt=None):
+    # `fmt` defaults to the extension of `path`: .csv, .npz, .parquet, anything
+    # else is written as a directory of raw `.npy` arrays
+    log = logging.getLogger('yacv')
+    if fmt is None:
+        fmt = os.path.splitext(path)[1][1:] or 'npy'
+    if fmt == 'csv':
+        with open(path, 'w', newline='') as f:
+            write_parsing_table_csv(tables, f)
+    elif fmt == 'npz':
+        save_npz(tables, path)
+    elif fmt == 'parquet':
+        try:
+            save_parquet(tables, path)
+        except ImportError:
+            path = os.path.splitext(path)[0]
+            log.warning('pyarrow is not installed, writing raw arrays to {} ' \
+                    'instead'.format(path))
+            save_npy_dir(tables, path)
+    elif fmt == 'npy':
+        save_npy_dir(tables, path)
+    else:
+        raise YACVError('Unknown parsing table format "{}"'.format(fmt))
+    log.info('Parsing table exported to {}'.format(path))
+    return path
+
+def load_parsing_tables(path, mmap_mode=None):
+    # Loads any of the binary formats written by `save_parsing_tables`.
+    # `mmap_mode` (e.g. 'r') memory maps the arrays of a raw `.npy` directory
+    if os.path.isdir(path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), \
+                mmap_mode=mmap_mode) for name in YACV_TABLE_ARRAYS}
+        return ParsingTables(meta['algorithm'], meta['terminals'], \
+                meta['nonterminals'], arrays)
+    if path.endswith('.parquet'):
+        return load_parquet(path)
+    with np.load(path) as data:
+        meta = json.loads(str(data['meta']))
+        arrays = {name: data[name] for name in YACV_TABLE_ARRAYS}
+    return ParsingTables(meta['algorithm'], meta['terminals'], \
+            meta['nonterminals'], arrays)
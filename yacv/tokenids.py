@@ -0,0 +1,58 @@
+import mmap
+from yacv.utils import YACVError
+
+# Pre-tokenized input. A token id is the position of the terminal in
+# `grammar.terminals` (sorted, '$' included), the same numbering as the
+# columns of the exported parsing tables (see yacv.tableexport). Ids can come
+# in any 1-D buffer: a NumPy array, an `array.array`, a memoryview, bytes or
+# an mmapped file. The buffer is wrapped in a memoryview and read one element
+# at a time, nothing is copied and no string is built per token
+
+def token_id_view(ids, fmt=None):
+    # `fmt` is the struct format of one id ('i', 'q', 'H', ...). Only needed
+    # for raw bytes like an mmapped file, typed buffers carry their own
+    view = ids if isinstance(ids, memoryview) else memoryview(ids)
+    if fmt is not None and view.format != fmt:
+        try:
+            view = view.cast('B').cast(fmt)
+        except (TypeError, ValueError) as e:
+            raise YACVError('Cannot read the token ids as {!r}: {}'.format(\
+                    fmt, e))
+    if view.ndim != 1:
+        raise YACVError('Token ids must be a 1-D buffer, got {} '\
+                'dimensions'.format(view.ndim))
+    return view
+
+def load_token_ids(fname, fmt='i'):
+    # Maps a file of native-endian ids read-only. The map lives as long as
+    # the returned view
+    with open(fname, 'rb') as f:
+        if not f.seek(0, 2):
+            return memoryview(b'').cast(fmt)
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return token_id_view(data, fmt)
+
+def feed_token_ids(steps, ids, terminals):
+    # Same as `yacv.asyncparse.feed_tokens` for a view of token ids. Every id
+    # is turned into the grammar's own terminal string, the parser core is
+    # unchanged
+    n_terminals = len(terminals)
+    end = terminals.index('$')
+    try:
+        try:
+            next(steps)
+            for i in range(len(ids)):
+                t = ids[i]
+                if not 0 <= t < n_terminals:
+                    raise YACVError('Token id {} at position {} is not a ' \
+                            'terminal of the grammar'.format(t, i))
+                steps.send(terminals[t])
+                if t == end:
+                    break
+            else:
+                steps.send('$')
+        except StopIteration as e:
+            return e.value
+        raise YACVError('Unexpected end of input')
+    finally:
+        steps.close()
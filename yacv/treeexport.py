@@ -0,0 +1,125 @@
+import logging
+import os
+import shutil
+import subprocess
+from yacv.constants import YACV_GRAPHVIZ_COLORS, YACV_GRAPHVIZ_INFINITY, \
+        YACV_EPSILON
+from yacv.utils import YACVError
+from yacv.layoutcache import layout_graph
+
+def dot_quote(x):
+    return '"' + str(x).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def html_escape(x):
+    return str(x).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def syntaxtree_dot_lines(tree, terminals, colors=None, \
+        name='AbstractSyntaxTree'):
+    # Walks the tree once (DFS) and yields the DOT source line by line.
+    # Children get their ids when the parent is visited so the edges and the
+    # `rank=same` subgraph of a production are emitted together. Terminals
+    # are chained left to right as they are found, graphviz merges all the
+    # `Terminals` subgraphs with the same name into one. Only the pending
+    # children on the current path are kept in memory
+    colors = colors if colors else YACV_GRAPHVIZ_COLORS
+    terminals = set(terminals)
+    yield 'digraph {} {{\n'.format(dot_quote(name))
+    yield '  node [ordering=out, shape=none, height=0, width=0, margin=0.1];\n'
+    yield '  edge [dir=none];\n'
+    node_id = 0
+    prev_terminal = None
+    stack = [iter([(tree, node_id)])]
+    node_id += 1
+    while stack:
+        item = next(stack[-1], None)
+        if item is None:
+            stack.pop(-1)
+            continue
+        top, node = item
+        attrs = []
+        desc = top.desc
+        if desc and desc[0].root == YACV_EPSILON:
+            attrs.append('label=<{} = &#x3B5;>'.format(html_escape(top.root)))
+            desc = []
+        else:
+            attrs.append('label=' + dot_quote(top.root))
+        color = None
+        if top.prod_id is not None:
+            color = colors[top.prod_id % len(colors)]
+            attrs.append('fontcolor=' + dot_quote(color))
+        yield '  {} [{}];\n'.format(node, ', '.join(attrs))
+        if top.root in terminals and not top.desc:
+            if prev_terminal is None:
+                yield '  subgraph Terminals {{ rank=max; {}; }}\n'.format(node)
+            else:
+                yield '  subgraph Terminals {{ rank=max; {} -> {} ' \
+                    '[style=invis]; }}\n'.format(prev_terminal, node)
+            prev_terminal = node
+        if not desc:
+            continue
+        children = []
+        for d in desc:
+            children.append((d, node_id))
+            node_id += 1
+        for d, child in children:
+            if color is None:
+                yield '  {} -> {};\n'.format(node, child)
+            else:
+                yield '  {} -> {} [color={}];\n'.format(node, child, \
+                        dot_quote(color))
+        nonterminals = [child for d, child in children \
+                if d.root not in terminals]
+        if len(nonterminals) > 1:
+            chain = ' -> '.join(str(x) for x in nonterminals)
+            yield '  subgraph Production{} {{ rank=same; {} [style=invis, ' \
+                'weight={}]; }}\n'.format(node, chain, YACV_GRAPHVIZ_INFINITY)
+        stack.append(iter(children))
+    yield '}\n'
+
+def syntaxtree_to_dot(tree, terminals, colors=None):
+    return ''.join(syntaxtree_dot_lines(tree, terminals, colors))
+
+def write_syntaxtree_dot(tree, terminals, f, colors=None):
+    for line in syntaxtree_dot_lines(tree, terminals, colors):
+        f.write(line)
+
+def export_syntaxtree(tree, terminals, fname, colors=None, fmt=None, \
+        layout='dot', stream=False):
+    # `fmt` defaults to the file extension. DOT is written directly, any other
+    # format is rendered with `layout`, which is either a layout program
+    # ('tidy' or a graphviz program) or a callable(lines, fname, fmt). By
+    # default pygraphviz lays out the graph in process (through the layout
+    # cache), `stream` pipes the DOT source into the graphviz binary instead
+    # so very large trees are never held as a graph in this process. It falls
+    # back to pygraphviz when the binary is not installed
+    log = logging.getLogger('yacv')
+    if fmt is None:
+        fmt = os.path.splitext(fname)[1][1:] or 'dot'
+    lines = syntaxtree_dot_lines(tree, terminals, colors)
+    if fmt in ['dot', 'gv']:
+        with open(fname, 'w') as f:
+            for line in lines:
+                f.write(line)
+    elif callable(layout):
+        layout(lines, fname, fmt)
+    elif stream and layout != 'tidy' and shutil.which(layout) is not None:
+        proc = subprocess.Popen([layout, '-T' + fmt, '-o', fname], \
+                stdin=subprocess.PIPE)
+        try:
+            for line in lines:
+                proc.stdin.write(line.encode('utf-8'))
+        finally:
+            proc.stdin.close()
+        if proc.wait() != 0:
+            raise YACVError('{} exited with status {} while exporting {}'\
+                    .format(layout, proc.returncode, fname))
+    else:
+        if stream and layout != 'tidy':
+            log.warning('{} not found, laying out {} with pygraphviz'.format(\
+                    layout, fname))
+        import pygraphviz as pgv
+        G = pgv.AGraph(string=''.join(lines))
+        layout_graph(G, layout)
+        G.draw(fname, format=fmt)
+    log.info('Syntax tree exported to {}'.format(fname))
+    return fname
@@ -0,0 +1,194 @@
+import logging
+import numpy as np
+from yacv.constants import YACV_TIDY_NODE_SEP, YACV_TIDY_RANK_SEP, \
+        YACV_TIDY_CHAR_WIDTH, YACV_TIDY_NODE_HEIGHT
+
+# In-process replacement for `dot` on ordered trees and forests. Node x
+# coordinates come from Walker's algorithm with Buchheim et al.'s linear time
+# improvements ("Improving Walker's Algorithm to Run in Linear Time", 2002).
+# Both walks are iterative, so deep trees don't hit the recursion limit
+
+def tidy_tree_positions(children, roots, widths, node_sep=YACV_TIDY_NODE_SEP):
+    # children: list of child index lists (ordered), roots: ordered list of
+    # root indices, widths: node widths. Returns (x, depth) arrays where x is
+    # the center of each node and siblings/cousins never overlap
+    n = len(children)
+    # A virtual root (index n) turns the forest into a single tree
+    children = list(children) + [list(roots)]
+    widths = list(widths) + [0.0]
+    parent = [-1] * (n + 1)
+    number = [0] * (n + 1)
+    for v in range(n + 1):
+        for i, w in enumerate(children[v]):
+            parent[w] = v
+            number[w] = i
+    prelim = [0.0] * (n + 1)
+    mod = [0.0] * (n + 1)
+    shift = [0.0] * (n + 1)
+    change = [0.0] * (n + 1)
+    thread = [-1] * (n + 1)
+    ancestor = list(range(n + 1))
+    midpoint = [0.0] * (n + 1)
+
+    def sep(a, b):
+        return (widths[a] + widths[b]) / 2.0 + node_sep
+
+    def next_left(v):
+        return children[v][0] if children[v] else thread[v]
+
+    def next_right(v):
+        return children[v][-1] if children[v] else thread[v]
+
+    def left_sibling(v):
+        p = parent[v]
+        return children[p][number[v] - 1] if p >= 0 and number[v] > 0 else -1
+
+    def move_subtree(wm, wp, amount):
+        subtrees = number[wp] - number[wm]
+        change[wp] -= amount / subtrees
+        shift[wp] += amount
+        change[wm] += amount / subtrees
+        prelim[wp] += amount
+        mod[wp] += amount
+
+    def apportion(v, default_ancestor):
+        w = left_sibling(v)
+        if w < 0:
+            return default_ancestor
+        vip = vop = v
+        vim = w
+        vom = children[parent[v]][0]
+        sip, sop, sim, som = mod[vip], mod[vop], mod[vim], mod[vom]
+        while next_right(vim) >= 0 and next_left(vip) >= 0:
+            vim = next_right(vim)
+            vip = next_left(vip)
+            vom = next_left(vom)
+            vop = next_right(vop)
+            ancestor[vop] = v
+            amount = (prelim[vim] + sim) - (prelim[vip] + sip) + sep(vim, vip)
+            if amount > 0:
+                a = ancestor[vim]
+                a = a if parent[a] == parent[v] else default_ancestor
+                move_subtree(a, v, amount)
+                sip += amount
+                sop += amount
+            sim += mod[vim]
+            sip += mod[vip]
+            som += mod[vom]
+            sop += mod[vop]
+        if next_right(vim) >= 0 and next_right(vop) < 0:
+            thread[vop] = next_right(vim)
+            mod[vop] += sim - sop
+        if next_left(vip) >= 0 and next_left(vom) < 0:
+            thread[vom] = next_left(vip)
+            mod[vom] += sip - som
+            default_ancestor = v
+        return default_ancestor
+
+    def place(v):
+        # The part of the first walk that depends on the left sibling
+        w = left_sibling(v)
+        if w >= 0:
+            prelim[v] = prelim[w] + sep(w, v)
+            mod[v] = prelim[v] - midpoint[v]
+        else:
+            prelim[v] = midpoint[v]
+
+    # First walk in post order. Apportioning a child only touches the child
+    # and its left siblings, so it is done once all the children are done
+    stack = [(n, False)]
+    while stack:
+        v, expanded = stack.pop(-1)
+        if not expanded:
+            stack.append((v, True))
+            for w in reversed(children[v]):
+                stack.append((w, False))
+            continue
+        if not children[v]:
+            continue
+        default_ancestor = children[v][0]
+        for w in children[v]:
+            place(w)
+            default_ancestor = apportion(w, default_ancestor)
+        # Execute shifts
+        s = c = 0.0
+        for w in reversed(children[v]):
+            prelim[w] += s
+            mod[w] += s
+            c += change[w]
+            s += shift[w] + c
+        midpoint[v] = (prelim[children[v][0]] + prelim[children[v][-1]]) / 2
+    place(n)
+
+    # Second walk in pre order
+    x = np.zeros(n + 1)
+    depth = np.zeros(n + 1, dtype=int)
+    stack = [(n, -prelim[n], -1)]
+    while stack:
+        v, m, d = stack.pop(-1)
+        x[v] = prelim[v] + m
+        depth[v] = d
+        for w in children[v]:
+            stack.append((w, m + mod[v], d + 1))
+    x, depth = x[:n], depth[:n]
+    if n:
+        x -= (x - np.asarray(widths[:n]) / 2).min()
+    return x, depth
+
+def label_width(label, char_width=YACV_TIDY_CHAR_WIDTH):
+    # Rough width estimate, HTML labels (<X = &#x3B5;>) count the entity once
+    label = str(label)
+    if label.startswith('<') and label.endswith('>'):
+        label = label[1:-1].replace('&#x3B5;', 'e')
+    return max(len(label), 1) * char_width
+
+def tidy_layout(G, rank_sep=YACV_TIDY_RANK_SEP, node_sep=YACV_TIDY_NODE_SEP):
+    # Lays out a pygraphviz tree/forest the way `G.layout('dot')` would: fills
+    # node `pos`, edge `pos` (as cubic splines) and graph `bb`. Invisible
+    # edges are ignored and nodes in the `Terminals` subgraph are put on the
+    # last rank like the `rank=max`/`rank=sink` subgraph in dot
+    log = logging.getLogger('yacv')
+    names = [str(x) for x in G.nodes()]
+    index = {name: i for i, name in enumerate(names)}
+    labels = [G.get_node(x).attr['label'] or x for x in names]
+    n = len(names)
+    children = [[] for _ in range(n)]
+    has_parent = [False] * n
+    edges = []
+    for e in G.edges():
+        if e.attr['style'] == 'invis':
+            continue
+        u, v = index[str(e[0])], index[str(e[1])]
+        children[u].append(v)
+        has_parent[v] = True
+        edges.append((e, u, v))
+    roots = [i for i in range(n) if not has_parent[i]]
+    widths = np.array([label_width(x) for x in labels], dtype=float)
+    x, depth = tidy_tree_positions(children, roots, widths, node_sep)
+    terminals = G.get_subgraph('Terminals')
+    if terminals is not None and n:
+        t = np.array([index[str(v)] for v in terminals.nodes()], dtype=int)
+        if len(t):
+            depth[t] = depth.max()
+    max_depth = depth.max() if n else 0
+    half = YACV_TIDY_NODE_HEIGHT / 2
+    y = (max_depth - depth) * rank_sep + half
+    width = (x + widths / 2).max() if n else 0
+    height = max_depth * rank_sep + 2 * half
+    for i, name in enumerate(names):
+        G.get_node(name).attr['pos'] = '{:.2f},{:.2f}'.format(x[i], y[i])
+    if edges:
+        # Straight edges between the bottom of the parent and the top of the
+        # child, written as a single cubic bezier segment
+        u = np.array([e[1] for e in edges])
+        v = np.array([e[2] for e in edges])
+        start = np.stack([x[u], y[u] - half], axis=1)
+        end = np.stack([x[v], y[v] + half], axis=1)
+        t = np.array([0.0, 1/3, 2/3, 1.0])[None, :, None]
+        points = start[:, None, :] + t * (end - start)[:, None, :]
+        for (e, _, _), p in zip(edges, points):
+            e.attr['pos'] = ' '.join('{:.2f},{:.2f}'.format(*q) for q in p)
+    G.graph_attr['bb'] = '0,0,{:.2f},{:.2f}'.format(width, height)
+    G.has_layout = True
+    log.debug('Tidy layout of {} nodes, bb = {}'.format(n, G.graph_attr['bb']))
+    return G
@@ -1,15 +1,7 @@
-try:
-    from manimlib import *
-    manimce = False
-except ImportError as e:
-    from manim import *
-    manimce = True
 import logging
 import os 
-from rich.traceback import install
-from rich.logging import RichHandler 
 import yacv.constants as constants 
-from yacv.constants import yacv_manimce_config, yacv_manim_config
+from yacv.constants import yacv_manimce_config, yacv_manim_config, manimce
 class YACVError(Exception):
     pass
 
@@ -23,6 +15,12 @@ def prepare_text(x):
 def setup_logger():
     log = logging.getLogger('yacv')
     log.setLevel('INFO')
+    try:
+        from rich.traceback import install
+        from rich.logging import RichHandler 
+    except ImportError as e:
+        log.addHandler(logging.StreamHandler())
+        return
     log.addHandler(RichHandler())
     install()
     return
@@ -9,6 +9,7 @@ except ImportError as e:
     manimce = True 
 import argparse
 import logging 
+import os
 import pygraphviz as pgv
 import numpy as np
 from copy import deepcopy
@@ -17,14 +18,19 @@ from yacv.constants import *
 from yacv.ll1 import *
 from yacv.lr import *
 from yacv.mobjects import *
+from yacv.replay import *
 
-class LL1ParsingVisualizer(Scene):
-    def setup(self, parser=None, string=None, colors=None, **kwargs):
+class ParsingVisualizer(Scene):
+    # Common parts of LL(1) and LR visualizers. Parsing is replayed from the
+    # parse trace, which lets a scene start at any step (`start_step`) and
+    # stop before any step (`end_step`). See `render_segments`
+    def setup(self, parser=None, string=None, colors=None, start_step=0, \
+            end_step=None, coalesce=False, time_budget=None, **kwargs):
         if hasattr(self, 'grammar_setup_done') and self.grammar_setup_done:
             super().setup(**kwargs)
             return
         self.parser = parser 
-        if not parser.is_ll1:
+        if not self.parser_valid(parser):
             raise YACVError('Grammar is not valid for chosen parsing algorithm. Parsing will not continue')
         if isinstance(string, str):
             string = string.split(' ')
@@ -33,106 +39,185 @@ class LL1ParsingVisualizer(Scene):
             string.append('$')
         self.string = string 
         self.colors = colors 
+        self.start_step = start_step
+        self.end_step = end_step
+        self.coalesce = coalesce
+        self.time_budget = time_budget
+        self.run_time = YACV_MANIM_RUN_TIME
+        self.wait_time = YACV_MANIM_WAIT_TIME
+        self.label_pool = LabelPool()
+        self.profile = None
+        self.status_pos = 5.5*LEFT + 3*UP
+        self.string_pos = 0*LEFT + 3.5*DOWN
         self.grammar_setup_done = True
         super().setup(**kwargs)
 
+    def parser_valid(self, parser):
+        return True
+
+    def string_mobject(self, string):
+        string_text = [YACV_MANIM_STRING_LEADER]
+        string_text.extend([prepare_text(x) for x in string])
+        string_text.append(']')
+        logging.getLogger('yacv').debug(string_text)
+        ret = Tex(*string_text)
+        ret.arrange(RIGHT, buff=0.25)
+        ret.move_to(self.string_pos)
+        ret[1].set_color(RED)
+        ret.scale(YACV_MANIM_STRING_SCALE)
+        return ret
+
+    def status_text(self, text, scale=YACV_MANIM_STATUS_SCALE):
+        ret = self.label_pool.text(text)
+        ret.scale(scale)
+        ret.move_to(self.status_pos)
+        return ret
+
+    def status_tex(self, text, color=None):
+        ret = self.label_pool.tex(text)
+        ret.move_to(self.status_pos)
+        if color is not None:
+            ret.set_color(color)
+        ret.scale(YACV_MANIM_STATUS_SCALE)
+        return ret
+
+    def play_status(self, status_mobject, new_status_mobject, wait=True):
+        self.play(Transform(status_mobject, new_status_mobject), \
+                run_time=self.run_time)
+        self.play(ShowCreationThenDestructionAround(new_status_mobject), \
+                run_time=self.run_time)
+        if wait:
+            self.pause()
+        self.remove(new_status_mobject)
+
+    def pause(self):
+        if self.wait_time > 0:
+            self.wait(self.wait_time)
+
+    def set_pace(self, plays, waits):
+        # Shortens animations and pauses so that `plays` animations and
+        # `waits` pauses fit in `time_budget` seconds. Pauses are dropped
+        # before animations go below YACV_MANIM_MIN_RUN_TIME
+        log = logging.getLogger('yacv')
+        self.run_time = YACV_MANIM_RUN_TIME
+        self.wait_time = YACV_MANIM_WAIT_TIME
+        if self.time_budget is None:
+            return
+        budget = float(self.time_budget)
+        total = plays * self.run_time + waits * self.wait_time
+        if total <= budget:
+            return
+        scale = budget / total
+        self.run_time = max(YACV_MANIM_MIN_RUN_TIME, YACV_MANIM_RUN_TIME * scale)
+        left = budget - plays * self.run_time
+        self.wait_time = max(0, min(YACV_MANIM_WAIT_TIME * scale, \
+                left / waits if waits else 0))
+        if left < 0:
+            log.warning('{} animations do not fit in a time budget of {}s, ' \
+                    'the video will last {:.1f}s'.format(plays, budget, \
+                    plays * self.run_time))
+        log.info('Animations last {:.2f}s and pauses {:.2f}s to fit in {}s' \
+                .format(self.run_time, self.wait_time, budget))
+
+    def pace(self, trace, chunks):
+        # Pace is computed over the whole parse, so that every segment of
+        # `render_segments` plays at the same speed
+        plays, waits = 0, 0
+        for start, end in chunks:
+            cost = self.step_cost(trace[start:end])
+            plays += cost[0]
+            waits += cost[1]
+        self.set_pace(plays, waits)
+
+    def step_done(self, actions):
+        # Called after every animated step, `profile` is set by yacv.bench
+        if self.profile is not None:
+            self.profile.step(actions)
+
+    def steps(self, trace):
+        # Range of trace indices animated by this scene
+        end = len(trace) if self.end_step is None else \
+                min(self.end_step, len(trace))
+        return range(self.start_step, end)
+
+    def chunks(self, trace):
+        # (start, end) ranges of the whole trace that are animated as one
+        # step each, see `coalesce_trace`
+        if self.coalesce:
+            return coalesce_trace(trace)
+        return [(i, i + 1) for i in range(len(trace))]
+
+class LL1ParsingVisualizer(LL1Replay, ParsingVisualizer):
+    def parser_valid(self, parser):
+        return parser.is_ll1
+
+    def prod_text(self, prod):
+        prod_text = '{} '.format(prod.lhs)
+        prod_text += '$\\rightarrow$' if manimce else '\\rightarrow'
+        if prod.rhs[0] == YACV_EPSILON:
+            prod_text += ' $\\epsilon$' if manimce else ' \\epsilon'
+        else:
+            prod_text += ' {}'.format(''.join(prod.rhs)\
+                    .replace('$', '\\$'))
+        return prod_text
+
+    def status_mobject(self, action):
+        if action[0] == 'match':
+            return self.status_text('Match {}'.format(action[1]), \
+                    YACV_MANIM_STRING_SCALE)
+        prod = self.parser.grammar.prods[action[1]]
+        return self.status_tex(self.prod_text(prod))
+
+    def step_cost(self, actions):
+        # (animations, pauses) played by `construct` for one step
+        if actions[0][0] == 'accept':
+            return 2, 1
+        return 3, 1
+
     def construct(self):
         log = logging.getLogger('yacv')
         p = self.parser
         assert p is not None
-        string = self.string 
-        tree = AbstractSyntaxTree('S\'')
-        curr_node_id = 0 # Assigning the node ids as we build the tree 
-        tree.node_id = curr_node_id 
-        curr_node_id += 1
-        stack = [tree]
-        popped_stack = []
-
-        old_stack_mobject = StackMobject(stack)
+        trace = ll1_parse_trace(p, self.string)
+        steps = self.steps(trace)
+        # Steps are never coalesced, accept is played after the trace
+        self.pace(trace + [('accept',)], \
+                [(i, i + 1) for i in range(len(trace) + 1)])
+        self.reset(self.string)
+        # Fast forward to the first step of this scene 
+        for action in trace[:steps.start]:
+            self.apply_step(action)
+
+        stack_mobject = StackMobject(self.stack, self.label_pool)
         prev_mobject = None 
         curr_mobject = None 
-        status_mobject  = Text('START')
-        status_mobject.scale(YACV_MANIM_STATUS_SCALE)
-        status_pos = 5.5*LEFT + 3*UP
-        string_text = [YACV_MANIM_STRING_LEADER]
-        string_text.extend([prepare_text(x) for x in string])
-        string_text.append(']')
-        string_mobject = Tex(*string_text)
-        string_mobject.arrange(RIGHT, buff=0.25)
-        string_pos = 0*LEFT + 3.5*DOWN
-        string_mobject.move_to(string_pos)
-        string_mobject[1].set_color(RED)
-        string_mobject.scale(YACV_MANIM_STRING_SCALE)
-        status_mobject.move_to(status_pos)
+        if steps.start == 0:
+            status_mobject = self.status_text('START')
+        else:
+            status_mobject = self.status_mobject(trace[steps.start-1])
+            prev_mobject = GraphvizMobject(stack_to_graphviz(\
+                    [self.popped_stack[0]], p.grammar, self.colors), \
+                    self.label_pool)
+            self.add(prev_mobject)
+        string_mobject = self.string_mobject(self.remaining)
 
         self.add(status_mobject)
         self.add(string_mobject)
-        self.add(old_stack_mobject)
-        # Assigning the stack top to a variable loses the tree ref 
-        # https://stackoverflow.com/questions/986006/how-do-i-pass-a-variable-by-reference
-        while stack[-1].root != '$' and stack[-1].root != '\\$':
-            a = string[0]
-            if a == '\\$':
-                a = '$'
-            if stack[-1].root == a:
-                popped_stack.append(stack.pop(-1))
-                a = string.pop(0)
-                new_status_mobject = Text('Match {}'.format(a))
-                new_status_mobject.scale(YACV_MANIM_STRING_SCALE)
-                new_status_mobject.move_to(status_pos)
-                self.play(Transform(status_mobject, new_status_mobject))
-                self.play(ShowCreationThenDestructionAround(new_status_mobject))
-                self.remove(new_status_mobject)
-            elif stack[-1].root in p.grammar.terminals:
-                raise ValueError('Error because top = {}, terminal'.format(stack[-1].root))
-            elif p.parsing_table.at[stack[-1].root.replace('\\$', '$'), a] ==\
-                    YACV_ERROR:
-                raise ValueError('Error entry in the parsing table for top = {}, a = {}'.format(stack[-1].root, a))
-            elif p.parsing_table.at[stack[-1].root.replace('\\$', '$'), a] !=\
-                    YACV_ACCEPT:
-                prod = p.parsing_table.at[stack[-1].root, a][0]
-                log.info(prod)
-                prod_text = '{} '.format(prod.lhs)
-                prod_text += '$\\rightarrow$' if manimce else '\\rightarrow'
-                if prod.rhs[0] == YACV_EPSILON:
-                    prod_text += ' $\\epsilon$' if manimce else ' \\epsilon'
-                else:
-                    prod_text += ' {}'.format(''.join(prod.rhs)\
-                            .replace('$', '\\$'))
-                new_status_mobject = Tex(prod_text)
-                new_status_mobject.scale(YACV_MANIM_STATUS_SCALE)
-                new_status_mobject.move_to(status_pos)
-                self.play(Transform(status_mobject, new_status_mobject))
-                self.play(ShowCreationThenDestructionAround(new_status_mobject))
-                self.remove(new_status_mobject)
-                stack[-1].prod_id = p.grammar.prods.index(prod)
-                desc_list = []
-                for symbol in prod.rhs:
-                    symbol = symbol.replace('$', '\\$')
-                    x = AbstractSyntaxTree(symbol)
-                    x.node_id = curr_node_id 
-                    curr_node_id += 1
-                    stack[-1].desc.append(x)
-                    desc_list.append(x)
-                popped_stack.append(stack.pop(-1))
-                if prod.rhs[0] != YACV_EPSILON:
-                    for i in range(len(desc_list)-1,-1,-1):
-                        stack.append(desc_list[i])
+        self.add(stack_mobject)
+        for step in steps:
+            action = trace[step]
+            self.apply_step(action)
+            if action[0] == 'expand':
+                log.info(p.grammar.prods[action[1]])
+            self.play_status(status_mobject, self.status_mobject(action), \
+                    wait=False)
             # Starting Animations
             all_anims = []
-            string_text = [YACV_MANIM_STRING_LEADER]
-            string_text.extend([prepare_text(x) for x in string])
-            string_text.append(']')
-            log.debug(string_text)
-            new_string_mobject = Tex(*string_text)
-            new_string_mobject.arrange(RIGHT, buff=0.25)
-            new_string_mobject[1].set_color(RED)
-            new_string_mobject.move_to(string_pos)
-            new_string_mobject.scale(YACV_MANIM_STRING_SCALE)
-            curr_stack_mobject = StackMobject(stack)
-            anim_s = transform_stacks(old_stack_mobject, curr_stack_mobject)
-            curr_mobject = GraphvizMobject(stack_to_graphviz([popped_stack[0]]\
-                    , p.grammar, self.colors))
+            new_string_mobject = self.string_mobject(self.remaining)
+            anim_s = stack_mobject.set_stack(self.stack)
+            curr_mobject = GraphvizMobject(stack_to_graphviz(\
+                    [self.popped_stack[0]], p.grammar, self.colors), \
+                    self.label_pool)
             if prev_mobject is not None:
                 anim_t = transform_graphviz_graphs(prev_mobject, curr_mobject)
             else:
@@ -140,117 +225,127 @@ class LL1ParsingVisualizer(Scene):
             all_anims.extend(anim_t)
             all_anims.extend(anim_s)
             all_anims.append(Transform(string_mobject, new_string_mobject))
-            self.play(*all_anims)
-            self.wait(1)
-            self.remove(old_stack_mobject)
+            self.play(*all_anims, run_time=self.run_time)
+            self.pause()
             self.remove(new_string_mobject)
             if prev_mobject is not None:
                 self.remove(prev_mobject)
-            old_stack_mobject = curr_stack_mobject
             prev_mobject = curr_mobject 
             # Ending Animations 
-            log.debug(popped_stack)
-        new_status_mobject = Tex('ACCEPT')
-        new_status_mobject.scale(YACV_MANIM_STATUS_SCALE)
-        new_status_mobject.move_to(status_pos)
-        new_status_mobject.set_color(YELLOW)
-        self.play(Transform(status_mobject, new_status_mobject))
-        self.play(ShowCreationThenDestructionAround(new_status_mobject))
-        self.wait(1)
-        self.remove(new_status_mobject)
+            log.debug(self.popped_stack)
+            self.step_done([action])
+        if steps.stop < len(trace):
+            return
+        new_status_mobject = self.status_tex('ACCEPT', YELLOW)
+        self.play_status(status_mobject, new_status_mobject)
+        self.step_done([('accept',)])
         return 
 
 
-class LRParsingVisualizer(Scene):
-    def setup(self, parser=None, string=None, colors=None, **kwargs):
-        if hasattr(self, 'grammar_setup_done') and self.grammar_setup_done:
-            super().setup(**kwargs)
-            return
-        self.parser = parser
-        if not parser.is_valid:
-            raise YACVError('Grammar is not valid for chosen parsing algorithm. Parsing is not continue')
-        if isinstance(string, str):
-            string = string.split(' ')
-            string = [x for x in string if x]
-        if string[-1] != '$':
-            string.append('$')
-        self.string = string
-        self.colors = colors
-        self.grammar_setup_done = True
-        super().setup(**kwargs)
+class LRParsingVisualizer(LRReplay, ParsingVisualizer):
+    def parser_valid(self, parser):
+        return parser.is_valid
+
+    def prod_text(self, prod):
+        if manimce:
+            prod_text = '{} $\\rightarrow$'.format(prod.lhs)
+        else:
+            prod_text = '{} \\rightarrow'.format(prod.lhs)
+        if prod.rhs[0] == YACV_EPSILON:
+            prod_text += ' $\\epsilon$' if manimce else ' \\epsilon'
+        else:
+            prod_text += ' {}'.format(' '.join(prod.rhs))
+        return prod_text
+
+    def status_mobject(self, action):
+        if action[0] == 'shift':
+            return self.status_text('SHIFT {}'.format(action[1]))
+        elif action[0] == 'reduce':
+            prod = self.parser.grammar.prods[action[1]]
+            return self.status_tex(self.prod_text(prod))
+        return self.status_tex('ACCEPT', YELLOW)
+
+    def status_chain(self, actions):
+        # Status listing every production of a chain of reductions
+        prods = self.parser.grammar.prods
+        texts = [self.status_tex(self.prod_text(prods[action[1]])) \
+                for action in actions]
+        if len(texts) == 1:
+            return texts[0]
+        ret = VGroup(*texts)
+        ret.arrange(DOWN, aligned_edge=LEFT)
+        ret.move_to(self.status_pos, aligned_edge=UP)
+        return ret
+
+    def chunk_status(self, actions):
+        # Status left on screen by a (coalesced) step
+        if actions[0][0] == 'shift' and len(actions) > 1:
+            return self.status_text('SHIFT {} TOKENS'.format(len(actions)))
+        if actions[0][0] == 'reduce' and self.coalesce:
+            return self.status_chain(actions)
+        return self.status_mobject(actions[0])
+
+    def step_cost(self, actions):
+        # (animations, pauses) played by `construct` for one step. Coalesced
+        # steps change the status together with the stack and the tree
+        if actions[0][0] == 'shift':
+            return (1, 1) if self.coalesce else (3, 2)
+        elif actions[0][0] == 'reduce':
+            return (2, 1) if self.coalesce else (5, 4)
+        return 3, 0
 
     def construct(self):
         p = self.parser 
         assert p is not None 
-        string = self.string 
         log = logging.getLogger('yacv')
-        stack = [0]
-        old_stack_mobject = None
+        trace = lr_parse_trace(p, self.string)
+        steps = self.steps(trace)
+        all_chunks = self.chunks(trace)
+        self.pace(trace, all_chunks)
+        # A scene starting inside a coalesced step starts at the next one,
+        # the scene before it plays the whole step
+        chunks = [(start, end) for start, end in all_chunks if start in steps]
+        first = chunks[0][0] if chunks else steps.stop
+        self.reset(self.string)
+        # Fast forward to the first step of this scene 
+        for action in trace[:first]:
+            self.apply_step(action)
+
+        stack_mobject = StackMobject(self.stack, self.label_pool)
         prev_mobject = None 
         curr_mobject = None 
-        curr_node_id = 0 # Assigning the node ids as we build the tree 
-        status_mobject  = Text('START')
-        status_mobject.scale(YACV_MANIM_STATUS_SCALE)
-        status_pos = 5.5*LEFT + 3*UP
-        string_text = [YACV_MANIM_STRING_LEADER]
-        string_text.extend([prepare_text(x) for x in string])
-        string_text.append(']')
-        log.debug(string_text)
-        string_mobject = Tex(*string_text)
-        string_mobject.arrange(RIGHT, buff=0.25)
-        string_pos = 0*LEFT + 3.5*DOWN
-        string_mobject.move_to(string_pos)
-        string_mobject[1].set_color(RED)
-        string_mobject.scale(YACV_MANIM_STRING_SCALE)
-        status_mobject.move_to(status_pos)
+        if first == 0:
+            status_mobject = self.status_text('START')
+        else:
+            # Same status the previous step ended with
+            previous = [x for x in all_chunks if x[1] == first][0]
+            status_mobject = self.chunk_status(trace[previous[0]:first])
+            prev_mobject = GraphvizMobject(stack_to_graphviz(self.stack, \
+                    p.grammar, self.colors), self.label_pool)
+            self.add(prev_mobject)
+        string_mobject = self.string_mobject(self.remaining)
         self.add(status_mobject)
         self.add(string_mobject)
-        while True:
-            top = stack[-1]
-            a = string[0]
-            entry = p.parsing_table.at[top, (YACV_ACTION, a)]
-            if old_stack_mobject is None:
-                old_stack_mobject = StackMobject(stack)
-                self.add(old_stack_mobject)
-            if entry == YACV_ERROR:
-                # TODO: Get better error messages here
-                raise ValueError('Parsing error. Got YACV_ERROR entry for top = {}, a = {}'.format(top, a))
-            if isinstance(entry, list):
-                # TODO: Can we implement some precedence here ?
-                # Like, if it's shift reduce conflict, user configures the 
-                # default action ?
-                # Shouldn't be difficult, I already have a provision for 
-                # preferred action in `LRAutomatonState`
-                entry = entry[0]
+        self.add(stack_mobject)
+        for start, end in chunks:
+            actions = trace[start:end]
+            action = actions[0]
             # Actual parsing logic starts 
-            if entry[0] == 's':
-                t = AbstractSyntaxTree(a)
-                t.node_id = curr_node_id 
-                curr_node_id += 1
-                stack.append(t)
-                stack.append(int(entry[1:]))
-                string.pop(0)
+            if action[0] == 'shift':
+                for action in actions:
+                    self.shift(action[1])
                 # Starting Animation 
-                new_status_mobject=Text('SHIFT {}'.format(int(entry[1:])))
-                new_status_mobject.move_to(status_pos)
-                new_status_mobject.scale(YACV_MANIM_STATUS_SCALE)
-                self.play(Transform(status_mobject, new_status_mobject))
-                self.play(ShowCreationThenDestructionAround(new_status_mobject))
-                self.wait(1)
-                self.remove(new_status_mobject)
+                new_status_mobject = self.chunk_status(actions)
                 all_anims = []
-                curr_stack_mobject = StackMobject(stack)
-                anim_s = transform_stacks(old_stack_mobject,curr_stack_mobject)
-                curr_mobject = GraphvizMobject(stack_to_graphviz(stack, \
-                            p.grammar, self.colors))
-                string_text = [YACV_MANIM_STRING_LEADER]
-                string_text.extend([prepare_text(x) for x in string])
-                string_text.append(']')
-                new_string_mobject = Tex(*string_text)
-                new_string_mobject.arrange(RIGHT, buff=0.25)
-                new_string_mobject[1].set_color(RED)
-                new_string_mobject.move_to(string_pos)
-                new_string_mobject.scale(YACV_MANIM_STRING_SCALE)
+                if self.coalesce:
+                    all_anims.append(Transform(status_mobject, \
+                            new_status_mobject))
+                else:
+                    self.play_status(status_mobject, new_status_mobject)
+                anim_s = stack_mobject.set_stack(self.stack)
+                curr_mobject = GraphvizMobject(stack_to_graphviz(self.stack, \
+                            p.grammar, self.colors), self.label_pool)
+                new_string_mobject = self.string_mobject(self.remaining)
                 if prev_mobject is not None:
                     anim_t = transform_graphviz_graphs(prev_mobject, \
                             curr_mobject)
@@ -259,131 +354,157 @@ class LRParsingVisualizer(Scene):
                 all_anims.extend(anim_s)
                 all_anims.extend(anim_t)
                 all_anims.append(Transform(string_mobject, new_string_mobject))
-                self.play(*all_anims)
-                self.wait(1)
-                self.remove(old_stack_mobject)
+                self.play(*all_anims, run_time=self.run_time)
+                self.pause()
                 self.remove(new_string_mobject)
                 if prev_mobject is not None:
                     self.remove(prev_mobject)
-                old_stack_mobject = curr_stack_mobject
                 prev_mobject = curr_mobject 
                 # Ending Animation 
-            elif entry[0] == 'r':
-                prod_id = int(entry[1:])
-                prod = p.grammar.prods[prod_id]
-                log.info(prod)
-                new_tree = AbstractSyntaxTree(prod.lhs)
-                new_tree.prod_id = prod_id 
-                new_tree.node_id = curr_node_id 
-                curr_node_id += 1
-                
+            elif action[0] == 'reduce':
+                prod = p.grammar.prods[action[1]]
                 # Starting animation 
                 # highlight 2 * len(prod.rhs) elements on the stack 
-                l = old_stack_mobject.stack_len
+                l = stack_mobject.stack_len
                 to_highlight = 2*len(prod.rhs) if l > 2*len(prod.rhs) else l 
-                keys = list(old_stack_mobject.elements.keys())
+                keys = list(stack_mobject.elements.keys())
                 anims = []
                 for i in keys[-to_highlight:]:
-                    anims.append(Indicate(old_stack_mobject.elements[i]))
-                self.play(*anims)
-                self.wait(1) 
-                
-                if manimce:
-                    prod_text = '{} $\\rightarrow$'.format(prod.lhs)
-                else:
-                    prod_text = '{} \\rightarrow'.format(prod.lhs)
-                if prod.rhs[0] == YACV_EPSILON:
-                    prod_text += ' $\\epsilon$' if manimce else ' \\epsilon'
-                else:
-                    prod_text += ' {}'.format(' '.join(prod.rhs))
-                new_status_mobject = Tex(prod_text)
-                new_status_mobject.move_to(status_pos)
-                new_status_mobject.scale(YACV_MANIM_STATUS_SCALE)
-                self.play(Transform(status_mobject, new_status_mobject))
-                self.play(ShowCreationThenDestructionAround(new_status_mobject))
-                self.wait(1)
-                self.remove(new_status_mobject)
-                # Ending animation
-
-                # I'm getting the popped list and then traversing it in 
-                # reverse direction again just so that memory references 
-                # are proper
-                # TODO: can this be optimized ?
-                popped_list = []
-                if prod.rhs[0] != YACV_EPSILON:
-                    for _ in range(len(prod.rhs)):
-                        if not stack:
-                            raise ValueError('Parsing Error: Stack prematurely empty')
-                        stack.pop(-1)
-                        if not stack:
-                            raise ValueError('Parsing Error: Stack prematurely empty')
-                        popped_list.append(stack.pop(-1))
+                    anims.append(Indicate(stack_mobject.elements[i]))
+                self.play(*anims, run_time=self.run_time)
+                all_anims = []
+                if self.coalesce:
+                    # Every production of the chain is listed in the status
+                    for action in actions:
+                        log.info(p.grammar.prods[action[1]])
+                        self.apply_step(action)
+                    all_anims.append(Transform(status_mobject, \
+                            self.chunk_status(actions)))
                 else:
-                    # Note here that we don't need to increment `curr_node_id`
-                    # This is because `epsilon` nodes are merged with their 
-                    # parents when converting AST to Graphviz
-                    new_tree.desc.append(AbstractSyntaxTree(YACV_EPSILON))
-                for i in range(len(popped_list)-1,-1,-1):
-                    new_tree.desc.append(popped_list[i])
+                    log.info(prod)
+                    self.pause()
+                    self.play_status(status_mobject, self.status_mobject(action))
+                    # Ending animation
+                    new_tree = self.reduce_pop(action[1])
+                    # Starting Animation 
+                    anims = stack_mobject.set_stack(self.stack)
+                    if anims:
+                        self.play(*anims, run_time=self.run_time)
+                    else:
+                        # Nothing is popped for epsilon productions
+                        self.wait(self.run_time)
+                    self.pause()
+                    # Ending Animation 
+                    self.reduce_push(new_tree, action[2])
                 # Starting Animation 
-                curr_stack_mobject = StackMobject(stack)
-                anims = transform_stacks(old_stack_mobject, curr_stack_mobject)
-                self.play(*anims)
-                self.wait(1)
-                old_stack_mobject = curr_stack_mobject
-                # Ending Animation 
-                new_top = stack[-1]
-                nonterminal = prod.lhs 
-                new_state = p.parsing_table.at[new_top, (YACV_GOTO, nonterminal)]
-                stack.append(new_tree)
-                if isinstance(new_state, list):
-                    new_state = new_state[0]
-                stack.append(int(new_state))
-                # Starting Animation 
-                all_anims = []
-                curr_stack_mobject = StackMobject(stack)
-                anim_s = transform_stacks(old_stack_mobject,curr_stack_mobject)
-                curr_mobject = GraphvizMobject(stack_to_graphviz(stack, \
-                        p.grammar, self.colors))
+                anim_s = stack_mobject.set_stack(self.stack)
+                curr_mobject = GraphvizMobject(stack_to_graphviz(self.stack, \
+                        p.grammar, self.colors), self.label_pool)
                 if prev_mobject == None:
                     anim_t = [ShowCreation(curr_mobject)]
                 else:
                     anim_t = transform_graphviz_graphs(prev_mobject, curr_mobject)
                 all_anims.extend(anim_s)
                 all_anims.extend(anim_t)
-                self.play(*all_anims)
-                self.wait(1)
-                self.remove(old_stack_mobject)
+                self.play(*all_anims, run_time=self.run_time)
+                self.pause()
                 self.remove(prev_mobject)
-                old_stack_mobject = curr_stack_mobject
                 prev_mobject = curr_mobject 
                 # Ending Animation 
-            elif entry == YACV_ACCEPT:
+            elif action[0] == 'accept':
                 prod = p.grammar.prods[0]
                 assert prod.rhs[-1] == '$' and len(prod.rhs) == 2
                 # Parsing successful 
                 # TODO: Log that parsing is successful 
-                new_status_mobject = Tex("ACCEPT")
-                new_status_mobject.move_to(status_pos)
-                new_status_mobject.set_color(YELLOW)
-                new_status_mobject.scale(YACV_MANIM_STATUS_SCALE)
-                self.play(Transform(status_mobject, new_status_mobject))
-                self.play(ShowCreationThenDestructionAround(new_status_mobject))
-                self.remove(new_status_mobject)
-                curr_mobject = GraphvizMobject(stack_to_graphviz(stack, \
-                        p.grammar, self.colors))
+                self.play_status(status_mobject, self.status_mobject(action), \
+                        wait=False)
+                curr_mobject = GraphvizMobject(stack_to_graphviz(self.stack, \
+                        p.grammar, self.colors), self.label_pool)
                 anims = transform_graphviz_graphs(prev_mobject, curr_mobject)
-                new_string_mobject = Tex(YACV_MANIM_STRING_LEADER, ']')
-                new_string_mobject.move_to(string_pos)
+                new_string_mobject = self.label_pool.tex(
+                        YACV_MANIM_STRING_LEADER, ']')
+                new_string_mobject.move_to(self.string_pos)
                 new_string_mobject.scale(YACV_MANIM_STRING_SCALE)
                 anims.append(Transform(string_mobject, new_string_mobject))
                 anims.append(FadeOut(string_mobject))
-                self.play(*anims)
-                break 
-            else:
-                raise ValueError('Unknown error while parsing')
+                self.play(*anims, run_time=self.run_time)
+            self.step_done(actions)
         return 
 
+def render_segment(job):
+    # Renders steps [start, end) of the parse into its own movie file and 
+    # returns the path to it. Runs inside a worker process
+    algo, parser, string, colors, save_dir, fname, quality, start, end, \
+            coalesce, time_budget = job
+    if not logging.getLogger('yacv').handlers:
+        setup_logger()
+    manim_config = get_manim_config(save_dir, fname, quality)
+    if manimce:
+        from manim import config 
+        for k, v in manim_config.items():
+            config[k] = v
+        kwargs = {}
+    else:
+        manim_config['file_writer_config']['open_file_upon_completion'] = False
+        manim_config['file_writer_config']['show_file_location_upon_completion'] = False
+        kwargs = manim_config 
+    vis = LL1ParsingVisualizer(**kwargs) if algo == 'll1' else \
+            LRParsingVisualizer(**kwargs)
+    vis.setup(parser, list(string), colors, start_step=start, end_step=end, \
+            coalesce=coalesce, time_budget=time_budget)
+    if manimce:
+        vis.render()
+        return vis.renderer.file_writer.movie_file_path
+    else:
+        vis.run()
+        return vis.file_writer.get_movie_file_path()
+
+def concat_movies(paths, output):
+    # Lossless concatenation, streams are copied without re-encoding
+    import subprocess
+    import tempfile
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+        for path in paths:
+            f.write("file '{}'\n".format(os.path.abspath(path).replace("'", "'\\''")))
+        list_file = f.name
+    try:
+        subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', \
+                '-safe', '0', '-i', list_file, '-c', 'copy', output], \
+                check=True)
+    finally:
+        os.remove(list_file)
+    return output
+
+def render_segments(algo, parser, string, colors, save_dir, fname, \
+        quality='480p', workers=None, segments=None, coalesce=False, \
+        time_budget=None):
+    # Splits the parse into `segments` independent scenes at step boundaries,
+    # renders them in a process pool and concatenates the partial movies.
+    # Coalesced LR steps are never split between two segments
+    from concurrent.futures import ProcessPoolExecutor
+    log = logging.getLogger('yacv')
+    workers = workers or os.cpu_count() or 1
+    trace = ll1_parse_trace(parser, string) if algo == 'll1' else \
+            lr_parse_trace(parser, string)
+    starts = [x[0] for x in coalesce_trace(trace)] if coalesce and \
+            algo != 'll1' else list(range(len(trace)))
+    segments = min(segments or workers, len(starts))
+    bounds = [starts[round(i * len(starts) / segments)] \
+            for i in range(segments)] + [len(trace)]
+    jobs = []
+    for i in range(segments):
+        jobs.append((algo, parser, list(string), colors, save_dir, \
+                '{}-part{:04d}'.format(fname, i), quality, bounds[i], \
+                bounds[i+1], coalesce, time_budget))
+    log.info('Rendering {} steps in {} segments with {} workers'.format(
+        len(trace), segments, workers))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        paths = list(pool.map(render_segment, jobs))
+    output = os.path.join(save_dir, fname + '.mp4')
+    concat_movies(paths, output)
+    log.info('Parsing visualization written to {}'.format(output))
+    return output
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
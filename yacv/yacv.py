@@ -1,21 +1,21 @@
-try:
-    from manimlib import *
-    manimce = False
-except:
-    from manim import *
-    manimce = True
 import logging
 import os 
 import sys 
 from copy import deepcopy 
 import yaml
 from yacv.grammar import Grammar
-from yacv.utils import setup_logger, get_manim_config
+from yacv.utils import YACVError, setup_logger, get_manim_config
+from yacv.layoutcache import configure_layout_cache, set_layout_engine
+from yacv.constants import YACV_LAYOUT_CACHE_DIR, YACV_LAYOUT_ENGINE, \
+        YACV_AUTOMATON_PAGE_SIZE, manimce
+from yacv.keyframes import export_keyframes
+from yacv.tableexport import parsing_tables, save_parsing_tables
 from yacv.ll1 import LL1Parser
 from yacv.lr import LR0Parser, SLR1Parser, LALR1Parser, LR1Parser
-from yacv.vis import LL1ParsingVisualizer, LRParsingVisualizer
+from yacv.earley import EarleyParser
 parser_map = {
     'll1'  : LL1Parser,
+    'earley': EarleyParser,
     'lr0'  : LR0Parser,
     'slr1' : SLR1Parser,
     'lalr1': LALR1Parser,
@@ -27,74 +27,147 @@ HELP_MESSAGE = """-------------------------------------
 yacv: Yet Another Compiler Visualizer
 -------------------------------------
 usage: yacv <path/to/config/file>
+       yacv serve [--socket PATH | --port PORT] [--cache-size N]
+                  [--grammar-root DIR] [--bypass-units [--lazy-units]]
+       yacv bench [--null] [--repeat N] [--steps] [--json FILE] <configs>
+       yacv build [--out DIR] [--jobs N] [--force] [--dry-run] <dir>
 
 -------------------------------------
 Project URL : https://github.com/ashutoshbsathe/yacv
 Config spec : https://ashutoshbsathe.github.io/yacv/config 
 """
-def parse_args():
-    class Namespace(object):
-        def __init__(self, **kwargs):
-            choices = {
-                'parsing_algo': ['ll1', 'lr0', 'slr1', 'lr1', 'lalr1'],
-                'manim_video_quality': ['480p', '720p', '1080p', '1440p', '2160p']
-            }
-            store_true = ['vis_tree', 'vis_parsing', 'vis_automaton', 'parsing_table']
-            for k, v in kwargs.items():
-                key = k.replace('-', '_')
-                if key in choices and v not in choices[key]:
-                    raise ValueError('Incorrect config value. Attribute {} must be one out of {}, received "{}"'.format(k, choices[key], v))
-                if key in store_true:
-                    v = bool(v)
-                self.__dict__[k.replace('-','_')] = v
-            for k in store_true:
-                if not hasattr(self, k):
-                    self.__dict__[k] = False 
-            if not hasattr(self, 'manim_video_quality'):
-                self.manim_video_quality = '480p'
-            if not hasattr(self, 'grammar') or not hasattr(self, 'string'):
-                raise ValueError('Please specify both grammar and string in config')
+class Namespace(object):
+    def __init__(self, **kwargs):
+        choices = {
+            'parsing_algo': ['ll1', 'lr0', 'slr1', 'lr1', 'lalr1', 'earley'],
+            'manim_video_quality': ['480p', '720p', '1080p', '1440p', '2160p'],
+            'layout_engine': ['dot', 'tidy'],
+            'automaton_pages': ['scc', 'depth'],
+            'parsing_table_format': ['csv', 'npz', 'npy', 'parquet']
+        }
+        store_true = ['vis_tree', 'vis_parsing', 'vis_automaton', 'parsing_table', 'vis_keyframes', 'keyframes_svg', 'reduce_grammar', 'manim_coalesce', 'lr_bypass_units', 'lr_lazy_units']
+        for k, v in kwargs.items():
+            key = k.replace('-', '_')
+            if key in choices and v not in choices[key]:
+                raise ValueError('Incorrect config value. Attribute {} must be one out of {}, received "{}"'.format(k, choices[key], v))
+            if key in store_true:
+                v = bool(v)
+            self.__dict__[k.replace('-','_')] = v
+        for k in store_true:
+            if not hasattr(self, k):
+                self.__dict__[k] = False 
+        if not hasattr(self, 'manim_video_quality'):
+            self.manim_video_quality = '480p'
+        if not hasattr(self, 'manim_workers'):
+            self.manim_workers = 1
+        if not hasattr(self, 'manim_segments'):
+            self.manim_segments = None
+        if not hasattr(self, 'manim_time_budget'):
+            self.manim_time_budget = None
+        if not hasattr(self, 'layout_cache'):
+            self.layout_cache = True
+        if not hasattr(self, 'layout_cache_dir'):
+            self.layout_cache_dir = YACV_LAYOUT_CACHE_DIR
+        if not hasattr(self, 'layout_engine'):
+            self.layout_engine = YACV_LAYOUT_ENGINE
+        if not hasattr(self, 'parsing_table_format'):
+            self.parsing_table_format = 'csv'
+        if not hasattr(self, 'automaton_states'):
+            self.automaton_states = None
+        if not hasattr(self, 'automaton_hops'):
+            self.automaton_hops = 1
+        if not hasattr(self, 'automaton_pages'):
+            self.automaton_pages = None
+        if not hasattr(self, 'automaton_page_size'):
+            self.automaton_page_size = YACV_AUTOMATON_PAGE_SIZE
+        if not hasattr(self, 'automaton_kernel_only'):
+            self.automaton_kernel_only = None
+        if not hasattr(self, 'automaton_layout'):
+            self.automaton_layout = None
+        if not hasattr(self, 'lr_workers'):
+            self.lr_workers = 1
+        if not hasattr(self, 'grammar') or not hasattr(self, 'string'):
+            raise ValueError('Please specify both grammar and string in config')
+
+    def __str__(self):
+        ret = 'Namespace(\n'
+        for k, v in self.__dict__.items():
+            ret += '\t{} : {}\n'.format(k, v)
+        ret += ')\n'
+        return ret
+
+def load_config(fname):
+    # Options of a YAML config file, with the defaults filled in. A grammar
+    # path that doesn't exist from the working directory is taken relative
+    # to the config file
+    with open(fname) as f:
+        args = Namespace(**yaml.safe_load(f.read()))
+    if args.grammar and not os.path.exists(args.grammar):
+        candidate = os.path.join(os.path.dirname(fname), args.grammar)
+        if os.path.exists(candidate):
+            args.grammar = candidate
+    return args
 
-        def __str__(self):
-            ret = 'Namespace(\n'
-            for k, v in self.__dict__.items():
-                ret += '\t{} : {}\n'.format(k, v)
-            ret += ')\n'
-            return ret
+def parse_args():
     if len(sys.argv) != 2:
         print(HELP_MESSAGE, file=sys.stderr)
         sys.exit(1)
-    args = yaml.safe_load(open(sys.argv[1]).read())
-    return Namespace(**args)
+    return load_config(sys.argv[1])
 
-def main():
-    global ROOT_DIR
-    setup_logger()
+def run(args, out_dir='.'):
+    # Everything a config asks for, outputs go to `out_dir`/yacv_<grammar>
     log = logging.getLogger('yacv')
-    args = parse_args()
     colors = args.colors if hasattr(args, 'colors') else None
     if not args.grammar or not args.string:
-        log.fatal('Please provide both grammar and string') 
-        exit(1)
+        raise YACVError('Please provide both grammar and string')
     if args.parsing_algo == 'll1' and args.vis_automaton:
-        log.fatal('LR state automaton does not exist for LL(1) parsing')
-        exit(1)
+        raise YACVError('LR state automaton does not exist for LL(1) parsing')
+    if args.parsing_algo == 'earley' and (args.vis_automaton or \
+            args.parsing_table or args.vis_parsing or args.vis_keyframes):
+        raise YACVError('Earley parsing has no automaton or parsing table, ' \
+                'only vis-tree is supported')
     log.info('Using {} parsing algorithm'.format(
         args.parsing_algo.upper()))
-    p = parser_map[args.parsing_algo](args.grammar)
+    configure_layout_cache(args.layout_cache_dir, \
+            enabled=bool(args.layout_cache))
+    set_layout_engine(args.layout_engine)
+    if args.parsing_algo in ['ll1', 'earley']:
+        p = parser_map[args.parsing_algo](args.grammar, args.reduce_grammar)
+    else:
+        p = parser_map[args.parsing_algo](args.grammar, args.reduce_grammar, \
+                args.lr_workers, args.lr_bypass_units, args.lr_lazy_units)
 
     # Prepare the main directories
     grammar = ''.join(args.grammar.split('/')[-1].split('.')[:-1])
-    ROOT_DIR = ROOT_DIR.format(grammar=grammar)
-    folder = os.path.join(ROOT_DIR, args.parsing_algo)
+    root = os.path.join(out_dir, ROOT_DIR.format(grammar=grammar))
+    folder = os.path.join(root, args.parsing_algo)
     os.makedirs(folder, exist_ok=True)
     if args.parsing_table:
-        fname = '{}-parsing-table.csv'.format(args.parsing_algo)
-        p.parsing_table.to_csv(os.path.join(folder, fname))
-        log.info('Parsing table exported to {}'.format(os.path.join(folder, fname)))
-    if args.vis_automaton:
+        fmt = args.parsing_table_format
+        fname = '{}-parsing-table'.format(args.parsing_algo)
+        if fmt != 'npy':
+            fname += '.' + fmt
+        save_parsing_tables(parsing_tables(p, args.parsing_algo), \
+                os.path.join(folder, fname), fmt)
+    if args.vis_automaton and args.automaton_pages:
+        pages = p.visualize_automaton_pages(args.automaton_pages, \
+                args.automaton_page_size, args.automaton_kernel_only, \
+                args.automaton_layout)
+        for i, G in enumerate(pages):
+            fname = '{}-state-automaton-page-{}.pdf'.format(args.parsing_algo, i)
+            G.draw(os.path.join(folder, fname))
+            log.info('LR automaton page {} visualized at {}'.format(i, \
+                os.path.join(folder, fname)))
+    elif args.vis_automaton:
         fname = '{}-state-automaton.pdf'.format(args.parsing_algo)
-        G = p.visualize_automaton()
+        states = None
+        if args.automaton_states is not None:
+            states = args.automaton_states
+            if not isinstance(states, list):
+                states = [states]
+            states = p.automaton_neighborhood(states, args.automaton_hops)
+        G = p.visualize_automaton(states, args.automaton_kernel_only, \
+                args.automaton_layout)
         G.draw(os.path.join(folder, fname))
         log.info('LR automaton visualized at {}'.format(os.path.join(folder, fname)))
     string = args.string.split(' ')
@@ -107,14 +180,31 @@ def main():
         string_folder = os.path.join(folder, string_folder)
         os.makedirs(string_folder, exist_ok=True)
         fname = 'abstractsyntaxtree.pdf'
-        G = p.visualize_syntaxtree(deepcopy(string), colors)
-        G.draw(os.path.join(string_folder, fname))
-        log.info('Syntax tree visualized to {}'.format(os.path.join(folder, fname)))
+        p.export_syntaxtree(deepcopy(string), \
+                os.path.join(string_folder, fname), colors, \
+                layout=args.layout_engine)
+        log.info('Syntax tree visualized to {}'.format(os.path.join(string_folder, fname)))
+    if args.vis_keyframes:
+        string_folder = ''.join(string)
+        string_folder = os.path.join(folder, string_folder)
+        export_keyframes(args.parsing_algo, p, deepcopy(string), \
+                os.path.join(string_folder, 'keyframes'), colors, \
+                args.keyframes_svg)
     if args.vis_parsing:
+        # manim is imported only when it's actually needed
+        from yacv.vis import LL1ParsingVisualizer, LRParsingVisualizer, \
+                render_segments
         string_folder = ''.join(string)
         string_folder = os.path.join(folder, string_folder)
         os.makedirs(string_folder, exist_ok=True)
         fname = 'ManimParsingVisualization'
+        if args.manim_workers != 1:
+            render_segments(args.parsing_algo, p, deepcopy(string), colors, \
+                    string_folder, fname, args.manim_video_quality, \
+                    args.manim_workers, args.manim_segments, \
+                    args.manim_coalesce, args.manim_time_budget)
+            log.info('YACV finished')
+            return
         manim_config = get_manim_config(string_folder, fname, \
                 args.manim_video_quality)
         if manimce:
@@ -126,7 +216,9 @@ def main():
             kwargs = manim_config 
         vis = LL1ParsingVisualizer(**kwargs) if args.parsing_algo == \
                 'll1' else LRParsingVisualizer(**kwargs)
-        vis.setup(p, deepcopy(string), colors)
+        vis.setup(p, deepcopy(string), colors, \
+                coalesce=args.manim_coalesce, \
+                time_budget=args.manim_time_budget)
         if manimce:
             vis.render()
         else:
@@ -134,5 +226,27 @@ def main():
     log.info('YACV finished')
     return 
 
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        from yacv.server import serve_main
+        serve_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        from yacv.bench import bench_main
+        bench_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'build':
+        from yacv.build import build_main
+        build_main(sys.argv[2:])
+        return
+    setup_logger()
+    log = logging.getLogger('yacv')
+    args = parse_args()
+    try:
+        run(args)
+    except YACVError as e:
+        log.fatal(str(e))
+        exit(1)
+
 if __name__ == '__main__':
     main()